@@ -0,0 +1,52 @@
+"""Measures MorningStar page parsing throughput on the bundled Pharmaxis
+fixture pages.
+
+Usage: python -m benchmarks.bench_morningstar [iterations]
+"""
+import os
+import sys
+import time
+from stockrank.scrapers.morningstar import parse_balancesheet, \
+    parse_historicals
+
+ASSETS = os.path.join(os.path.dirname(__file__), '..', 'tests', 'assets')
+
+
+def _read(filename):
+    with open(os.path.join(ASSETS, filename)) as f:
+        return f.read()
+
+
+def load_fixtures():
+    """Returns the (historicals, balance sheet) fixture pages for Pharmaxis.
+    """
+    return (_read('Pharmaxis Ltd - Company Historicals.html'),
+            _read('Pharmaxis Ltd - Balance Sheet.html'))
+
+
+def parse_pages(historicals, balancesheet, iterations):
+    """Parses both pages 'iterations' times.
+    """
+    for _ in range(iterations):
+        parse_historicals(historicals)
+        parse_balancesheet(balancesheet)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    historicals, balancesheet = load_fixtures()
+    size = len(historicals.encode('utf-8')) + len(balancesheet.encode('utf-8'))
+
+    start = time.perf_counter()
+    parse_pages(historicals, balancesheet, iterations)
+    elapsed = time.perf_counter() - start
+
+    print('%d stocks (%d pages) in %.3fs'
+          % (iterations, iterations * 2, elapsed))
+    print('%.1f stocks/s, %.1f MB/s' % (iterations / elapsed,
+                                        iterations * size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
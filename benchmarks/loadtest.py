@@ -0,0 +1,189 @@
+"""Load-tests the download path, StockRank.download(), against the stand-in
+server of benchmarks.standin, so scraper performance can be measured
+offline. Reports stocks and requests per second, the retries and failures
+seen by the scraper, and the responses sent by the server, and writes them as
+JSON if asked, so results can be compared across commits.
+
+Usage: python -m benchmarks.loadtest [--symbols 500] [--workers 8]
+                                     [--requests-per-second 100]
+                                     [--latency 0.05] [--latency-sigma 0.5]
+                                     [--error-rate 0.01]
+                                     [--throttle-rate 0.01]
+                                     [--rate-limit 0] [--output results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from benchmarks.standin import StandInServer
+from benchmarks.suite import _commit
+from stockrank.metrics import metrics
+from stockrank.scrapers.executor import request_executor
+from stockrank.stockrank import StockRank
+
+CONFIG = """[Credentials]
+morningstar_username = loadtest
+morningstar_password = {password}
+morningstar_cookie_path =
+
+[Application]
+database_path = {database_path}
+
+[Scraper]
+workers = {workers}
+requests_per_second = {requests_per_second}
+burst = {workers}
+parse_processes = {parse_processes}
+initial_concurrency = {workers}
+
+[Sources]
+google_url = {url}
+asx_url = {url}
+morningstar_url = {url}
+
+[Cache]
+path =
+
+[Archive]
+path =
+
+[Metrics]
+json_path =
+prometheus_path =
+"""
+
+
+def _counter_total(name):
+    return sum(counter['value'] for counter in metrics.to_dict()['counters']
+               if counter['name'] == name)
+
+
+def run(symbols=500, workers=8, requests_per_second=100.0,
+        parse_processes=0, **server_settings):
+    """Downloads every stock listed by a new stand-in server, and returns a
+    dict of the results. A download aborted by an error is reported in the
+    results' 'error'.
+
+    Arguments:
+    symbols -- Number of stocks the server lists.
+    workers, requests_per_second, parse_processes -- The [Scraper] settings
+        of the download. Every source is on the server's host, so they share
+        the rate limit.
+    server_settings -- Passed to StandInServer, eg latency or error_rate.
+    """
+    server = StandInServer(symbols=symbols, **server_settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    workdir = tempfile.mkdtemp()
+    config_path = os.path.join(workdir, 'config.ini')
+
+    with open(config_path, 'w') as f:
+        f.write(CONFIG.format(password=server.password,
+                              database_path=os.path.join(workdir,
+                                                         'stocks.db'),
+                              workers=workers,
+                              requests_per_second=requests_per_second,
+                              parse_processes=parse_processes,
+                              url=server.url))
+
+    # the scrapers' state is shared by the process, so start afresh
+    metrics.reset()
+    request_executor.reset()
+    error = None
+
+    try:
+        stockrank = StockRank(config_path)
+        start = time.perf_counter()
+
+        try:
+            stockrank.download()
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+
+        elapsed = time.perf_counter() - start
+        stocks = len(stockrank._db.get_stock_profiles())
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workdir)
+
+    requests = _counter_total('requests')
+    return {
+        'commit': _commit(),
+        'settings': dict(server_settings, symbols=symbols, workers=workers,
+                         requests_per_second=requests_per_second),
+        'seconds': elapsed,
+        'stocks': stocks,
+        'stocks_per_second': stocks / elapsed,
+        'requests': requests,
+        'requests_per_second': requests / elapsed,
+        'retries': _counter_total('retries'),
+        'failures': _counter_total('failures'),
+        'responses': server.stats(),
+        'error': error,
+    }
+
+
+def report(results):
+    """Returns a summary of a load test's results, for printing.
+    """
+    lines = ['%d stocks in %.2fs: %.1f stocks/s, %.1f requests/s'
+             % (results['stocks'], results['seconds'],
+                results['stocks_per_second'], results['requests_per_second']),
+             '%d requests, %d retries, %d failures'
+             % (results['requests'], results['retries'],
+                results['failures'])]
+
+    for kind, statuses in sorted(results['responses'].items()):
+        lines.append('  %-20s %s' % (kind, ', '.join(
+            '%s: %d' % (status, count)
+            for status, count in sorted(statuses.items()))))
+
+    if results['error']:
+        lines.append('download aborted by %s' % results['error'])
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=500,
+                        help='number of stocks listed by the server')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests-per-second', type=float, default=100.0)
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='0 means one per core')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='median seconds per response')
+    parser.add_argument('--latency-sigma', type=float, default=0.5,
+                        help='standard deviation of the log of latencies')
+    parser.add_argument('--error-rate', type=float, default=0.01,
+                        help='fraction of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.01,
+                        help='fraction of requests answered with a 429')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="server's requests per second; 0 for no limit")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None,
+                        help='file to write the results to, as JSON')
+    args = parser.parse_args()
+
+    results = run(args.symbols, args.workers, args.requests_per_second,
+                  args.parse_processes, latency=args.latency,
+                  latency_sigma=args.latency_sigma,
+                  error_rate=args.error_rate,
+                  throttle_rate=args.throttle_rate,
+                  rate_limit=args.rate_limit, seed=args.seed)
+    print(report(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""A local stand-in for the sites we download from, so the scrapers can be
+load-tested offline (see benchmarks.loadtest). For a universe of synthetic
+stocks, it serves:
+
+    POST /Security/Login -- MorningStar's login form, which redirects to '/'
+        with a session cookie, given the right password.
+    GET /Stocks/BalanceSheet/<symbol>
+    GET /Stocks/CompanyHistoricals/<symbol> -- MorningStar's pages, copied
+        from the bundled fixtures. Without a session cookie, they redirect to
+        the login form.
+    GET /finance?q=... -- Google's stock screener, as JSON, listing the
+        stocks above the query's market cap.
+    GET /asx/research/ASXListedCompanies.csv -- the ASX's list of companies
+        and their sectors.
+
+Every response is delayed by a latency drawn from a log-normal distribution.
+At the configured rates, requests for pages and lists (but not logins) are
+instead answered with a '500 Internal Server Error' or a '429 Too Many
+Requests'. Requests beyond the server's rate limit, if it has one, get a 429
+with a Retry-After header too.
+"""
+import collections
+import csv
+import io
+import itertools
+import json
+import math
+import os
+import random
+import re
+import string
+import threading
+import time
+import urllib.parse
+import uuid
+import http.cookies
+import http.server
+from benchmarks.bench_morningstar import ASSETS
+from benchmarks.suite import SECTORS
+
+LOGIN_PATH = '/Security/Login'
+GOOGLE_PATH = '/finance'
+ASX_PATH = '/asx/research/ASXListedCompanies.csv'
+
+# fixture page pairs, as (historicals, balance sheet) file names; stocks take
+# turns to be served each pair
+FIXTURES = [('%s - Company Historicals.html' % name,
+             '%s - Balance Sheet.html' % name)
+            for name in ('Pharmaxis Ltd', 'The PAS Group Limited')]
+
+# sectors of synthetic stocks. some are screened out by the scraper, as real
+# ones would be
+STANDIN_SECTORS = SECTORS + ['Banks', 'Utilities']
+
+LOGIN_FORM = ('<html><head><title>Login</title></head><body>'
+              '<form method="post" action="%s">'
+              '<input name="UserName"><input name="Password" type="password">'
+              '</form></body></html>' % LOGIN_PATH)
+
+_MARKET_CAP_QUERY = re.compile(r'market_cap\s*>=\s*(\d+)')
+
+# the kinds of request which may fail
+FALLIBLE = ('balancesheet', 'companyhistoricals', 'google', 'asx')
+
+StandInStock = collections.namedtuple(
+    'StandInStock', ['symbol', 'title', 'sector', 'market_cap', 'pages'])
+
+
+def synthetic_symbols(count):
+    """Returns 'count' distinct ASX-style symbols: 'AAA', 'AAB', and so on,
+    then four letter symbols once the three letter ones run out.
+    """
+    symbols = []
+
+    for length in itertools.count(3):
+        for letters in itertools.product(string.ascii_uppercase,
+                                         repeat=length):
+            if len(symbols) == count:
+                return symbols
+
+            symbols.append(''.join(letters))
+
+
+def synthetic_stocks(count, seed=0):
+    """Returns a list of 'count' randomly generated StandInStocks, worth
+    between $10M and $5,000M.
+    """
+    rand = random.Random(seed)
+    return [StandInStock(symbol, '%s Synthetic Ltd' % symbol,
+                         rand.choice(STANDIN_SECTORS),
+                         rand.randint(10, 5000) * 1000000,
+                         i % len(FIXTURES))
+            for i, symbol in enumerate(synthetic_symbols(count))]
+
+
+def _read(filename):
+    with open(os.path.join(ASSETS, filename)) as f:
+        return f.read()
+
+
+def _google_json(stocks, min_market_cap):
+    return json.dumps({
+        'num_company_results': str(len(stocks)),
+        'searchresults': [
+            {'ticker': stock.symbol, 'title': stock.title,
+             'columns': [{'field': 'MarketCap',
+                          'value': '%dM' % (stock.market_cap // 1000000)}]}
+            for stock in stocks if stock.market_cap >= min_market_cap],
+    })
+
+
+def _asx_csv(stocks):
+    text = io.StringIO()
+    text.write('ASX listed companies as at %s\r\n\r\n' % time.ctime())
+    writer = csv.writer(text)
+    writer.writerow(['Company name', 'ASX code', 'GICS industry group'])
+    writer.writerows([stock.title.upper(), stock.symbol, stock.sector]
+                     for stock in stocks)
+    return text.getvalue()
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+
+    # keep connections open between requests, as the real sites do
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body=b'', content_type='text/html',
+              headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        # before the client can see the response
+        self.server.record(self._kind, status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in headers:
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, location, headers=()):
+        self._send(302, headers=(('Location', location),) + tuple(headers))
+
+    def _logged_in(self):
+        cookies = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        return 'auth' in cookies and \
+            self.server.valid_session(cookies['auth'].value)
+
+    def _route(self, method):
+        """Returns the kind of request this is, and the function answering
+        it.
+        """
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(x) for x in url.path.split('/') if x]
+
+        if url.path.rstrip('/') == LOGIN_PATH:
+            if method == 'POST':
+                return 'login', self._login
+            return 'login', lambda: self._send(200, LOGIN_FORM)
+        if len(parts) == 3 and parts[0] == 'Stocks' and \
+                parts[1] in ('BalanceSheet', 'CompanyHistoricals'):
+            return parts[1].lower(), lambda: self._page(parts[1], parts[2])
+        if url.path == GOOGLE_PATH:
+            return 'google', lambda: self._google(url.query)
+        if url.path == ASX_PATH:
+            return 'asx', lambda: self._send(
+                200, self.server.asx_csv, 'text/csv')
+        if url.path == '/':
+            return 'home', lambda: self._send(200, '<html></html>')
+
+        return 'other', lambda: self._send(404, 'not found', 'text/plain')
+
+    def _handle(self, method):
+        self._kind, answer = self._route(method)
+        # the body must be read even if we don't answer it, for the next
+        # request on the connection
+        length = int(self.headers.get('Content-Length') or 0)
+        self._body = self.rfile.read(length) if length else b''
+
+        time.sleep(self.server.latency())
+        fault = self.server.fault() if self._kind in FALLIBLE else None
+
+        if fault is None:
+            answer()
+        else:
+            status, retry_after = fault
+            headers = () if retry_after is None else \
+                (('Retry-After', str(retry_after)),)
+            self._send(status, 'try again later', 'text/plain', headers)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _login(self):
+        form = urllib.parse.parse_qs(self._body.decode('utf-8'))
+
+        if form.get('Password', [''])[0] != self.server.password:
+            # a failed login shows the login form again
+            self._send(200, LOGIN_FORM)
+            return
+
+        self._redirect('/', [('Set-Cookie', 'auth=%s; Path=/'
+                              % self.server.new_session())])
+
+    def _page(self, page_type, symbol):
+        stock = self.server.stocks.get(symbol.upper())
+
+        if not self._logged_in():
+            self._redirect('%s?ReturnUrl=%s' % (
+                LOGIN_PATH, urllib.parse.quote(self.path, safe='')))
+        elif stock is None:
+            self._send(404, 'unknown symbol', 'text/plain')
+        else:
+            historicals, balancesheet = self.server.pages[stock.pages]
+            self._send(200, historicals if page_type == 'CompanyHistoricals'
+                       else balancesheet)
+
+    def _google(self, query):
+        match = _MARKET_CAP_QUERY.search(
+            urllib.parse.parse_qs(query).get('q', [''])[0])
+        min_market_cap = int(match.group(1)) if match else 0
+        self._send(200, _google_json(self.server.stocks.values(),
+                                     min_market_cap), 'application/json')
+
+    def log_message(self, format, *args):
+        # a load test sends thousands of requests
+        pass
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """A local HTTP server standing in for MorningStar, Google and the ASX;
+    see the module's docstring. Each request is answered by its own thread,
+    so slow responses overlap as they would from the real sites.
+    """
+    daemon_threads = True
+    # don't refuse connections when many workers connect at once
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), symbols=1000, latency=0.05,
+                 latency_sigma=0.5, error_rate=0.0, throttle_rate=0.0,
+                 rate_limit=0.0, burst=10, retry_after=1,
+                 password='password', seed=0):
+        """Arguments:
+        address -- A (host, port) tuple to listen on; port 0 picks a free
+                   port. See url.
+        symbols -- Number of synthetic stocks listed.
+        latency -- Median seconds taken to answer a request.
+        latency_sigma -- Spread of the latencies: the standard deviation of
+                         their logarithm. 0 means every request takes the
+                         median.
+        error_rate -- Fraction of requests answered with a 500.
+        throttle_rate -- Fraction of requests answered with a 429.
+        rate_limit -- Requests per second answered, in bursts of up to
+                      'burst' requests, before the rest get 429s. 0 means
+                      no limit.
+        retry_after -- Seconds in the Retry-After header of 429s.
+        password -- Password accepted by the login form, for any user name.
+        seed -- Seed of the stocks, latencies and faults.
+        """
+        super().__init__(address, _StandInHandler)
+        self.stocks = {stock.symbol: stock
+                       for stock in synthetic_stocks(symbols, seed)}
+        self.pages = [(_read(historicals), _read(balancesheet))
+                      for historicals, balancesheet in FIXTURES]
+        self.asx_csv = _asx_csv(self.stocks.values())
+        self.password = password
+
+        self._latency = latency
+        self._latency_sigma = latency_sigma
+        self._error_rate = error_rate
+        self._throttle_rate = throttle_rate
+        self._rate_limit = rate_limit
+        self._burst = burst
+        self._retry_after = retry_after
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._sessions = set()
+        self._responses = collections.Counter()
+
+    @property
+    def url(self):
+        """The root URL of the server, eg 'http://127.0.0.1:8081', for the
+        [Sources] settings.
+        """
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def latency(self):
+        """Returns the seconds the next response is delayed by.
+        """
+        with self._lock:
+            return self._latency * math.exp(
+                self._random.gauss(0, self._latency_sigma))
+
+    def _admit(self):
+        """Takes a token from the rate limit's bucket, and returns 0, or the
+        seconds until there'll be one if it's empty. Must be called with the
+        lock held.
+        """
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens +
+                           (now - self._updated) * self._rate_limit)
+        self._updated = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+
+        return (1 - self._tokens) / self._rate_limit
+
+    def fault(self):
+        """Returns a tuple of (status, Retry-After seconds or None) if the
+        next request should fail, otherwise None.
+        """
+        with self._lock:
+            if self._rate_limit:
+                wait = self._admit()
+
+                if wait:
+                    return 429, max(1, math.ceil(wait))
+
+            draw = self._random.random()
+
+            if draw < self._error_rate:
+                return 500, None
+            if draw < self._error_rate + self._throttle_rate:
+                return 429, self._retry_after
+
+        return None
+
+    def new_session(self):
+        """Returns the token of a new login session.
+        """
+        token = uuid.uuid4().hex
+
+        with self._lock:
+            self._sessions.add(token)
+
+        return token
+
+    def valid_session(self, token):
+        with self._lock:
+            return token in self._sessions
+
+    def record(self, kind, status):
+        with self._lock:
+            self._responses[kind, status] += 1
+
+    def stats(self):
+        """Returns the responses sent so far, as a dict mapping each kind of
+        request (eg 'balancesheet', 'google') to a dict mapping each status
+        to the number of responses with it.
+        """
+        stats = {}
+
+        with self._lock:
+            for (kind, status), count in sorted(self._responses.items()):
+                stats.setdefault(kind, {})[status] = count
+
+        return stats
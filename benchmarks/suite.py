@@ -0,0 +1,258 @@
+"""Offline benchmark suite. Times ranking, persistence and rendering over
+synthetic universes of stocks, MorningStar parsing over the bundled fixture
+pages, a backtest over 20 years of synthetic prices, and the time taken to
+import the command-line interface. Wall time
+and peak memory (as traced by tracemalloc, in a separate pass so tracing
+doesn't skew the timings) are written as JSON, so results can be compared
+across commits.
+
+Usage: python -m benchmarks.suite [--sizes 1000 100000 1000000]
+                                  [--output results.json] [--no-memory]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from stockrank import columnar
+from stockrank.backtest import Prices, backtest
+from stockrank.sweep import Universe, screens, sweep
+from stockrank.stock import StockProfile
+from stockrank.stockrank import StockRank, _rank_stocks
+from benchmarks.bench_morningstar import load_fixtures, parse_pages
+
+SECTORS = ['Materials', 'Energy', 'Health Care', 'Industrials',
+           'Information Technology', 'Consumer Staples',
+           'Consumer Discretionary', 'Telecommunication Services']
+
+# number of page pairs parsed by the MorningStar benchmark
+PARSE_ITERATIONS = 200
+
+# screens tried by the sweep benchmark: 5 market cap floors x 4 sets of
+# excluded sectors x 5 weightings
+SWEEP_SCREENS = screens(
+    [None, 100000000, 500000000, 1000000000, 2000000000],
+    [(), ('Energy',), ('Materials',), ('Energy', 'Materials')],
+    [(1, 1), (2, 1), (1, 2), (1, 0), (0, 1)])
+
+# trading days and stocks of the backtest benchmark: about 20 years of the
+# ASX, rebalanced monthly
+BACKTEST_DAYS = 20 * 252
+BACKTEST_STOCKS = 2000
+
+
+def synthetic_profiles(count, seed=0):
+    """Returns a list of 'count' randomly generated StockProfile objects.
+    """
+    rand = random.Random(seed)
+    stock_profiles = []
+
+    for i in range(count):
+        market_cap = rand.randint(50, 5000) * 1000000
+
+        stock_profiles.append(StockProfile(
+            symbol='S%07d' % i,
+            title='Synthetic Company %d Ltd' % i,
+            sector=rand.choice(SECTORS),
+            return_on_capital=rand.uniform(-0.5, 1.0),
+            ebit=rand.randint(-10, 100) * 1000000,
+            market_cap=market_cap,
+            total_debt=rand.randint(0, 500) * 1000000,
+            # keep the enterprise value positive
+            cash=rand.randint(0, market_cap // 2)))
+
+    return stock_profiles
+
+
+def synthetic_backtest(days, stocks, seed=0):
+    """Returns a tuple of (Prices, snapshot dates, ranks) for a backtest over
+    random walks of 'stocks' stocks, with a snapshot of random ranks taken
+    every 21 trading days.
+    """
+    rand = np.random.default_rng(seed)
+    dates = np.datetime64('2000-01-03') + np.arange(days)
+    symbols = np.array(['S%07d' % i for i in range(stocks)], dtype=object)
+    closes = 10 * np.exp(np.cumsum(rand.normal(0.0003, 0.02,
+                                               (days, stocks)), axis=0))
+    # the odd missing price, as when a stock is suspended
+    closes[rand.random((days, stocks)) < 0.01] = np.nan
+
+    snapshot_dates = dates[::21]
+    ranks = np.argsort(rand.random((len(snapshot_dates), stocks)),
+                       axis=1) + 1.0
+    return Prices(dates, symbols, closes), snapshot_dates, ranks
+
+
+def _measure(function, memory):
+    """Runs a function, and returns a tuple of (seconds, peak bytes). Peak
+    bytes is None if memory isn't measured.
+    """
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+def _universe_benchmarks(size, workdir):
+    """Yields (name, function) pairs benchmarking a universe of 'size' stocks.
+    """
+    stock_profiles = synthetic_profiles(size)
+
+    config_path = os.path.join(workdir, 'config.ini')
+    with open(config_path, 'w') as f:
+        f.write('[Application]\ndatabase_path = %s\n'
+                % os.path.join(workdir, 'stocks-%d.db' % size))
+
+    stockrank = StockRank(config_path)
+    db = stockrank._db
+    stockrank._stock_profiles = _rank_stocks(stock_profiles)
+
+    def print_stocks():
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                stockrank.print_stocks()
+
+    yield 'rank_stocks', lambda: _rank_stocks(stock_profiles)
+    yield 'populate', lambda: db.populate(stock_profiles)
+    yield 'get_stock_profiles', db.get_stock_profiles
+    yield 'get_stock_table', db.get_stock_table
+    yield 'rank_table', lambda: db.get_stock_table().ranked()
+    yield 'top_30', lambda: db.get_ranked_table(30)
+
+    export_path = os.path.join(workdir, 'stocks-%d.srk' % size)
+    yield 'export', lambda: columnar.export(export_path,
+                                            db.get_ranked_columns())
+    # loading a whole exported file, and reading every one of its earnings
+    # yields
+    yield 'load_export', lambda: int(
+        columnar.load_table(export_path).earnings_yield.argmax())
+    yield 'sweep_100', lambda: sweep(
+        Universe.from_table(db.get_stock_table()), SWEEP_SCREENS)
+    yield 'print_stocks', print_stocks
+
+
+def import_time(module='stockrank.main'):
+    """Imports a module in a fresh interpreter with '-X importtime', and
+    returns a tuple of (seconds taken to import it, including everything it
+    imports, set of every module imported along the way).
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    seconds = None
+    modules = set()
+
+    # lines are 'import time: <self us> | <cumulative us> | <indent><name>'
+    for line in output.stderr.decode().splitlines():
+        fields = line.split('|')
+
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+
+        name = fields[2].strip()
+        modules.add(name)
+
+        if name == module:
+            seconds = int(fields[1]) / 1000000
+
+    return seconds, modules
+
+
+def _commit():
+    """Returns the current git commit, if we're in a git checkout.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, memory=True):
+    """Runs every benchmark, and returns the results as a JSON-serialisable
+    dict.
+    """
+    results = []
+
+    def record(name, size, function):
+        seconds, peak = _measure(function, memory)
+        results.append({'name': name, 'size': size, 'seconds': seconds,
+                        'peak_bytes': peak})
+        print('%-20s %9d %10.4fs' % (name, size, seconds), file=sys.stderr)
+
+    workdir = tempfile.mkdtemp()
+
+    try:
+        for size in sizes:
+            for name, function in _universe_benchmarks(size, workdir):
+                record(name, size, function)
+    finally:
+        shutil.rmtree(workdir)
+
+    historicals, balancesheet = load_fixtures()
+    record('parse_morningstar', PARSE_ITERATIONS,
+           lambda: parse_pages(historicals, balancesheet, PARSE_ITERATIONS))
+
+    prices, snapshot_dates, ranks = synthetic_backtest(BACKTEST_DAYS,
+                                                       BACKTEST_STOCKS)
+    record('backtest', BACKTEST_DAYS,
+           lambda: backtest(prices, snapshot_dates, ranks, holding_days=21,
+                            cost=0.003))
+
+    # not measured by _measure(), as it runs in its own process
+    seconds, _ = import_time()
+    results.append({'name': 'import_main', 'size': 1, 'seconds': seconds,
+                    'peak_bytes': None})
+    print('%-20s %9d %10.4fs' % ('import_main', 1, seconds), file=sys.stderr)
+
+    return {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000],
+                        help='numbers of stocks in the synthetic universes')
+    parser.add_argument('--output', type=str, default=None,
+                        help='file to write JSON results to (default stdout)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help="don't measure peak memory")
+    args = parser.parse_args()
+
+    results = run(args.sizes, memory=not args.no_memory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,5 +9,6 @@ setuptools.setup(
         author_email='benbrcan@gmail.com',
         license='GPL',
         url='https://github.com/bbrcan/stockrank',
-        packages=['stockrank']
+        packages=['stockrank'],
+        install_requires=['lxml', 'numpy', 'requests']
 )
@@ -0,0 +1,316 @@
+"""Backtests the magic formula over the rankings stored in our snapshots,
+against daily closing prices read from local files.
+
+At every rebalance, the portfolio is rebalanced into equal weights of the
+top-ranked stocks of the latest snapshot taken on or before that day, only
+trading the difference, then held, drifting with the stocks' prices, until
+the next rebalance. Everything is computed with whole-array NumPy
+operations: there's no Python loop over days or stocks.
+"""
+import csv
+import os
+import numpy as np
+
+# trading days in a year, for annualising returns
+TRADING_DAYS = 252
+
+
+class Prices(object):
+    """Daily closing prices, as a (day, stock) matrix with NaN wherever a
+    stock has no price.
+    """
+    def __init__(self, dates, symbols, closes):
+        """Arguments:
+        dates -- Sorted datetime64[D] array of trading days.
+        symbols -- Sorted array of symbols.
+        closes -- float64 array of shape (len(dates), len(symbols)).
+        """
+        self.dates = dates
+        self.symbols = symbols
+        self.closes = closes
+
+    @classmethod
+    def from_columns(cls, dates, symbols, closes):
+        """Builds the price matrix from equal-length arrays of dates, symbols
+        and closing prices, in any order. If a stock has more than one price
+        on a day, the last one wins.
+        """
+        dates, day = np.unique(np.asarray(dates, dtype='datetime64[D]'),
+                               return_inverse=True)
+        symbols, stock = np.unique(np.asarray(symbols, dtype=object),
+                                   return_inverse=True)
+        matrix = np.full((len(dates), len(symbols)), np.nan)
+        matrix[day, stock] = closes
+        return cls(dates, symbols, matrix)
+
+
+def _read_csv(path):
+    """Reads a CSV file of prices, with 'date' and 'close' columns, and
+    either a 'symbol' column or one stock's prices named after the file (eg
+    BHP.csv). Returns a tuple of (dates, symbols, closes) columns.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader)]
+        rows = [row for row in reader if row]
+
+    date, close = header.index('date'), header.index('close')
+    date_column = [row[date] for row in rows]
+    closes = np.array([row[close] for row in rows], dtype=np.float64)
+
+    if 'symbol' in header:
+        symbol = header.index('symbol')
+        symbols = [row[symbol] for row in rows]
+    else:
+        symbol = os.path.splitext(os.path.basename(path))[0].upper()
+        symbols = [symbol] * len(rows)
+
+    return date_column, symbols, closes
+
+
+def _read_parquet(path):
+    """Reads a Parquet file of prices, with the same columns as _read_csv().
+    Needs pyarrow.
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('reading %s needs pyarrow, which is not installed'
+                          % path)
+
+    table = pyarrow.parquet.read_table(path)
+    names = [name.lower() for name in table.column_names]
+
+    def column(name):
+        return table.column(names.index(name)).to_numpy()
+
+    if 'symbol' in names:
+        symbols = column('symbol')
+    else:
+        symbol = os.path.splitext(os.path.basename(path))[0].upper()
+        symbols = [symbol] * table.num_rows
+
+    return column('date').astype('datetime64[D]'), symbols, \
+        column('close').astype(np.float64)
+
+
+_READERS = {'.csv': _read_csv, '.parquet': _read_parquet}
+
+
+def load_prices(path):
+    """Loads daily closing prices from a CSV or Parquet file, or from every
+    such file in a directory. See _read_csv() for the columns expected.
+    """
+    def readable(name):
+        return os.path.splitext(name)[1].lower() in _READERS
+
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                       if readable(name))
+    else:
+        paths = [path] if readable(path) else []
+
+    if not paths:
+        raise ValueError('no price files found in %s' % path)
+
+    dates, symbols, closes = [], [], []
+
+    for file_path in paths:
+        reader = _READERS[os.path.splitext(file_path)[1].lower()]
+        file_dates, file_symbols, file_closes = reader(file_path)
+        dates.append(np.asarray(file_dates, dtype='datetime64[D]'))
+        symbols.append(np.asarray(file_symbols, dtype=object))
+        closes.append(file_closes)
+
+    return Prices.from_columns(np.concatenate(dates),
+                               np.concatenate(symbols),
+                               np.concatenate(closes))
+
+
+def snapshot_ranks(rows, symbols, excluded_sectors=(),
+                   min_market_cap=None):
+    """Builds a matrix of each snapshot's ranks from the rows returned by
+    StockDatabase.snapshot_ranks(). Returns a tuple of (snapshot dates as a
+    datetime64[D] array, float64 array of shape (snapshots, symbols)), where
+    stocks missing from a snapshot, or filtered out of it, rank infinitely
+    low.
+
+    Arguments:
+    symbols -- Sorted array of the symbols to rank, eg Prices.symbols.
+    excluded_sectors -- Stocks whose sector contains any of these strings are
+                        filtered out.
+    min_market_cap -- If given, smaller stocks are filtered out.
+    """
+    if not rows:
+        return (np.empty(0, dtype='datetime64[D]'),
+                np.empty((0, len(symbols))))
+
+    dates, row_symbols, ranks, sectors, market_caps = zip(*rows)
+    dates, snapshot = np.unique(np.array(dates, dtype='datetime64[D]'),
+                                return_inverse=True)
+
+    row_symbols = np.array(row_symbols, dtype=object)
+    stock = np.searchsorted(symbols, row_symbols)
+    stock[stock == len(symbols)] = 0
+    keep = symbols[stock] == row_symbols
+
+    # sectors repeat, so each distinct one is only matched once
+    excluded = [sector for sector in set(sectors) if sector and
+                any(x in sector for x in excluded_sectors)]
+    keep &= ~np.isin(np.array(sectors, dtype=object), excluded)
+
+    if min_market_cap is not None:
+        keep &= np.array(market_caps, dtype=np.float64) >= min_market_cap
+
+    matrix = np.full((len(dates), len(symbols)), np.inf)
+    matrix[snapshot[keep], stock[keep]] = np.array(ranks)[keep]
+    return dates, matrix
+
+
+def _forward_fill(closes):
+    """Fills each missing price with the stock's last known price, so a stock
+    which stops trading holds its value. Prices before a stock's first are
+    left missing.
+    """
+    days = np.arange(len(closes))[:, None]
+    last = np.where(np.isnan(closes), 0, days)
+    np.maximum.accumulate(last, axis=0, out=last)
+    return np.take_along_axis(closes, last, axis=0)
+
+
+class BacktestResult(object):
+    """The outcome of a backtest. 'values' is the portfolio's value on each
+    of 'dates', starting from 1 (before the first purchase's costs).
+    """
+    def __init__(self, dates, values, rebalance_dates, holdings, turnover,
+                 costs):
+        self.dates = dates
+        self.values = values
+        self.rebalance_dates = rebalance_dates
+        # list of the symbols bought at each rebalance
+        self.holdings = holdings
+        # fraction of the portfolio traded, and lost to costs, at each one
+        self.turnover = turnover
+        self.costs = costs
+
+    def summary(self):
+        """Returns a dict of the backtest's total return, compound annual
+        growth rate, annualised volatility and Sharpe ratio (with no
+        risk-free rate), maximum drawdown, and the number of rebalances.
+        """
+        values = self.values
+        years = (self.dates[-1] - self.dates[0]).astype(int) / 365.25
+        returns = values[1:] / values[:-1] - 1
+        deviation = returns.std() if len(returns) else 0.0
+
+        return {
+            'total_return': values[-1] - 1,
+            'cagr': values[-1] ** (1 / years) - 1 if years > 0 else np.nan,
+            'volatility': deviation * np.sqrt(TRADING_DAYS),
+            'sharpe': (returns.mean() / deviation * np.sqrt(TRADING_DAYS)
+                       if deviation > 0 else np.nan),
+            'max_drawdown': (values / np.maximum.accumulate(values) -
+                             1).min(),
+            'rebalances': len(self.rebalance_dates),
+        }
+
+
+def backtest(prices, snapshot_dates, ranks, portfolio_size=30,
+             holding_days=TRADING_DAYS, cost=0.0, start=None, end=None):
+    """Simulates buying the top-ranked stocks every 'holding_days' trading
+    days, and returns a BacktestResult.
+
+    A stock can only be bought on a day it has a price. A stock which stops
+    trading is held at its last price until the next rebalance. If fewer
+    stocks than 'portfolio_size' can be bought, the rest is held in cash.
+
+    Arguments:
+    prices -- A Prices object.
+    snapshot_dates, ranks -- As returned by snapshot_ranks(), for the symbols
+                             of 'prices'.
+    portfolio_size -- Number of stocks held.
+    holding_days -- Trading days between rebalances.
+    cost -- Transaction costs, as a fraction of the value traded, eg 0.003
+            for 30 basis points.
+    start, end -- Optional datetime64[D] (or ISO date string) bounds of the
+                  backtest. It starts no earlier than the first snapshot.
+    """
+    dates = prices.dates
+    first = np.searchsorted(dates, snapshot_dates[0]) \
+        if len(snapshot_dates) else len(dates)
+
+    if start is not None:
+        first = max(first, np.searchsorted(dates, np.datetime64(start, 'D')))
+
+    stop = len(dates) if end is None else \
+        np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+
+    if first >= stop:
+        raise ValueError('no trading days with a snapshot to backtest')
+
+    rebalances = np.arange(first, stop, holding_days)
+    ends = np.append(rebalances[1:], stop - 1)
+
+    # the ranks each rebalance sees, from the latest snapshot on or before
+    # it. stocks without a price that day can't be bought
+    snapshot = np.searchsorted(snapshot_dates, dates[rebalances],
+                               side='right') - 1
+    candidates = ranks[snapshot]
+    candidates[np.isnan(prices.closes[rebalances])] = np.inf
+
+    held = np.argsort(candidates, axis=1,
+                      kind='stable')[:, :portfolio_size]
+    valid = np.isfinite(np.take_along_axis(candidates, held, axis=1))
+    count = valid.sum(axis=1)
+    # each stock gets its share of the full portfolio, and the shares of
+    # stocks which can't be bought are held in cash
+    weights = valid / portfolio_size
+    cash = 1 - count / portfolio_size
+
+    # only the stocks ever held need their prices filled in
+    columns, held = np.unique(held, return_inverse=True)
+    held = held.reshape(valid.shape)
+    closes = _forward_fill(prices.closes[:, columns])
+
+    def growth(days, period):
+        """Returns the growth of each period's portfolio, from the period's
+        rebalance to the given days.
+        """
+        stocks = held[period]
+        ratio = closes[days[:, None], stocks] / \
+            closes[rebalances[period][:, None], stocks]
+        ratio = np.where(valid[period], ratio, 0.0)
+        return cash[period] + (weights[period] * ratio).sum(axis=1)
+
+    periods = np.arange(len(rebalances))
+    period_growth = growth(ends, periods)
+
+    # the weights each portfolio drifted to, against the weights the next
+    # one is bought at. stocks in both only trade the difference
+    drifted = np.zeros_like(weights)
+    drifted[1:] = weights[:-1] * np.where(
+        valid[:-1], closes[ends[:-1, None], held[:-1]] /
+        closes[rebalances[:-1, None], held[:-1]], 0.0) / \
+        period_growth[:-1, None]
+    previous = np.zeros_like(held)
+    previous[1:] = held[:-1]
+    same = held[:, :, None] == previous[:, None, :]
+    kept = (same * np.minimum(weights[:, :, None],
+                              drifted[:, None, :])).sum(axis=(1, 2))
+    turnover = weights.sum(axis=1) + drifted.sum(axis=1) - 2 * kept
+    costs = cost * turnover
+
+    # value at each rebalance, after paying for it
+    carried = np.ones(len(rebalances))
+    carried[1:] = period_growth[:-1]
+    start_values = np.cumprod(carried * (1 - costs))
+
+    days = np.arange(first, stop)
+    period = np.searchsorted(rebalances, days, side='right') - 1
+    values = start_values[period] * growth(days, period)
+
+    holdings = [prices.symbols[columns[stocks[ok]]]
+                for stocks, ok in zip(held, valid)]
+
+    return BacktestResult(dates[first:stop], values, dates[rebalances],
+                          holdings, turnover, costs)
@@ -0,0 +1,208 @@
+"""Exports the ranked universe of stocks, with its precomputed ranks, to a
+fixed-width columnar file which can be memory-mapped, so loading it costs
+page faults rather than building an object per stock. The universe can also
+be exported as CSV, or Parquet (which needs pyarrow), for other tools.
+
+File layout (integers are little-endian):
+
+    offset  size    field
+    0       8       magic, b'SRKCOLS1'
+    8       8       number of rows (uint64)
+    16      4       number of columns (uint32)
+    20      4       reserved (zero)
+    24      64 * n  column directory, one 64-byte entry per column
+    ...             column data, each column starting on a 64-byte boundary
+
+Each directory entry holds the column's name (32 bytes of ASCII, padded with
+NULs), its NumPy dtype (16 bytes of ASCII, eg '<f8' or '|S30', padded with
+NULs), the offset of its data from the start of the file (uint64), and 8
+reserved bytes. A column's data is one fixed-width value per row, with no
+gaps. Text is UTF-8, padded with NULs to the column's width; missing numbers
+are NaN. Rows are in rank order.
+"""
+import csv
+import struct
+import numpy as np
+from stockrank.table import StockTable, TEXT_FIELDS, NUMERIC_FIELDS
+
+MAGIC = b'SRKCOLS1'
+
+_HEADER = struct.Struct('<8sQI4x')
+_ENTRY = struct.Struct('<32s16sQ8x')
+_ALIGNMENT = 64
+
+# columns written, in file order, after the profile fields
+DERIVED_FIELDS = ('enterprise_value', 'earnings_yield')
+RANK_FIELDS = ('earnings_yield_rank', 'roc_rank', 'score', 'rank')
+
+COLUMNS = TEXT_FIELDS + NUMERIC_FIELDS + DERIVED_FIELDS + RANK_FIELDS
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _encode(values):
+    """Converts an object array of strings (or None) to a fixed-width array
+    of UTF-8 bytes.
+    """
+    return np.array([(value or '').encode('utf-8') for value in values],
+                    dtype=bytes)
+
+
+def _file_columns(columns):
+    """Converts the columns returned by StockDatabase.get_ranked_columns()
+    to the arrays stored in a file, in file order.
+    """
+    for name in COLUMNS:
+        column = columns[name]
+
+        if name in TEXT_FIELDS:
+            column = _encode(column)
+        elif name in RANK_FIELDS:
+            column = column.astype('<i8')
+        else:
+            column = column.astype('<f8')
+
+        yield name, column
+
+
+def write(path, columns):
+    """Writes columns, as returned by StockDatabase.get_ranked_columns(), to
+    a columnar file.
+    """
+    arrays = list(_file_columns(columns))
+    rows = len(arrays[0][1])
+
+    offset = _align(_HEADER.size + _ENTRY.size * len(arrays))
+    directory = []
+
+    for name, array in arrays:
+        directory.append(_ENTRY.pack(name.encode('ascii'),
+                                     array.dtype.str.encode('ascii'), offset))
+        offset = _align(offset + array.nbytes)
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, rows, len(arrays)))
+        f.write(b''.join(directory))
+
+        for (_, array), entry in zip(arrays, directory):
+            f.seek(_ENTRY.unpack(entry)[2])
+            f.write(array.tobytes())
+
+        # pad the last column, so the file size is what a reader expects
+        f.truncate(offset)
+
+
+def read(path):
+    """Memory-maps a columnar file, and returns a dict mapping each column's
+    name to a read-only NumPy view of its data. Nothing is read until a view
+    is used. Raises ValueError if the file isn't a columnar file.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    magic, rows, count = _HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise ValueError('%s is not a stockrank columnar file' % path)
+
+    columns = {}
+
+    for i in range(count):
+        name, dtype, offset = _ENTRY.unpack_from(
+            data, _HEADER.size + i * _ENTRY.size)
+        name = name.rstrip(b'\0').decode('ascii')
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        columns[name] = np.ndarray(rows, dtype, buffer=data, offset=offset)
+
+    return columns
+
+
+def load_table(path, count=None, sector=None, min_market_cap=None):
+    """Loads a columnar file as a StockTable, in ranked order, whose columns
+    are views of the file (unless filtered, when only the rows kept are
+    copied). Text columns hold UTF-8 bytes; StockRow decodes them.
+
+    Arguments:
+    count -- If given, at most this many stocks are loaded.
+    sector -- If given, only stocks in this sector (ignoring case) are
+              loaded.
+    min_market_cap -- If given, only stocks with at least this market cap
+                      are loaded.
+    """
+    columns = read(path)
+    keep = slice(count)
+
+    if sector is not None or min_market_cap is not None:
+        mask = np.ones(len(columns['symbol']), dtype=bool)
+
+        if sector is not None:
+            mask &= np.char.lower(columns['sector']) == \
+                sector.lower().encode('utf-8')
+        if min_market_cap is not None:
+            mask &= columns['market_cap'] >= min_market_cap
+
+        keep = np.flatnonzero(mask)[:count]
+
+    return StockTable(
+        {name: columns[name][keep] for name in TEXT_FIELDS + NUMERIC_FIELDS},
+        {name: columns[name][keep] for name in DERIVED_FIELDS})
+
+
+def write_csv(path, columns):
+    """Writes columns, as returned by StockDatabase.get_ranked_columns(), to
+    a CSV file with a header row. Missing values are left empty.
+    """
+    arrays = [columns[name] for name in COLUMNS]
+
+    def cell(value):
+        if value is None or value != value:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows([cell(value) for value in row]
+                         for row in zip(*(array.tolist()
+                                          for array in arrays)))
+
+
+def write_parquet(path, columns):
+    """Writes columns, as returned by StockDatabase.get_ranked_columns(), to
+    a Parquet file. Needs pyarrow.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('writing %s needs pyarrow, which is not installed'
+                          % path)
+
+    arrays = []
+
+    for name in COLUMNS:
+        column = columns[name]
+
+        if name in RANK_FIELDS:
+            column = column.astype(np.int64)
+
+        arrays.append(pyarrow.array(column, from_pandas=True))
+
+    pyarrow.parquet.write_table(pyarrow.table(arrays, names=list(COLUMNS)),
+                                path)
+
+
+def export(path, columns):
+    """Writes columns, as returned by StockDatabase.get_ranked_columns(), in
+    the format given by the file's extension: '.csv', '.parquet', or
+    otherwise a columnar file.
+    """
+    if path.lower().endswith('.csv'):
+        write_csv(path, columns)
+    elif path.lower().endswith('.parquet'):
+        write_parquet(path, columns)
+    else:
+        write(path, columns)
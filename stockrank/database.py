@@ -1,5 +1,59 @@
+import datetime
+import hashlib
 import sqlite3
 from stockrank.stock import StockProfile
+from stockrank.helpers import timestamp
+
+
+# columns holding StockProfile attributes, in table order
+_PROFILE_COLUMNS = [
+    ('symbol', 'TEXT PRIMARY KEY'),
+    ('title', 'TEXT'),
+    ('sector', 'TEXT'),
+    ('return_on_capital', 'REAL'),
+    ('ebit', 'REAL'),
+    ('market_cap', 'INTEGER'),
+    ('total_debt', 'INTEGER'),
+    ('cash', 'INTEGER'),
+]
+
+# the sources we scrape; each gets a '<source>_fetched_at' column holding the
+# unix timestamp of its last successful scrape
+SOURCES = ['google', 'asx', 'morningstar']
+
+_STORED_COLUMNS = _PROFILE_COLUMNS + \
+    [(source + '_fetched_at', 'REAL') for source in SOURCES]
+
+# columns derived from the stored ones, recomputed when stocks are written
+# (see rerank()). ranks are 1-based; 'rank' is the magic formula rank
+_DERIVED_COLUMNS = [
+    ('enterprise_value', 'REAL'),
+    ('earnings_yield', 'REAL'),
+    ('earnings_yield_rank', 'INTEGER'),
+    ('roc_rank', 'INTEGER'),
+    ('score', 'INTEGER'),
+    ('rank', 'INTEGER'),
+]
+
+_COLUMNS = _STORED_COLUMNS + _DERIVED_COLUMNS
+
+_PROFILE_NAMES = [name for name, _ in _PROFILE_COLUMNS]
+
+
+def _profile_values(stock):
+    return [getattr(stock, name) for name in _PROFILE_NAMES]
+
+
+def _digest(values):
+    """Returns a hash identifying a profile's contents, used to store each
+    distinct version of a profile only once.
+    """
+    return hashlib.blake2b(repr(values).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+def _row_to_profile(row):
+    return StockProfile(**{name: row[name] for name in _PROFILE_NAMES})
 
 
 class StockDatabase(object):
@@ -8,21 +62,86 @@ class StockDatabase(object):
     """
     def __init__(self, config):
         db = sqlite3.connect(config.get('Application', 'database_path'))
-        db.execute('CREATE TABLE IF NOT EXISTS stocks '
-                   '(symbol TEXT,'
-                   'title TEXT,'
-                   'sector TEXT,'
-                   'return_on_capital REAL,'
-                   'ebit REAL,'
-                   'market_cap INTEGER,'
-                   'total_debt INTEGER,'
-                   'cash INTEGER)')
+        self._migrate(db)
+        db.execute('CREATE TABLE IF NOT EXISTS stocks (%s)' %
+                   ', '.join('%s %s' % column for column in _COLUMNS))
+
+        # top-N queries walk one of these in rank order, filtering on market
+        # cap without touching the table
+        db.execute('CREATE INDEX IF NOT EXISTS stocks_rank '
+                   'ON stocks (rank, market_cap)')
+        db.execute('CREATE INDEX IF NOT EXISTS stocks_sector_rank '
+                   'ON stocks (sector COLLATE NOCASE, rank, market_cap)')
+
+        # snapshots are append-only. each distinct version of a profile is
+        # stored once in profile_versions; a snapshot row only references it,
+        # along with the stock's ranks on that date
+        db.execute('CREATE TABLE IF NOT EXISTS profile_versions '
+                   '(id INTEGER PRIMARY KEY,'
+                   'digest BLOB UNIQUE,'
+                   '%s)' % ', '.join(
+                       '%s %s' % (name, column_type.split()[0])
+                       for name, column_type in _PROFILE_COLUMNS))
+        db.execute('CREATE TABLE IF NOT EXISTS snapshots '
+                   '(snapshot_date TEXT,'
+                   'symbol TEXT,'
+                   'version_id INTEGER,'
+                   'rank INTEGER,'
+                   'earnings_yield_rank INTEGER,'
+                   'roc_rank INTEGER,'
+                   'PRIMARY KEY (snapshot_date, symbol)) WITHOUT ROWID')
+        db.execute('CREATE INDEX IF NOT EXISTS snapshots_symbol_date '
+                   'ON snapshots (symbol, snapshot_date)')
+
+        # checkpoint journal of downloads, so an interrupted download can be
+        # resumed. download_journal lists the symbols stored by each run
+        db.execute('CREATE TABLE IF NOT EXISTS download_runs '
+                   '(id INTEGER PRIMARY KEY,'
+                   'started_at REAL,'
+                   'finished_at REAL)')
+        db.execute('CREATE TABLE IF NOT EXISTS download_journal '
+                   '(run_id INTEGER,'
+                   'symbol TEXT,'
+                   'PRIMARY KEY (run_id, symbol)) WITHOUT ROWID')
 
         db.commit()
         db.row_factory = sqlite3.Row
         self._db = db
         self._cursor = db.cursor()
 
+        # stocks written by an older version have no ranks yet
+        if db.execute('SELECT 1 FROM stocks WHERE rank IS NULL '
+                      'LIMIT 1').fetchone():
+            self.rerank()
+
+    def _migrate(self, db):
+        """Upgrades a 'stocks' table created by an older version. Tables
+        without a primary key are rebuilt, and missing columns are added.
+        """
+        table_info = db.execute('PRAGMA table_info(stocks)').fetchall()
+
+        if not table_info:
+            return
+
+        # table_info rows are (cid, name, type, notnull, default, pk)
+        if not any(row[5] for row in table_info):
+            old_columns = ', '.join(row[1] for row in table_info)
+            db.execute('ALTER TABLE stocks RENAME TO stocks_old')
+            db.execute('CREATE TABLE stocks (%s)' %
+                       ', '.join('%s %s' % column for column in _COLUMNS))
+            # older tables may hold duplicate symbols; keep the last one
+            db.execute('INSERT OR REPLACE INTO stocks (%s) SELECT %s '
+                       'FROM stocks_old' % (old_columns, old_columns))
+            db.execute('DROP TABLE stocks_old')
+            return
+
+        names = set(row[1] for row in table_info)
+
+        for name, column_type in _COLUMNS:
+            if name not in names:
+                db.execute('ALTER TABLE stocks ADD COLUMN %s %s'
+                           % (name, column_type))
+
     def empty(self):
         """Returns True if no stock data is present in the database, otherwise
         False.
@@ -30,18 +149,35 @@ class StockDatabase(object):
         self._cursor.execute('SELECT count(*) FROM stocks')
         row = self._cursor.fetchone()
 
-        if row[0] is 0:
+        if row[0] == 0:
             return True
 
         return False
 
-    def populate(self, stock_profiles):
-        """Populates the database with given stock data.
+    def data_version(self):
+        """Returns a number which changes whenever another connection (in
+        this process or any other) commits a change to the database.
+        """
+        return self._db.execute('PRAGMA data_version').fetchone()[0]
+
+    def populate(self, stock_profiles, fetched_at=None, run_id=None,
+                 rerank=True):
+        """Inserts or updates the given stocks in the database. Stocks already
+        in the database but not in stock_profiles are left untouched.
 
         Arguments:
         stock_profiles -- A list of StockProfile objects.
+        fetched_at -- Unix timestamp at which the stock data was scraped from
+                      each source. Defaults to now.
+        run_id -- If given, the stocks are recorded in the journal of this
+                  download run (see start_run()), in the same transaction.
+        rerank -- If False, the ranks stored in the database aren't updated.
+                  Ranking takes time proportional to the whole table, so
+                  callers writing many batches should call rerank() once
+                  they're done instead.
         """
-        self._cursor.execute('DELETE FROM stocks')
+        if fetched_at is None:
+            fetched_at = timestamp()
 
         # store values to insert into the DB here first, so we can insert them
         # all at once using the more efficient executemany()
@@ -58,12 +194,127 @@ class StockDatabase(object):
                 stock.market_cap,
                 stock.total_debt,
                 stock.cash
-                ])
+                ] + [fetched_at] * len(SOURCES))
+
+        names = [name for name, _ in _STORED_COLUMNS]
+        self._cursor.executemany(
+            'INSERT INTO stocks (%s) VALUES (%s) '
+            'ON CONFLICT(symbol) DO UPDATE SET %s'
+            % (', '.join(names),
+               ', '.join('?' * len(names)),
+               ', '.join('%s = excluded.%s' % (name, name)
+                         for name in names[1:])),
+            many_values)
+
+        if run_id is not None:
+            self._cursor.executemany(
+                'INSERT OR IGNORE INTO download_journal VALUES (?, ?)',
+                [(run_id, values[0]) for values in many_values])
+
+        if rerank:
+            self._rerank()
+        self._db.commit()
+
+    def start_run(self, resume=False):
+        """Starts a download run and returns its id. If resume is True and the
+        last run didn't finish, that run is continued instead.
+        """
+        if resume:
+            self._cursor.execute('SELECT id, finished_at FROM download_runs '
+                                 'ORDER BY id DESC LIMIT 1')
+            row = self._cursor.fetchone()
+
+            if row and row['finished_at'] is None:
+                return row['id']
+
+        self._cursor.execute('INSERT INTO download_runs (started_at) '
+                             'VALUES (?)', (timestamp(),))
+        self._db.commit()
+        return self._cursor.lastrowid
+
+    def finish_run(self, run_id):
+        """Marks a download run as complete, and discards its journal.
+        """
+        self._cursor.execute('UPDATE download_runs SET finished_at = ? '
+                             'WHERE id = ?', (timestamp(), run_id))
+        self._cursor.execute('DELETE FROM download_journal WHERE run_id = ?',
+                             (run_id,))
+        self._db.commit()
+
+    def journaled_symbols(self, run_id):
+        """Returns the set of symbols already stored by a download run.
+        """
+        self._cursor.execute('SELECT symbol FROM download_journal '
+                             'WHERE run_id = ?', (run_id,))
+        return set(row[0] for row in self._cursor.fetchall())
+
+    def update_fields(self, stock_profiles, fields, rerank=True):
+        """Updates only the given fields of stocks already in the database.
+        Stocks not in the database are ignored.
+
+        Arguments:
+        stock_profiles -- A list of StockProfile objects.
+        fields -- A list of StockProfile attribute names, eg ['ebit'].
+        rerank -- As for populate().
+        """
+        self._cursor.executemany(
+            'UPDATE stocks SET %s WHERE symbol = ?'
+            % ', '.join('%s = ?' % field for field in fields),
+            ([getattr(stock, field) for field in fields] + [stock.symbol]
+             for stock in stock_profiles))
 
-        self._cursor.executemany('INSERT INTO stocks VALUES '
-                                 '(?, ?, ?, ?, ?, ?, ?, ?)', many_values)
+        if rerank:
+            self._rerank()
+        self._db.commit()
+
+    def rerank(self):
+        """Recomputes the ranks and derived metrics stored in the database.
+        """
+        self._rerank()
         self._db.commit()
 
+    def _rerank(self):
+        """Recomputes the derived columns of every stock, in the current
+        transaction. The ranks match those of stockrank.ranking: missing
+        values rank last, and ties are broken by the order stocks were first
+        stored in.
+        """
+        self._cursor.execute(
+            'UPDATE stocks SET '
+            'enterprise_value = market_cap + total_debt - cash, '
+            # SQLite gives NULL for a division by zero
+            'earnings_yield = ebit * 1.0 / (market_cap + total_debt - cash) '
+            # only rewrite rows which changed
+            'WHERE enterprise_value IS NOT market_cap + total_debt - cash '
+            'OR earnings_yield IS NOT '
+            'ebit * 1.0 / (market_cap + total_debt - cash)')
+        self._cursor.execute(
+            'WITH metrics AS (SELECT rowid AS id, '
+            'row_number() OVER (ORDER BY earnings_yield IS NULL, '
+            'earnings_yield DESC, rowid) AS ey_rank, '
+            'row_number() OVER (ORDER BY return_on_capital IS NULL, '
+            'return_on_capital DESC, rowid) AS roc_rank '
+            'FROM stocks) '
+            'UPDATE stocks SET earnings_yield_rank = ranked.ey_rank, '
+            'roc_rank = ranked.roc_rank, score = ranked.score, '
+            'rank = ranked.rank '
+            'FROM (SELECT id, ey_rank, roc_rank, ey_rank + roc_rank AS score, '
+            'row_number() OVER (ORDER BY ey_rank + roc_rank, id) AS rank '
+            'FROM metrics) AS ranked '
+            'WHERE stocks.rowid = ranked.id '
+            'AND (stocks.rank IS NOT ranked.rank '
+            'OR stocks.earnings_yield_rank IS NOT ranked.ey_rank '
+            'OR stocks.roc_rank IS NOT ranked.roc_rank)')
+
+    def fresh_symbols(self, max_age, source='morningstar'):
+        """Returns the set of symbols whose data from the given source was
+        scraped less than max_age seconds ago.
+        """
+        self._cursor.execute('SELECT symbol FROM stocks '
+                             'WHERE %s_fetched_at >= ?' % source,
+                             (timestamp() - max_age,))
+        return set(row[0] for row in self._cursor.fetchall())
+
     def get_stock_profiles(self):
         """Returns a list of StockProfile objects, pulled from the database.
         """
@@ -71,14 +322,180 @@ class StockDatabase(object):
         self._cursor.execute('SELECT * FROM stocks')
 
         for row in self._cursor.fetchall():
-            stock_profiles.append(StockProfile(
-                symbol=row['symbol'],
-                title=row['title'],
-                sector=row['sector'],
-                return_on_capital=row['return_on_capital'],
-                ebit=row['ebit'],
-                market_cap=row['market_cap'],
-                total_debt=row['total_debt'],
-                cash=row['cash']))
+            stock_profiles.append(_row_to_profile(row))
 
         return stock_profiles
+
+    def get_stock_table(self):
+        """Returns all stocks in the database as a StockTable, without
+        building an object per stock.
+        """
+        # imported here, so reading the ranking doesn't need NumPy
+        from stockrank.table import StockTable
+
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        count = cursor.execute('SELECT count(*) FROM stocks').fetchone()[0]
+
+        # stream rows straight into the table's columns. StockTable's fields
+        # are in the same order as ours
+        cursor.execute('SELECT %s FROM stocks LIMIT ?'
+                       % ', '.join(_PROFILE_NAMES), (count,))
+        return StockTable.from_rows(cursor, count)
+
+    def _ranked_rows(self, count, sector, min_market_cap):
+        """Returns a cursor over the profile columns of stocks in ranked
+        order, using the ranks stored in the database. See
+        get_ranked_profiles() for the arguments.
+        """
+        where = []
+        params = []
+
+        if sector is not None:
+            where.append('sector = ? COLLATE NOCASE')
+            params.append(sector)
+
+        if min_market_cap is not None:
+            where.append('market_cap >= ?')
+            params.append(min_market_cap)
+
+        # a negative limit means no limit
+        params.append(-1 if count is None else count)
+
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        return cursor.execute('SELECT %s FROM stocks %s ORDER BY rank LIMIT ?'
+                              % (', '.join(_PROFILE_NAMES),
+                                 'WHERE ' + ' AND '.join(where)
+                                 if where else ''),
+                              params)
+
+    def get_ranked_profiles(self, count=None, sector=None,
+                            min_market_cap=None):
+        """Returns a list of StockProfile objects in ranked order, using the
+        ranks stored in the database, so only the rows returned are read.
+
+        Arguments:
+        count -- If given, at most this many stocks are returned.
+        sector -- If given, only stocks in this sector (ignoring case) are
+                  returned.
+        min_market_cap -- If given, only stocks with at least this market cap
+                          are returned.
+        """
+        return [StockProfile(*row)
+                for row in self._ranked_rows(count, sector, min_market_cap)]
+
+    def get_ranked_table(self, count=None, sector=None, min_market_cap=None):
+        """As get_ranked_profiles(), but returns the stocks as a StockTable.
+        """
+        from stockrank.table import StockTable
+
+        return StockTable.from_rows(self._ranked_rows(count, sector,
+                                                      min_market_cap))
+
+    def get_ranked_columns(self):
+        """Returns every stock in ranked order, with its derived columns, as a
+        dict mapping each column name (see _PROFILE_COLUMNS and
+        _DERIVED_COLUMNS) to a NumPy array: an object array of strings for
+        text columns, and float64, with NaN for missing values, for the rest.
+        """
+        import numpy as np
+
+        names = _PROFILE_NAMES + [name for name, _ in _DERIVED_COLUMNS]
+        text = [name for name, column_type in _PROFILE_COLUMNS
+                if column_type.startswith('TEXT')]
+
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute('SELECT %s FROM stocks ORDER BY rank'
+                              % ', '.join(names)).fetchall()
+
+        return {name: np.array([row[i] for row in rows],
+                               dtype=object if name in text else np.float64)
+                for i, name in enumerate(names)}
+
+    def save_snapshot(self, stock_profiles, earnings_yield_ranks, roc_ranks,
+                      order, date=None):
+        """Records a dated snapshot of the given stocks and their ranks. A
+        snapshot taken earlier on the same date is replaced.
+
+        Arguments:
+        stock_profiles -- A list of StockProfile objects.
+        earnings_yield_ranks, roc_ranks, order -- The ranks of stock_profiles,
+            as returned by stockrank.ranking.profile_ranks().
+        date -- A datetime.date; defaults to today.
+        """
+        snapshot_date = (date or datetime.date.today()).isoformat()
+
+        many_versions = []
+        many_snapshots = []
+
+        for i, stock in enumerate(stock_profiles):
+            values = _profile_values(stock)
+            digest = _digest(values)
+            many_versions.append([digest] + values)
+            many_snapshots.append([snapshot_date, stock.symbol, digest, None,
+                                   int(earnings_yield_ranks[i]) + 1,
+                                   int(roc_ranks[i]) + 1])
+
+        for rank, i in enumerate(order):
+            many_snapshots[i][3] = rank + 1
+
+        self._cursor.executemany(
+            'INSERT OR IGNORE INTO profile_versions (digest, %s) VALUES (%s)'
+            % (', '.join(_PROFILE_NAMES),
+               ', '.join('?' * (len(_PROFILE_NAMES) + 1))),
+            many_versions)
+        self._cursor.execute('DELETE FROM snapshots WHERE snapshot_date = ?',
+                             (snapshot_date,))
+        self._cursor.executemany(
+            'INSERT INTO snapshots VALUES (?, ?, '
+            '(SELECT id FROM profile_versions WHERE digest = ?), ?, ?, ?)',
+            many_snapshots)
+        self._db.commit()
+
+    def snapshot_date(self, date):
+        """Returns the date (as an ISO string) of the latest snapshot taken on
+        or before the given datetime.date, or None if there is none.
+        """
+        self._cursor.execute('SELECT max(snapshot_date) FROM snapshots '
+                             'WHERE snapshot_date <= ?', (date.isoformat(),))
+        return self._cursor.fetchone()[0]
+
+    def ranking_as_of(self, date):
+        """Returns a list of StockProfile objects in ranked order, as they were
+        in the latest snapshot taken on or before the given datetime.date.
+        """
+        snapshot_date = self.snapshot_date(date)
+
+        self._cursor.execute(
+            'SELECT v.* FROM snapshots s '
+            'JOIN profile_versions v ON v.id = s.version_id '
+            'WHERE s.snapshot_date = ? ORDER BY s.rank', (snapshot_date,))
+
+        return [_row_to_profile(row) for row in self._cursor.fetchall()]
+
+    def rank_history(self, symbol):
+        """Returns the rank trajectory of a stock, as a list of (snapshot date,
+        rank, earnings yield rank, return on capital rank) tuples ordered by
+        date.
+        """
+        self._cursor.execute(
+            'SELECT snapshot_date, rank, earnings_yield_rank, roc_rank '
+            'FROM snapshots WHERE symbol = ? ORDER BY snapshot_date',
+            (symbol,))
+
+        return [tuple(row) for row in self._cursor.fetchall()]
+
+    def snapshot_ranks(self):
+        """Returns every snapshot's ranking, as a list of (snapshot date,
+        symbol, rank, sector, market cap) tuples ordered by date. Used by
+        backtests, which only ever see the ranking as it was on each date.
+        """
+        self._cursor.execute(
+            'SELECT s.snapshot_date, s.symbol, s.rank, v.sector, '
+            'v.market_cap FROM snapshots s '
+            'JOIN profile_versions v ON v.id = s.version_id '
+            'ORDER BY s.snapshot_date, s.rank')
+
+        return [tuple(row) for row in self._cursor.fetchall()]
@@ -1,2 +1,18 @@
 class FieldMissingException(Exception):
     pass
+
+
+class RequestFailedException(Exception):
+    pass
+
+
+class CircuitOpenException(Exception):
+    pass
+
+
+class LoginFailedException(Exception):
+    pass
+
+
+class SessionExpiredException(Exception):
+    pass
@@ -1,4 +1,5 @@
 import datetime
+import urllib.parse
 
 
 def sort_list_into_keys(objects, copy_attr, sort_attr):
@@ -7,12 +8,81 @@ def sort_list_into_keys(objects, copy_attr, sort_attr):
 
     Arguments:
     copy_attr -- The attribute of each object to copy into the new list.
-    sort_attr -- The attribute of each object to sort the list by.
+    sort_attr -- The attribute of each object to sort the list by. Objects with
+                 a missing value are sorted last.
     """
-    sorted_list = sorted(objects, key=lambda x: getattr(x, sort_attr),
-                         reverse=True)
-    sorted_keys = [getattr(x, copy_attr) for x in sorted_list]
-    return sorted_keys
+    # imported here, as NumPy is slow to import and few callers need it
+    from stockrank import ranking
+
+    order = ranking.descending_order(ranking.column(objects, sort_attr))
+    return [getattr(objects[i], copy_attr) for i in order]
+
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(text):
+    """Converts a duration such as '30d', '12h' or '90m' into seconds. A
+    number without a unit is taken as seconds.
+    """
+    text = text.strip().lower()
+
+    if text and text[-1] in _DURATION_UNITS:
+        return float(text[:-1]) * _DURATION_UNITS[text[-1]]
+
+    return float(text)
+
+
+def parse_list(text, separator=','):
+    """Splits a config value such as 'Utilities, Banks' into a list of its
+    items, without surrounding whitespace or empty items.
+    """
+    return [item.strip() for item in text.split(separator) if item.strip()]
+
+
+def rebase_url(url, root):
+    """Moves a URL to another site, eg 'https://www.asx.com.au/a/b.csv' to
+    'http://127.0.0.1:8081/a/b.csv' given a root of 'http://127.0.0.1:8081'.
+    An empty root leaves the URL as it is.
+    """
+    if not root:
+        return url
+
+    parts = urllib.parse.urlsplit(url)
+    return root.rstrip('/') + urllib.parse.urlunsplit(
+        ('', '', parts.path, parts.query, parts.fragment))
+
+
+_MONEY_SUFFIXES = {'K': 10 ** 3, 'M': 10 ** 6, 'B': 10 ** 9, 'T': 10 ** 12}
+
+
+def parse_market_cap(text):
+    """Converts an amount such as '50M', '10.5B' or '1,234' into an integer
+    number of dollars. Raises ValueError if it isn't a number.
+    """
+    multiplier = _MONEY_SUFFIXES.get(text[-1:].upper())
+
+    if multiplier is None:
+        return int(float(text.replace(',', '')))
+
+    # round, as eg 4.35 * 10 ** 6 is 4349999.999...
+    return int(round(float(text[:-1].replace(',', '')) * multiplier))
+
+
+def batched(iterable, size):
+    """Yields lists of up to 'size' consecutive items from an iterable.
+    """
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
 
 
 def timestamp():
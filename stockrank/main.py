@@ -1,5 +1,11 @@
 from stockrank.stockrank import StockRank
+from stockrank.helpers import parse_duration
 import argparse
+import datetime
+
+
+def _parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
 
 
 def main():
@@ -7,22 +13,122 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--download', action='store_true',
                         help='download stock data and store locally')
+    parser.add_argument('--stale-after', type=parse_duration, default=None,
+                        help='with --download, only download stocks whose '
+                             'data is older than this, eg "30d" or "12h"')
+    parser.add_argument('--resume', action='store_true',
+                        help='with --download, continue an interrupted '
+                             'download')
+    parser.add_argument('--reparse', action='store_true',
+                        help='re-extract stock data from archived pages, '
+                             'without downloading anything')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='queue stocks to be downloaded by --work; '
+                             'honours --stale-after')
+    parser.add_argument('--work', action='store_true',
+                        help='download stocks from the queue until it\'s '
+                             'empty. run as many workers as you like')
+    parser.add_argument('--progress', action='store_true',
+                        help='prints the progress of the queue\'s workers, '
+                             'and ranks the stocks once they\'re done')
     parser.add_argument('--show', action='store_true',
                         help='prints a list of stocks, in ranked order')
+    parser.add_argument('--top', type=int, default=None, metavar='N',
+                        help='with --show, prints only the top N stocks')
+    parser.add_argument('--sector', type=str, default=None,
+                        help='with --show, prints only stocks in this sector')
+    parser.add_argument('--min-market-cap', type=int, default=None,
+                        metavar='DOLLARS',
+                        help='with --show, prints only stocks with at least '
+                             'this market cap')
+    parser.add_argument('--import', type=str, default=None, metavar='PATH',
+                        dest='import_path',
+                        help='with --show, reads the stocks from a file '
+                             'written by --export, instead of the database')
+    parser.add_argument('--export', type=str, default=None, metavar='PATH',
+                        help='exports the ranked stocks to a file: CSV or '
+                             'Parquet if PATH ends in .csv or .parquet, '
+                             'otherwise a memory-mapped columnar file')
+    parser.add_argument('--as-of', type=_parse_date, default=None,
+                        help='with --show, prints the ranking as it was on '
+                             'a given date (YYYY-MM-DD)')
+    parser.add_argument('--history', type=str, metavar='SYMBOL',
+                        help='prints how the rank of a stock has changed '
+                             'over time')
+    parser.add_argument('--backtest', action='store_true',
+                        help='backtests the magic formula over the stored '
+                             'snapshots; honours --top, --min-market-cap')
+    parser.add_argument('--prices', type=str, default=None, metavar='PATH',
+                        help='with --backtest, a CSV or Parquet file (or '
+                             'directory of them) of daily closing prices')
+    parser.add_argument('--holding-days', type=int, default=None,
+                        metavar='N',
+                        help='with --backtest, trading days between '
+                             'rebalances')
+    parser.add_argument('--cost-bps', type=float, default=None,
+                        help='with --backtest, transaction costs in basis '
+                             'points')
+    parser.add_argument('--start', type=_parse_date, default=None,
+                        help='with --backtest, the first day (YYYY-MM-DD)')
+    parser.add_argument('--end', type=_parse_date, default=None,
+                        help='with --backtest, the last day (YYYY-MM-DD)')
+    parser.add_argument('--sweep', action='store_true',
+                        help='prints the top stocks under each screen in the '
+                             'config file\'s [Sweep] section; honours --top')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='with --sweep, the number of processes to use; '
+                             '0 means one per core')
+    parser.add_argument('--serve', action='store_true',
+                        help='serves the ranking as JSON over HTTP, until '
+                             'interrupted')
     parser.add_argument('--config', type=str, default='config.ini',
                         help='specifies the path to the config file')
     args = parser.parse_args()
 
     stockrank = StockRank(args.config)
 
+    if args.serve:
+        stockrank.serve()
+        return
+
+    if args.backtest:
+        stockrank.backtest(args.prices, args.top, args.holding_days,
+                           args.cost_bps, args.min_market_cap, args.start,
+                           args.end)
+        return
+
+    if args.sweep:
+        stockrank.sweep(args.top, args.processes)
+        return
+
     if args.download:
-        stockrank.download()
+        stockrank.download(args.stale_after, args.resume)
+    elif args.enqueue:
+        stockrank.enqueue(args.stale_after)
+    elif args.work:
+        stockrank.work()
+    elif args.reparse:
+        stockrank.reparse()
+    elif args.as_of:
+        stockrank.load_snapshot(args.as_of)
+    elif args.import_path:
+        stockrank.load_file(args.import_path, args.top, args.sector,
+                            args.min_market_cap)
     else:
-        stockrank.load_local()
+        stockrank.load_local(args.top, args.sector, args.min_market_cap)
+
+    if args.export:
+        stockrank.export(args.export)
 
     if args.show:
         stockrank.print_stocks()
 
+    if args.history:
+        stockrank.print_history(args.history)
+
+    if args.progress:
+        stockrank.print_progress()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,207 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+import urllib.parse
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, float('inf'))
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, value.replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Histogram(object):
+    """A histogram with fixed bucket bounds, in the style of Prometheus.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': dict(zip(map(_format_bound, self.bounds),
+                                    self.counts)),
+                'sum': self.sum,
+                'count': self.count}
+
+
+class Metrics(object):
+    """Records the metrics of a run: wall time per phase, labelled counters
+    and labelled histograms. Thread-safe, and cheap enough to leave on; each
+    update is a dict lookup under a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discards everything recorded so far.
+        """
+        with self._lock:
+            # phase name -> [total seconds, number of times run]
+            self._phases = {}
+            # (name, label key) -> value
+            self._counters = {}
+            # (name, label key) -> Histogram
+            self._histograms = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager which adds the wall time spent in its body to a
+        phase. A phase run by several threads at once accumulates the time
+        spent in each of them.
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                phase = self._phases.setdefault(name, [0.0, 0])
+                phase[0] += elapsed
+                phase[1] += 1
+
+    def increment(self, name, amount=1, **labels):
+        """Adds to a counter, eg increment('skipped', reason='delisted').
+        """
+        key = (name, _label_key(labels))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, bounds=LATENCY_BUCKETS, **labels):
+        """Records a value, eg a latency in seconds, in a histogram. The
+        bucket bounds are fixed by the first observation of a histogram.
+        """
+        key = (name, _label_key(labels))
+
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(bounds)
+            self._histograms[key].observe(value)
+
+    def request(self, url, seconds, size, status):
+        """Records a completed HTTP request: its latency, in a per-host
+        histogram, and the number of bytes and requests, in per-host counters.
+        """
+        host = urllib.parse.urlsplit(url).hostname
+        self.observe('request_seconds', seconds, host=host)
+        self.increment('requests', host=host, status=status)
+        self.increment('bytes', size, host=host)
+
+    def counter(self, name, **labels):
+        """Returns the current value of a counter.
+        """
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def to_dict(self):
+        """Returns everything recorded, as a JSON-serialisable dict.
+        """
+        with self._lock:
+            return {
+                'phases': {name: {'seconds': seconds, 'count': count}
+                           for name, (seconds, count) in self._phases.items()},
+                'counters': [dict(key, name=name, value=value)
+                             for (name, key), value in self._counters.items()],
+                'histograms': [dict(key, name=name, **histogram.to_dict())
+                               for (name, key), histogram
+                               in self._histograms.items()],
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """Returns everything recorded in the Prometheus text exposition
+        format.
+        """
+        lines = []
+
+        with self._lock:
+            if self._phases:
+                lines.append('# TYPE stockrank_phase_seconds_total counter')
+                for name, (seconds, _) in sorted(self._phases.items()):
+                    lines.append('stockrank_phase_seconds_total%s %r'
+                                 % (_format_labels((('phase', name),)),
+                                    seconds))
+
+            for name in sorted(set(name for name, _ in self._counters)):
+                lines.append('# TYPE stockrank_%s_total counter' % name)
+                for (counter, key), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append('stockrank_%s_total%s %r'
+                                     % (name, _format_labels(key), value))
+
+            for name in sorted(set(name for name, _ in self._histograms)):
+                lines.append('# TYPE stockrank_%s histogram' % name)
+                for (histogram_name, key), histogram in \
+                        sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds,
+                                            histogram.counts):
+                        cumulative += count
+                        lines.append('stockrank_%s_bucket%s %d' % (
+                            name,
+                            _format_labels(key, (('le',
+                                                  _format_bound(bound)),)),
+                            cumulative))
+                    lines.append('stockrank_%s_sum%s %r'
+                                 % (name, _format_labels(key), histogram.sum))
+                    lines.append('stockrank_%s_count%s %d'
+                                 % (name, _format_labels(key),
+                                    histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Returns a short, human-readable summary of the phases.
+        """
+        with self._lock:
+            return ', '.join('%s %.1fs' % (name, seconds)
+                             for name, (seconds, _) in self._phases.items())
+
+    def dump(self, json_path=None, prometheus_path=None):
+        """Writes everything recorded to the given files. Either path may be
+        None (or empty) to skip that format.
+        """
+        if json_path:
+            with open(json_path, 'w') as f:
+                f.write(self.to_json())
+
+        if prometheus_path:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.to_prometheus())
+
+
+# shared by the whole process
+metrics = Metrics()
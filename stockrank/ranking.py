@@ -0,0 +1,91 @@
+import numpy as np
+
+
+def _value(obj, attr):
+    """Returns an attribute of an object as a float, or NaN if the attribute
+    is missing or can't be computed (eg a derived property over None fields).
+    """
+    try:
+        value = getattr(obj, attr)
+    except (TypeError, ZeroDivisionError):
+        return np.nan
+
+    return np.nan if value is None else value
+
+
+def column(objects, attr):
+    """Builds a float64 NumPy column from an attribute of each object.
+    Missing values become NaN.
+    """
+    return np.fromiter((_value(x, attr) for x in objects),
+                       dtype=np.float64, count=len(objects))
+
+
+def earnings_yields(ebit, market_cap, total_debt, cash):
+    """Returns a column of earnings yields (EBIT / enterprise value). Rows
+    where any input is missing, or the enterprise value is zero, are NaN.
+
+    Arguments:
+    ebit, market_cap, total_debt, cash -- Equal-length float64 arrays.
+    """
+    enterprise_value = market_cap + total_debt - cash
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = ebit / enterprise_value
+
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def descending_order(values):
+    """Returns the index permutation which sorts a column from highest to
+    lowest. Ties keep their original order, and NaN values always come last.
+
+    Arguments:
+    values -- A float64 array.
+    """
+    # negate so a stable ascending sort gives us a stable descending order;
+    # NaN stays NaN, and argsort places it at the end
+    return np.argsort(-values, kind='stable')
+
+
+def metric_ranks(values):
+    """Returns the rank of each row of a column (0 is best, ie the highest
+    value). Ties are broken by original order, and NaN values rank last.
+    """
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[descending_order(values)] = np.arange(len(values))
+    return ranks
+
+
+def magic_formula_ranks(earnings_yield, return_on_capital):
+    """Ranks rows by both earnings yield and return on capital.
+
+    Returns a tuple of (earnings yield ranks, return on capital ranks, index
+    permutation). The permutation orders rows by the sum of both ranks, with
+    ties broken by original order.
+    """
+    by_earnings = metric_ranks(earnings_yield)
+    by_roc = metric_ranks(return_on_capital)
+    order = np.argsort(by_earnings + by_roc, kind='stable')
+    return by_earnings, by_roc, order
+
+
+def profile_ranks(stock_profiles):
+    """Ranks a list of StockProfile objects according to the magic formula.
+    Returns the same tuple as magic_formula_ranks().
+    """
+    earnings_yield = earnings_yields(column(stock_profiles, 'ebit'),
+                                     column(stock_profiles, 'market_cap'),
+                                     column(stock_profiles, 'total_debt'),
+                                     column(stock_profiles, 'cash'))
+    return_on_capital = column(stock_profiles, 'return_on_capital')
+
+    return magic_formula_ranks(earnings_yield, return_on_capital)
+
+
+def rank_profiles(stock_profiles):
+    """Ranks a list of StockProfile objects according to the magic formula,
+    and returns the ranked index permutation as a NumPy array.
+    """
+    return profile_ranks(stock_profiles)[2]
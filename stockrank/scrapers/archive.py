@@ -0,0 +1,82 @@
+import itertools
+import sqlite3
+import threading
+import zlib
+from stockrank.helpers import timestamp
+
+
+def decompress(body):
+    """Returns the text of a page stored in the archive.
+    """
+    return zlib.decompress(body).decode('utf-8')
+
+
+class PageArchive(object):
+    """An append-only archive of every page fetched from MorningStar, stored
+    zlib-compressed in SQLite and indexed by symbol, page type and fetch time.
+    Pages in the archive can be parsed again later without any network
+    access.
+    """
+    def __init__(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS pages '
+                   '(id INTEGER PRIMARY KEY,'
+                   'symbol TEXT,'
+                   'page_type TEXT,'
+                   'fetched_at REAL,'
+                   'url TEXT,'
+                   'body BLOB)')
+        db.execute('CREATE INDEX IF NOT EXISTS pages_symbol_type_time '
+                   'ON pages (symbol, page_type, fetched_at)')
+        db.commit()
+        self._db = db
+        self._lock = threading.Lock()
+
+    def store(self, symbol, page_type, url, text, fetched_at=None):
+        """Adds a page to the archive.
+        """
+        body = zlib.compress(text.encode('utf-8'), 6)
+
+        with self._lock:
+            self._db.execute('INSERT INTO pages (symbol, page_type, '
+                             'fetched_at, url, body) VALUES (?, ?, ?, ?, ?)',
+                             (symbol, page_type, fetched_at or timestamp(),
+                              url, body))
+            self._db.commit()
+
+    def latest(self, symbol, page_type):
+        """Returns the text of the most recently fetched page of a given type
+        for a stock, or None if it isn't in the archive.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body FROM pages WHERE symbol = ? AND page_type = ? '
+                'ORDER BY fetched_at DESC LIMIT 1',
+                (symbol, page_type)).fetchone()
+
+        return decompress(row[0]) if row else None
+
+    def latest_pages(self, page_types):
+        """Yields a tuple of (symbol, compressed pages) for each stock which
+        has every one of the given page types archived. Compressed pages are
+        the latest of each type, in the order of page_types; see decompress().
+        """
+        # SQLite returns the body of the row holding the max(fetched_at). we
+        # use our own cursor, so rows are streamed rather than all loaded
+        rows = self._db.cursor().execute(
+            'SELECT symbol, page_type, body, max(fetched_at) FROM pages '
+            'GROUP BY symbol, page_type ORDER BY symbol')
+
+        symbol = None
+        pages = {}
+
+        # the sentinel row flushes the last symbol
+        for row_symbol, page_type, body, _ in \
+                itertools.chain(rows, [(None, None, None, None)]):
+            if row_symbol != symbol:
+                if all(page in pages for page in page_types):
+                    yield symbol, tuple(pages[page] for page in page_types)
+                symbol = row_symbol
+                pages = {}
+
+            pages[page_type] = body
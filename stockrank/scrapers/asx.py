@@ -1,39 +1,188 @@
 import csv
+import io
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
 import urllib.request
+from stockrank.helpers import rebase_url, timestamp
+from stockrank.exceptions import CircuitOpenException, \
+    RequestFailedException
+from stockrank.scrapers.executor import request_executor
+from stockrank.metrics import metrics
 
 
 class AsxScraper(object):
     """Class to scrape stock data from ASX. We use this to grab the sector for
     each stock.
+
+    The list of sectors is parsed as it's downloaded, and stored in a
+    'sectors' table, so it's only downloaded again once it's older than its
+    time-to-live. Each download is recorded in 'sector_fetches', whose latest
+    id is the version of the sectors table. If the ASX can't be reached, the
+    last sectors stored are used, however old.
     """
     URL = 'http://www.asx.com.au/asx/research/ASXListedCompanies.csv'
 
-    def __init__(self):
-        self._stock_sectors = {}
+    # lines before the first row of the CSV: a title, a blank line, and the
+    # column names
+    HEADER_LINES = 3
 
-    def _scrape(self):
-        """Scrapes stock data from ASX. To be called only once.
+    def __init__(self, path=':memory:', ttl=0, root=None):
+        """Arguments:
+        path -- SQLite database to store the sectors in, eg our stock
+                database. By default they're only kept in memory.
+        ttl -- Seconds for which stored sectors may be used.
+        root -- If given, the list is downloaded from this site instead of
+                the ASX, eg 'http://127.0.0.1:8081'.
         """
+        self._url = rebase_url(self.URL, root)
+        self._ttl = ttl
+        self._stock_sectors = {}
 
-        response = urllib.request.urlopen(self.URL)
-        data = response.read().decode('utf-8')
+        # lookups may come from a different thread to the one creating us
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS sectors '
+                   '(symbol TEXT PRIMARY KEY,'
+                   'sector TEXT) WITHOUT ROWID')
+        db.execute('CREATE TABLE IF NOT EXISTS sector_fetches '
+                   '(id INTEGER PRIMARY KEY,'
+                   'fetched_at REAL,'
+                   'etag TEXT,'
+                   'last_modified TEXT,'
+                   'count INTEGER)')
+        db.commit()
+        self._db = db
+        self._lock = threading.Lock()
 
-        csv_reader = csv.reader(data.splitlines())
+    def _latest_fetch(self):
+        return self._db.execute(
+            'SELECT fetched_at, etag, last_modified FROM sector_fetches '
+            'ORDER BY id DESC LIMIT 1').fetchone()
+
+    def _ingest(self, response):
+        """Stream-parses the CSV from a response into the sectors table,
+        replacing its contents, and returns the number of stocks stored.
+        Must be called with the lock held.
+        """
+        lines = io.TextIOWrapper(response, encoding='utf-8', newline='')
+        csv_reader = csv.reader(lines)
 
         # skip headers
-        next(csv_reader)
-        next(csv_reader)
-        next(csv_reader)
+        for _ in range(self.HEADER_LINES):
+            next(csv_reader)
 
-        for row in csv_reader:
-            self._stock_sectors[row[1]] = row[2]
+        self._db.execute('DELETE FROM sectors')
+        self._db.executemany(
+            'INSERT OR REPLACE INTO sectors VALUES (?, ?)',
+            ((sys.intern(row[1]), sys.intern(row[2]))
+             for row in csv_reader if len(row) > 2))
+        return self._db.execute('SELECT count(*) FROM sectors').fetchone()[0]
 
-    def sector(self, symbol):
-        """Returns the sector for a given stock. On the first run of this
-        function, all the stock data will be scraped from ASX. As such, the
-        first call will always be slower.
+    @staticmethod
+    def _open(url, request):
+        return urllib.request.urlopen(request)
+
+    def _refresh(self):
+        """Downloads the CSV into the sectors table, unless the sectors we
+        have are still fresh. Must be called with the lock held.
+        """
+        latest = self._latest_fetch()
+        headers = {}
+
+        if latest:
+            fetched_at, etag, last_modified = latest
+
+            if timestamp() - fetched_at < self._ttl:
+                return
+
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        request = urllib.request.Request(self._url, headers=headers)
+        start = time.perf_counter()
+
+        try:
+            with request_executor.execute(self._url, self._open,
+                                          request) as response:
+                count = self._ingest(response)
+                status = response.status
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                size = int(response.headers.get('Content-Length') or 0)
+        except (urllib.error.URLError, CircuitOpenException,
+                RequestFailedException) as e:
+            # urllib treats '304 Not Modified' as an error
+            if getattr(e, 'code', None) == 304:
+                metrics.request(self._url, time.perf_counter() - start, 0,
+                                e.code)
+                self._db.execute('INSERT INTO sector_fetches (fetched_at, '
+                                 'etag, last_modified, count) SELECT ?, '
+                                 'etag, last_modified, count FROM '
+                                 'sector_fetches ORDER BY id DESC LIMIT 1',
+                                 (timestamp(),))
+                self._db.commit()
+                return
+
+            # any other failure, eg an outage answering 503s, falls back on
+            # the sectors we have
+            if latest is None:
+                raise
+
+            self._db.rollback()
+            print('ASX unreachable (%s), using sectors from %s'
+                  % (getattr(e, 'reason', e), time.ctime(latest[0])))
+            return
+
+        metrics.request(self._url, time.perf_counter() - start, size, status)
+
+        # the new sectors only replace the old ones along with this record
+        self._db.execute('INSERT INTO sector_fetches (fetched_at, etag, '
+                         'last_modified, count) VALUES (?, ?, ?, ?)',
+                         (timestamp(), etag, last_modified, count))
+        self._db.commit()
+
+    def _load(self):
+        """Loads the sectors into memory, downloading them first if needed.
         """
-        if not self._stock_sectors:
-            self._scrape()
+        with self._lock:
+            if self._stock_sectors:
+                return
+
+            with metrics.phase('sectors'):
+                try:
+                    self._refresh()
+                except Exception:
+                    # don't leave a half-replaced table behind
+                    self._db.rollback()
+                    raise
+
+            self._stock_sectors = dict(
+                self._db.execute('SELECT symbol, sector FROM sectors'))
 
+    def version(self):
+        """Returns the version of the stored sectors, which increases every
+        time they're downloaded or revalidated, or None if there are none.
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT max(id) FROM sector_fetches').fetchone()[0]
+
+    def sector(self, symbol):
+        """Returns the sector for a given stock. On the first call, the
+        sectors are loaded from our database, or from the ASX if they've
+        expired, so the first call will always be slower.
+        """
+        self._load()
         return self._stock_sectors[symbol]
+
+    def relation(self):
+        """Returns a dict mapping the symbol of every stock listed on the ASX
+        to a record of its 'sector' field.
+        """
+        self._load()
+        return {symbol: {'sector': sector}
+                for symbol, sector in self._stock_sectors.items()}
@@ -0,0 +1,171 @@
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from stockrank.helpers import timestamp
+from stockrank.metrics import metrics
+
+
+class ResponseCache(object):
+    """An on-disk cache of HTTP responses, keyed by URL and stored in SQLite.
+
+    Entries younger than their time-to-live are served without touching the
+    network. Older entries are revalidated with the ETag / Last-Modified
+    headers the server gave us, so an unchanged page costs a '304 Not
+    Modified' rather than a full download. When the cache grows beyond
+    max_size bytes, the least recently used entries are evicted.
+    """
+    def __init__(self, path, max_size=256 * 1024 * 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS responses '
+                   '(url TEXT PRIMARY KEY,'
+                   'body TEXT,'
+                   'etag TEXT,'
+                   'last_modified TEXT,'
+                   'fetched_at REAL,'
+                   'accessed_at REAL,'
+                   'size INTEGER)')
+        db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                   'ON responses (accessed_at)')
+        db.commit()
+        self._db = db
+        self._lock = threading.Lock()
+
+    def _lookup(self, url):
+        with self._lock:
+            return self._db.execute(
+                'SELECT body, etag, last_modified, fetched_at '
+                'FROM responses WHERE url = ?', (url,)).fetchone()
+
+    def _touch(self, url, fetched_at=None):
+        """Marks an entry as recently used and, when given, re-validated at
+        'fetched_at'.
+        """
+        with self._lock:
+            if fetched_at is None:
+                self._db.execute('UPDATE responses SET accessed_at = ? '
+                                 'WHERE url = ?', (timestamp(), url))
+            else:
+                self._db.execute('UPDATE responses SET accessed_at = ?, '
+                                 'fetched_at = ? WHERE url = ?',
+                                 (timestamp(), fetched_at, url))
+            self._db.commit()
+
+    def _store(self, url, body, headers):
+        now = timestamp()
+        size = len(body.encode('utf-8'))
+
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES '
+                             '(?, ?, ?, ?, ?, ?, ?)',
+                             (url, body, headers.get('ETag'),
+                              headers.get('Last-Modified'), now, now, size))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Deletes the least recently used entries until the cache fits in
+        max_size. Must be called with the lock held.
+        """
+        total = self._db.execute(
+            'SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        lru = self._db.execute('SELECT url, size FROM responses '
+                               'ORDER BY accessed_at').fetchall()
+
+        for url, size in lru:
+            if total <= self.max_size:
+                break
+            self._db.execute('DELETE FROM responses WHERE url = ?', (url,))
+            total -= size
+
+    def fetch(self, url, ttl, opener):
+        """Returns the body of the page at the given URL, from the cache if
+        possible.
+
+        Arguments:
+        url -- The URL to fetch.
+        ttl -- Seconds for which a cached copy can be used without
+               revalidating it with the server.
+        opener -- A function taking (url, request headers), which performs
+                  the request and returns (status code, response headers,
+                  body text). See urllib_opener().
+        """
+        entry = self._lookup(url)
+        request_headers = {}
+
+        if entry:
+            body, etag, last_modified, fetched_at = entry
+
+            if timestamp() - fetched_at < ttl:
+                self.hits += 1
+                self._touch(url)
+                return body
+
+            if etag:
+                request_headers['If-None-Match'] = etag
+            if last_modified:
+                request_headers['If-Modified-Since'] = last_modified
+
+        status, headers, text = opener(url, request_headers)
+
+        if status == 304 and entry:
+            self.revalidated += 1
+            self._touch(url, fetched_at=timestamp())
+            return entry[0]
+
+        self.misses += 1
+
+        # error pages (which some openers return rather than raise) are
+        # passed through, so they aren't served again as hits
+        if 200 <= status < 300:
+            self._store(url, text, headers)
+
+        return text
+
+    def report(self):
+        """Returns a one-line summary of cache usage during this run.
+        """
+        return ('cache: %d hits, %d revalidated, %d misses'
+                % (self.hits, self.revalidated, self.misses))
+
+
+def urllib_opener(url, headers):
+    """Performs a GET request using urllib. Suitable as an opener for
+    ResponseCache.fetch().
+    """
+    request = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        metrics.request(url, time.perf_counter() - start, 0, e.code)
+        # urllib treats '304 Not Modified' as an error
+        if e.code == 304:
+            return e.code, e.headers, None
+        raise
+
+    data = response.read()
+    metrics.request(url, time.perf_counter() - start, len(data),
+                    response.status)
+    return response.status, response.headers, data.decode('utf-8')
+
+
+def cached_fetch(cache, url, ttl, opener):
+    """Fetches a URL through the given ResponseCache, or straight from the
+    network if cache is None.
+    """
+    if cache is None:
+        return opener(url, {})[2]
+
+    return cache.fetch(url, ttl, opener)
@@ -0,0 +1,298 @@
+import random
+import threading
+import time
+import urllib.parse
+from stockrank.scrapers.throttle import rate_limiter
+from stockrank.exceptions import CircuitOpenException, \
+    RequestFailedException
+from stockrank.metrics import metrics
+
+
+def _status(result):
+    """Returns the HTTP status of a request's result: either an opener's
+    (status, headers, body) tuple, or a response object.
+    """
+    if isinstance(result, tuple):
+        return result[0]
+
+    return getattr(result, 'status', None) or \
+        getattr(result, 'status_code', None)
+
+
+def _overloaded(status):
+    # statuses telling us to back off, rather than that the request is bad
+    return status == 429 or status is not None and status >= 500
+
+
+class AdaptiveLimit(object):
+    """Limits the number of requests in flight to a host, adjusting the limit
+    AIMD-style (as TCP does): it grows by one for each limit's worth of fast,
+    successful requests, and halves when the host is overloaded, ie responds
+    with a 429 or 5xx, fails to respond, or responds much slower than usual.
+    """
+    def __init__(self, initial=1, maximum=16, minimum=1, tolerance=2.0):
+        """Arguments:
+        initial, maximum, minimum -- Number of requests allowed in flight.
+        tolerance -- A request taking more than this many times the usual
+                     latency counts as a sign of overload.
+        """
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.in_flight = 0
+        # exponentially weighted moving average of successful latencies
+        self.latency = None
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until another request may be sent.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, seconds, overloaded):
+        """Records the outcome of a request sent after acquire().
+
+        Arguments:
+        seconds -- The request's latency.
+        overloaded -- True if the host signalled it's overloaded.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            slow = self.latency is not None and \
+                seconds > self.latency * self.tolerance
+
+            if overloaded or slow:
+                # requests already in flight will report the same overload,
+                # so only back off once per round trip
+                if now - self._decreased_at > (self.latency or seconds):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = now
+            else:
+                self.limit = min(self.maximum,
+                                 self.limit + 1 / int(self.limit))
+
+            if not overloaded:
+                self.latency = seconds if self.latency is None else \
+                    0.9 * self.latency + 0.1 * seconds
+
+            self._condition.notify_all()
+
+
+class CircuitBreaker(object):
+    """Stops requests to a host which keeps failing. After 'threshold'
+    consecutive failures the circuit opens, and requests fail straight away
+    for 'reset_after' seconds. A single request is then let through; if it
+    succeeds the circuit closes again, otherwise it stays open for another
+    period.
+    """
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before(self, host):
+        """Raises CircuitOpenException if a request may not be sent now.
+        Otherwise returns True if the request is the trial of an open
+        circuit, which must be passed on to record() or abandon().
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            if self._trial or \
+                    time.monotonic() - self._opened_at < self.reset_after:
+                raise CircuitOpenException('too many failures from %s; not '
+                                           'sending requests' % host)
+
+            self._trial = True
+            return True
+
+    def abandon(self, trial):
+        """Lets another trial through, if the trial request ended without an
+        outcome, eg because it raised something other than a network error.
+        """
+        if trial:
+            with self._lock:
+                self._trial = False
+
+    def record(self, success, trial=False):
+        """Records the outcome of a request. trial is before()'s result for
+        it; only the trial itself ends the trial, not other requests which
+        were already in flight.
+        """
+        with self._lock:
+            if trial:
+                self._trial = False
+
+            if success:
+                self.failures = 0
+                self._opened_at = None
+                return
+
+            self.failures += 1
+
+            if self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class RequestExecutor(object):
+    """Sends requests on behalf of every scraper. For each host, it keeps an
+    AdaptiveLimit on the requests in flight, and a CircuitBreaker. Requests
+    also wait for the host's shared rate limit (see throttle.rate_limiter).
+
+    A request which fails to connect, or gets a 429 or 5xx response, is
+    retried with exponential backoff and full jitter, up to 'retries' times.
+    """
+    def __init__(self, retries=5, backoff=0.5, max_backoff=30.0,
+                 initial_concurrency=1, max_concurrency=16,
+                 failure_threshold=5, reset_after=30.0):
+        """Arguments:
+        retries -- Number of times a failed request is retried.
+        backoff -- Seconds of the first backoff; each retry doubles it, up to
+                   max_backoff.
+        initial_concurrency, max_concurrency -- Bounds of each host's limit on
+                                                requests in flight.
+        failure_threshold, reset_after -- See CircuitBreaker.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, host):
+        """Returns the (AdaptiveLimit, CircuitBreaker) of a host, creating
+        them if necessary.
+        """
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (
+                    AdaptiveLimit(self.initial_concurrency,
+                                  self.max_concurrency),
+                    CircuitBreaker(self.failure_threshold, self.reset_after))
+            return self._hosts[host]
+
+    def _delay(self, attempt, retry_after=None):
+        """Returns the seconds to wait before a retry: a server's Retry-After
+        if it gave one, otherwise a random backoff.
+        """
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                # an HTTP date; fall back to our own backoff
+                pass
+
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    def execute(self, url, send, *args):
+        """Calls send(url, *args) to send a request to the given URL, and
+        returns its result: either an opener's (status, headers, body) tuple
+        or a response object. Raises CircuitOpenException if the host's
+        circuit is open, and RequestFailedException if the request still
+        fails after every retry.
+        """
+        host = urllib.parse.urlsplit(url).hostname
+        limit, breaker = self.host(host)
+
+        # a request already under way finishes its retries, even if they
+        # open the circuit
+        trial = breaker.before(host)
+
+        try:
+            for attempt in range(self.retries + 1):
+                limit.acquire()
+                rate_limiter.acquire(url)
+
+                start = time.perf_counter()
+                error = None
+                result = None
+
+                try:
+                    result = send(url, *args)
+                    status = _status(result)
+                except OSError as e:
+                    # includes urllib's HTTPError, and requests' exceptions
+                    error = e
+                    status = getattr(e, 'code', None)
+                except BaseException:
+                    # not a network problem, so don't count it against the host
+                    limit.release(time.perf_counter() - start, False)
+                    raise
+
+                overloaded = _overloaded(status) or \
+                    (error is not None and status is None)
+                limit.release(time.perf_counter() - start, overloaded)
+                breaker.record(not overloaded, trial)
+                trial = False
+
+                if not overloaded:
+                    if error is not None:
+                        # eg a 404; retrying won't help
+                        raise error
+                    return result
+
+                if attempt == self.retries:
+                    break
+
+                metrics.increment('retries', host=host)
+
+                if isinstance(result, tuple):
+                    headers = result[1] or {}
+                else:
+                    headers = getattr(result if error is None else error,
+                                      'headers', None) or {}
+                time.sleep(self._delay(attempt, headers.get('Retry-After')))
+
+            metrics.increment('failures', host=host)
+
+            # callers may be expecting the exception their request raised
+            if error is not None:
+                raise error
+
+            raise RequestFailedException('%s failed with status %s after %d '
+                                         'attempts'
+                                         % (url, status, self.retries + 1))
+        finally:
+            # a trial which raised something other than a network error, and
+            # so has no outcome, mustn't keep the circuit open for good
+            breaker.abandon(trial)
+
+    def reset(self):
+        """Forgets the limits and circuit breakers of every host.
+        """
+        with self._lock:
+            self._hosts = {}
+
+    def configure(self, retries=None, initial_concurrency=None,
+                  max_concurrency=None, failure_threshold=None,
+                  reset_after=None):
+        """Changes the executor's settings. Hosts already seen keep theirs.
+        """
+        settings = {'retries': retries,
+                    'initial_concurrency': initial_concurrency,
+                    'max_concurrency': max_concurrency,
+                    'failure_threshold': failure_threshold,
+                    'reset_after': reset_after}
+
+        for name, value in settings.items():
+            if value is not None:
+                setattr(self, name, value)
+
+
+# shared by all scrapers in the process
+request_executor = RequestExecutor()
@@ -1,7 +1,14 @@
+import io
+import time
+import urllib.parse
 import urllib.request
-import json
+from stockrank.scrapers.cache import urllib_opener
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.jsonstream import iter_array
 from stockrank.stock import StockProfile
 from stockrank.exceptions import FieldMissingException
+from stockrank.helpers import parse_market_cap, rebase_url
+from stockrank.metrics import metrics
 
 
 class GoogleScraper(object):
@@ -12,8 +19,17 @@ class GoogleScraper(object):
     """
     BASE_URL = 'https://www.google.com/finance'
 
-    def __init__(self, min_market_cap):
-
+    def __init__(self, min_market_cap, cache=None, ttl=0, root=None):
+        """Arguments:
+        min_market_cap -- Stocks worth less than this aren't listed.
+        cache -- A ResponseCache, or None to always download the list.
+        ttl -- Seconds for which a cached list may be used.
+        root -- If given, the list is requested from this site instead of
+                Google, eg 'http://127.0.0.1:8081'.
+        """
+        self._url = rebase_url(self.BASE_URL, root)
+        self._cache = cache
+        self._ttl = ttl
         self._request_values = {
             'output': 'json',
             'start': 0,
@@ -24,66 +40,101 @@ class GoogleScraper(object):
             'restype': 'company'
         }
 
-    def _load_json(self):
-        """Sends request to Google and loads the JSON file returned.  The
-        contents of this file are returned.
+    def _open_json(self):
+        """Sends request to Google, and returns the JSON it returns as a text
+        stream.
         """
         url_values = urllib.parse.urlencode(self._request_values, False)
         url_values = url_values.replace('%5B', '[')
         url_values = url_values.replace('%5D', ']')
-        full_url = self.BASE_URL + '?' + url_values
-        response = urllib.request.urlopen(full_url)
-        return response.read().decode('utf-8')
-
-    def _scrape_field(self, columns, title):
-        """Scrapes an individual field from the JSON file.
-
-        Arguments:
-        columns -- A JSON element containing our field.
-        title -- The title of the field to scrape.
+        full_url = self._url + '?' + url_values
+
+        if self._cache is not None:
+            def opener(url, headers):
+                return request_executor.execute(url, urllib_opener, headers)
+
+            return io.StringIO(self._cache.fetch(full_url, self._ttl,
+                                                 opener))
+
+        # without a cache, the response is decoded as it arrives
+        start = time.perf_counter()
+        response = request_executor.execute(full_url,
+                                            urllib.request.urlopen)
+        metrics.request(full_url, time.perf_counter() - start,
+                        int(response.headers.get('Content-Length') or 0),
+                        response.status)
+        return io.TextIOWrapper(response, encoding='utf-8')
+
+    def _index_columns(self, columns):
+        """Returns a dict mapping the name of each field in a result's
+        columns to its value. If a field appears twice, the first wins.
         """
+        fields = {}
+
         for col in columns:
+            fields.setdefault(col['field'], col['value'])
 
-            # a '-' means no result
-            if col['field'] == title and col['value'] != '-':
-                return col['value']
+        return fields
 
-        raise FieldMissingException('field "' + title + '" missing')
+    def _scrape_field(self, fields, title):
+        """Scrapes an individual field from a result.
 
-    def _scrape_market_cap(self, columns):
-        """Scrapes the market cap field from the JSON. As the field is in format
-        '50M', '10B', etc, we need to convert it to a valid integral value.
+        Arguments:
+        fields -- A result's fields, as returned by _index_columns().
+        title -- The title of the field to scrape.
         """
-        market_cap = self._scrape_field(columns, 'MarketCap')
+        value = fields.get(title, '-')
 
-        if 'B' in market_cap:
-            market_cap = float(market_cap.strip('B'))
-            market_cap = int(market_cap * 1000000000)
-        elif 'M' in market_cap:
-            market_cap = float(market_cap.strip('M'))
-            market_cap = int(market_cap * 1000000)
+        # a '-' means no result
+        if value == '-':
+            raise FieldMissingException('field "' + title + '" missing')
 
-        return market_cap
+        return value
 
-    def scrape_stock_profiles(self):
-        """Scrapes and returns stock profiles from Google. Note that the only
-        fields scraped the symbol, market cap and title.
+    def _scrape_market_cap(self, fields):
+        """Scrapes the market cap field from a result. As the field is in
+        format '50M', '10B', etc, we need to convert it to a valid integral
+        value.
         """
-        data = self._load_json()
-        data = data.replace('\\x', '\\u00')
-        json_data = json.loads(data)
+        return parse_market_cap(self._scrape_field(fields, 'MarketCap'))
 
-        stock_profiles = []
-
-        for result in json_data['searchresults']:
+    def _decode(self, stream):
+        """Yields a StockProfile for each result in an open JSON stream, as
+        it's decoded, then closes the stream.
+        """
+        with stream:
+            # Google escapes some characters as '\xNN', which isn't valid
+            # JSON; the decoder fixes them as it goes
+            results = iter_array(stream, 'searchresults', fix_escapes=True)
 
-            symbol = result['ticker']
-            title = result['title']
-            market_cap = self._scrape_market_cap(result['columns'])
+            for result in results:
+                fields = self._index_columns(result['columns'])
 
-            stock_profile = StockProfile(symbol=symbol, title=title,
-                                         market_cap=market_cap)
+                yield StockProfile(symbol=result['ticker'],
+                                   title=result['title'],
+                                   market_cap=self._scrape_market_cap(fields))
 
-            stock_profiles.append(stock_profile)
+    def scrape_stock_profiles(self):
+        """Scrapes stock profiles from Google, yielding each one as it's
+        decoded. Note that the only fields scraped the symbol, market cap and
+        title.
+        """
+        yield from self._decode(self._open_json())
+
+    def records(self):
+        """Sends the request to Google, and returns an iterator of (symbol,
+        record) tuples, in Google's order, where each record holds a stock's
+'title' and 'market_cap' fields. Stocks are decoded as the iterator
+        is consumed, so the response is never held in memory as text. The
+        iterator should be consumed promptly, as it reads from the open
+        connection.
+        """
+        return ((stock.symbol, {'title': stock.title,
+                                'market_cap': stock.market_cap})
+                for stock in self._decode(self._open_json()))
 
-        return stock_profiles
+    def relation(self):
+        """Returns the stocks from Google as a dict mapping each symbol to a
+        record of its 'title' and 'market_cap' fields, in Google's order.
+        """
+        return dict(self.records())
@@ -0,0 +1,180 @@
+import json
+
+# characters read from a stream at once
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+def fix_hex_escapes(chunks):
+    """Rewrites the '\\xNN' escapes some servers (eg Google) put in JSON,
+    which isn't valid JSON, as '\\u00NN'. Works on an iterable of text
+    chunks, yielding fixed chunks, so the payload is never copied as a whole.
+    Escaped backslashes ('\\\\x') are left alone.
+    """
+    # a backslash at the end of a chunk escapes the start of the next one
+    escaped = False
+
+    for chunk in chunks:
+        if '\\' not in chunk and not escaped:
+            yield chunk
+            continue
+
+        out = []
+        start = 0
+        i = 0
+
+        if escaped:
+            if chunk[:1] == 'x':
+                out.append('u00')
+                start = i = 1
+            else:
+                i = 1
+            escaped = False
+
+        while True:
+            i = chunk.find('\\', i)
+
+            if i == -1:
+                break
+
+            if i + 1 == len(chunk):
+                escaped = True
+                break
+
+            if chunk[i + 1] == 'x':
+                out.append(chunk[start:i])
+                out.append('\\u00')
+                start = i + 2
+
+            i += 2
+
+        out.append(chunk[start:])
+        yield ''.join(out)
+
+
+def _read_chunks(stream, chunk_size):
+    while True:
+        chunk = stream.read(chunk_size)
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+class _Reader(object):
+    """A window over a stream of JSON text, holding only what hasn't been
+    decoded yet.
+    """
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._decoder = json.JSONDecoder()
+        self._eof = False
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self):
+        """Reads another chunk into the buffer, discarding what's been
+        decoded. Returns False at the end of the stream.
+        """
+        chunk = next(self._chunks, None)
+
+        if chunk is None:
+            self._eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next character which isn't whitespace, without
+        consuming it, or '' at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+
+        if not char or char not in chars:
+            raise ValueError('expected one of %r at offset %d, got %r'
+                             % (chars, self.pos, char))
+
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodes and returns the next complete JSON value.
+        """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+
+            # a number at the end of the buffer may continue in the next
+            # chunk, so only trust a value which is followed by something
+            if end < len(self.buf) or self._eof or not self._fill():
+                self.pos = end
+                return value
+
+
+def iter_array(stream, key, chunk_size=CHUNK_SIZE, fix_escapes=False):
+    """Yields the items of an array in a top-level JSON object, eg
+    iter_array(stream, 'searchresults') for '{"searchresults": [...]}', as
+    each is decoded. Only one item is held in memory at a time.
+
+    Arguments:
+    stream -- A file-like object of JSON text.
+    key -- The key of the array in the top-level object.
+    chunk_size -- Number of characters read from the stream at once.
+    fix_escapes -- If True, '\\xNN' escapes are fixed; see fix_hex_escapes().
+    """
+    chunks = _read_chunks(stream, chunk_size)
+
+    if fix_escapes:
+        chunks = fix_hex_escapes(chunks)
+
+    reader = _Reader(chunks)
+    reader.expect('{')
+
+    if reader.peek() == '}':
+        raise KeyError(key)
+
+    while True:
+        name = reader.value()
+        reader.expect(':')
+
+        if name == key:
+            break
+
+        # other members are decoded and thrown away
+        reader.value()
+
+        if reader.expect(',}') == '}':
+            raise KeyError(key)
+
+    reader.expect('[')
+
+    if reader.peek() == ']':
+        return
+
+    while True:
+        yield reader.value()
+
+        if reader.expect(',]') == ']':
+            return
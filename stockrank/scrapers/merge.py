@@ -0,0 +1,98 @@
+from stockrank.stock import StockProfile
+
+# for each StockProfile field, the sources it's taken from in order of
+# preference. the first source with a value for the field wins
+FIELD_PRECEDENCE = {
+    # Google's title and market cap are more up-to-date than MorningStar's
+    'title': ('google', 'morningstar'),
+    'market_cap': ('google', 'morningstar'),
+    'sector': ('asx',),
+    'return_on_capital': ('morningstar',),
+    'ebit': ('morningstar',),
+    'total_debt': ('morningstar',),
+    'cash': ('morningstar',),
+}
+
+
+def hash_join(relations):
+    """Joins relations on their symbols. A relation is a dict mapping each
+    symbol to a record, ie a dict of the fields a source has for it.
+
+    Yields a tuple of (symbol, records, missing) for each symbol in the first
+    relation, in its order. records maps the name of each relation holding the
+    symbol to its record; missing is the name of the first relation which
+    doesn't hold it, or None.
+
+    Arguments:
+    relations -- A list of (name, relation) tuples. The first relation is the
+                 probe side: it drives the join, and may be an iterable of
+                 (symbol, record) tuples, which is consumed as the join is,
+                 so it's never held in memory. The rest are the hash tables
+                 it's probed against, so should be the smaller relations.
+    """
+    (driver_name, driver), probed = relations[0], relations[1:]
+
+    if isinstance(driver, dict):
+        driver = driver.items()
+
+    for symbol, record in driver:
+        records = {driver_name: record}
+        missing = None
+
+        for name, relation in probed:
+            other = relation.get(symbol)
+
+            if other is None:
+                missing = missing or name
+            else:
+                records[name] = other
+
+        yield symbol, records, missing
+
+
+def collapse(precedence, sources, name):
+    """Returns a copy of a precedence table in which the given sources, which
+    have already been merged into a single relation called 'name', are
+    replaced by that relation.
+    """
+    collapsed = {}
+
+    for field, field_sources in precedence.items():
+        names = []
+
+        for source in field_sources:
+            source = name if source in sources else source
+
+            if source not in names:
+                names.append(source)
+
+        collapsed[field] = tuple(names)
+
+    return collapsed
+
+
+def merge_fields(records, precedence=FIELD_PRECEDENCE):
+    """Merges the records of one stock from several sources into a single
+    dict of fields, according to a precedence table like FIELD_PRECEDENCE.
+    Fields none of the sources have are None.
+    """
+    fields = {}
+
+    for field, sources in precedence.items():
+        fields[field] = None
+
+        for source in sources:
+            value = records.get(source, {}).get(field)
+
+            if value is not None:
+                fields[field] = value
+                break
+
+    return fields
+
+
+def merge_profile(symbol, records, precedence=FIELD_PRECEDENCE):
+    """Returns a StockProfile merged from the records of one stock, as for
+    merge_fields().
+    """
+    return StockProfile(symbol=symbol, **merge_fields(records, precedence))
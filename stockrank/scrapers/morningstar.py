@@ -1,17 +1,212 @@
 import time
-import re
-from bs4 import BeautifulSoup
 import ssl
-import random
-import requests
-import itertools
+import lxml.html
+from lxml import etree
+import threading
+import urllib.parse
 
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.poolmanager import PoolManager
 
-from stockrank.helpers import timestamp
-from stockrank.exceptions import FieldMissingException
+from stockrank.exceptions import FieldMissingException, \
+    LoginFailedException, SessionExpiredException
 from stockrank.stock import StockProfile
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.cache import cached_fetch
+from stockrank.scrapers.archive import decompress
+from stockrank.scrapers.sessions import SessionPool
+from stockrank.metrics import metrics
+from stockrank.helpers import rebase_url
+
+
+LOGIN_URL = 'https://www.morningstar.com.au/Security/Login'
+
+# page types, as stored in the page archive
+HISTORICALS = 'historicals'
+BALANCESHEET = 'balancesheet'
+ARCHIVED_PAGES = (HISTORICALS, BALANCESHEET)
+
+# Each page section is a compiled XPath selecting its table rows, along with
+# the titles of the fields we want from it. A row matches a field when its
+# first cell contains the field's title; if several rows match, the first one
+# in the page wins.
+_HISTORICALS_SECTIONS = [
+    (etree.XPath('//div[@id="HistoricalFinancialsTab"]//tr[td]'),
+     ('Return on capital', 'EBIT')),
+    (etree.XPath('//div[@id="PerShareStatisticsTab"]//tr[td]'),
+     ('Market cap',)),
+]
+
+# the capital position div doesn't have any unique identifiers, but we know it
+# contains this anchor
+_BALANCESHEET_SECTIONS = [
+    (etree.XPath('//a[@name="CapitalPosition"]/..//tr[td]'),
+     ('Cash', 'Total debt')),
+]
+
+_TITLE_XPATH = etree.XPath(
+    '//div[contains(concat(" ", normalize-space(@class), " "),'
+    ' " N_QHeaderContainer ")]//label')
+
+
+def _parse_value(text):
+    """Converts a table cell into a float, or None if it has no value (shown
+    as '--').
+    """
+    # some fields have a comma, eg '4,873.0'
+    text = text.strip().replace(',', '')
+
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _extract_fields(root, sections):
+    """Extracts fields from a parsed page in a single pass over each section's
+    rows. Returns a dict mapping each field title found to its list of values,
+    one per year (oldest first).
+    """
+    fields = {}
+
+    for xpath, titles in sections:
+        wanted = [title for title in titles if title not in fields]
+
+        for row in xpath(root):
+            if not wanted:
+                break
+
+            cells = row.findall('td')
+            label = cells[0].text_content()
+
+            for title in wanted:
+                if title in label:
+                    fields[title] = [_parse_value(cell.text_content())
+                                     for cell in cells[1:]]
+                    wanted.remove(title)
+                    break
+
+    return fields
+
+
+def parse_historicals(page):
+    """Parses a CompanyHistoricals page. Returns a dict mapping 'Return on
+    capital', 'EBIT' and 'Market cap' to their values for every available
+    year. Fields which can't be found are left out.
+    """
+    return _extract_fields(lxml.html.fromstring(page), _HISTORICALS_SECTIONS)
+
+
+def parse_balancesheet(page):
+    """Parses a BalanceSheet page. Returns a tuple of (company title, fields),
+    where fields maps 'Cash' and 'Total debt' to their values for every
+    available year. The title is None if it can't be found.
+    """
+    root = lxml.html.fromstring(page)
+    labels = _TITLE_XPATH(root)
+    title = labels[0].text_content().strip() if labels else None
+    return title, _extract_fields(root, _BALANCESHEET_SECTIONS)
+
+
+def _scrape_field(fields, title):
+    """Returns the value of a field scraped from a page. When there are
+    multiple years for a field, the last available year is always chosen.
+
+    Arguments:
+    fields -- A dict of field values, as returned by parse_historicals() or
+              parse_balancesheet().
+    title -- The title of the field, eg 'Return on capital'.
+    """
+    values = fields.get(title)
+
+    if not values or values[-1] is None:
+        raise FieldMissingException('field "' + title + '" missing')
+
+    return values[-1]
+
+
+def apply_historicals(stock_profile, page):
+    """Parses a CompanyHistoricals page, and sets the return on capital, ebit
+    and market cap of the given StockProfile from it.
+    """
+    fields = parse_historicals(page)
+
+    raw_roc = _scrape_field(fields, 'Return on capital')
+    raw_ebit = _scrape_field(fields, 'EBIT')
+    raw_market_cap = _scrape_field(fields, 'Market cap')
+
+    # convert from percentage to decimal
+    stock_profile.return_on_capital = raw_roc / 100.0
+
+    # data displayed in millions, so multiply for full number
+    stock_profile.ebit = int(raw_ebit * 1000000)
+    stock_profile.market_cap = int(raw_market_cap * 1000000)
+
+
+def apply_balancesheet(stock_profile, page):
+    """Parses a BalanceSheet page, and sets the title, cash and total debt of
+    the given StockProfile from it.
+    """
+    title, fields = parse_balancesheet(page)
+
+    if title is None:
+        raise FieldMissingException('field "title" missing')
+
+    stock_profile.title = title
+
+    raw_cash = _scrape_field(fields, 'Cash')
+    raw_total_debt = _scrape_field(fields, 'Total debt')
+
+    # data displayed in thousands, so multiply for full number
+    stock_profile.cash = int(raw_cash * 1000)
+    stock_profile.total_debt = int(raw_total_debt * 1000)
+
+
+def profile_from_pages(symbol, historicals, balancesheet):
+    """Returns a StockProfile built from a stock's CompanyHistoricals and
+    BalanceSheet pages, without any network access.
+    """
+    stock_profile = StockProfile(symbol)
+    apply_historicals(stock_profile, historicals)
+    apply_balancesheet(stock_profile, balancesheet)
+    return stock_profile
+
+
+# fields of the compact tuples returned by parse_pages()
+PARSED_FIELDS = ('title', 'return_on_capital', 'ebit', 'market_cap',
+                 'total_debt', 'cash')
+
+
+def parse_pages(pages):
+    """Parses a stock's (CompanyHistoricals, BalanceSheet) pages, and returns
+    a tuple of its PARSED_FIELDS. Raises FieldMissingException if a field is
+    missing. Suitable for running in a separate process.
+    """
+    stock_profile = profile_from_pages(None, *pages)
+    return tuple(getattr(stock_profile, field) for field in PARSED_FIELDS)
+
+
+def profile_from_archive(archived):
+    """Returns a StockProfile built from a stock's archived pages, or None if
+    a field is missing. Takes one of the tuples yielded by
+    PageArchive.latest_pages(ARCHIVED_PAGES), so it can be mapped over a
+    process pool.
+    """
+    symbol, (historicals, balancesheet) = archived
+
+    try:
+        return profile_from_pages(symbol, decompress(historicals),
+                                  decompress(balancesheet))
+    except FieldMissingException:
+        return None
+
+
+def _login_required(response):
+    """Returns True if a response is MorningStar's login form, which is where
+    members-only pages redirect to if we aren't logged in.
+    """
+    return urllib.parse.urlsplit(response.url).path.rstrip('/').lower() == \
+        urllib.parse.urlsplit(LOGIN_URL).path.lower()
 
 
 class TLSHTTPAdapter(HTTPAdapter):
@@ -26,34 +221,112 @@ class MorningStarScraper(object):
     """Class used to scrape stock data from MorningStar. login() must be called
     prior to scrape_stock_profile(). The only fields scraped will are symbol,
     title, market cap, return on capital, ebit, total debt, and cash.
+
+    Requests are shared out among a pool of sessions, one per worker. If
+    given a cookie path, the login is kept there and reused by later runs,
+    until MorningStar redirects a members-only page to its login form, when
+    we log in again.
     """
-    def __init__(self, username, password):
+    def __init__(self, username, password, pool_size=10, cache=None, ttl=0,
+                 archive=None, cookie_path=None, root=None):
         self.username = username
+        # pages are requested from root instead of MorningStar, if given, eg
+        # 'http://127.0.0.1:8081'
+        self.login_url = rebase_url(LOGIN_URL, root)
+        self.balance_sheet_url = rebase_url(
+            _MorningStarStockScraper.BALANCE_SHEET_URL, root)
+        self.historicals_url = rebase_url(
+            _MorningStarStockScraper.HISTORICALS_URL, root)
         self.password = password
-        self._session = requests.session()
-        self._session.mount('https://', TLSHTTPAdapter())
-
-    def login(self):
+        self._cache = cache
+        self._ttl = ttl
+        self._archive = archive
+        # one session per worker thread, each with its own connections
+        self._sessions = SessionPool(pool_size, self._mount, cookie_path)
+        self._login_lock = threading.RLock()
+        # incremented by every login, so workers which find the session
+        # expired at the same time only log in again once
+        self._logins = 0
+
+    @staticmethod
+    def _mount(session):
+        session.mount('https://', TLSHTTPAdapter(pool_maxsize=1))
+        session.mount('http://', HTTPAdapter(pool_maxsize=1))
+
+    def login(self, force=False):
         """Logs into MorningStar, so members-only pages can be loaded. This must
-        be run before scrape_stock_profile().
+        be run before scrape_stock_profile(). Unless forced, a login kept
+        from an earlier run is reused without contacting MorningStar. Raises
+        LoginFailedException if MorningStar doesn't accept our credentials.
+        """
+        with self._login_lock:
+            if not force and self._sessions.has_cookies():
+                return
+
+            self._sessions.clear_cookies()
+            values = {'UserName': self.username, 'Password': self.password}
+            headers = {'User-agent': 'Mozilla/5.0'}
+
+            # limited, retried and backed off like any other request
+            response = request_executor.execute(self.login_url, self._post,
+                                                values, headers)
+
+            # a failed login shows the login form again
+            if response.status_code >= 400 or _login_required(response):
+                raise LoginFailedException(
+                    'MorningStar login failed for %s (status %d)'
+                    % (self.username, response.status_code))
+
+            self._logins += 1
+            self._sessions.save_cookies()
+
+    def _post(self, url, values, headers):
+        with self._sessions.session() as session:
+            return session.post(url, data=values, headers=headers,
+                                verify=True, allow_redirects=True)
+
+    @property
+    def logins(self):
+        """The number of times we've logged in, to pass to relogin().
         """
-        url = 'https://www.morningstar.com.au/Security/Login'
+        return self._logins
 
-        values = {'UserName': self.username, 'Password': self.password}
-        headers = {'User-agent': 'Mozilla/5.0'}
-        self._session.post(url,
-                           data=values,
-                           headers=headers,
-                           verify=True,
-                           allow_redirects=True)
+    def relogin(self, logins):
+        """Logs in again, after a page came back as the login form, unless
+        another worker has already done so since 'logins' was read (before
+        the page was requested). Safe to call from multiple threads at once.
+        """
+        with self._login_lock:
+            if self._logins == logins:
+                self.login(force=True)
+
+    def get(self, url, headers=None):
+        """Sends a GET request for a members-only page through one of our
+        sessions, and returns the response. If our login has expired, this
+        is MorningStar's login form, and the caller should relogin(). Safe
+        to call from multiple threads at once.
+        """
+        with self._sessions.session() as session:
+            return session.get(url, headers=headers)
+
+    def fetch_pages(self, symbol):
+        """Fetches a stock's pages from MorningStar without parsing them, and
+        returns them as a tuple of (CompanyHistoricals, BalanceSheet) page
+        text; see parse_pages(). Safe to call from multiple threads at once.
+        """
+        scraper = _MorningStarStockScraper(self, symbol, self._cache,
+                                           self._ttl, self._archive)
+        return scraper.fetch_pages()
 
     def scrape_stock_profile(self, symbol):
-        """Scrapes MorningStar and returns a StockProfile object.
+        """Scrapes MorningStar and returns a StockProfile object. Safe to call
+        from multiple threads at once.
 
         Arguments:
         symbol -- ASX symbol of the company we want to scrape, eg "CBA".
         """
-        scraper = _MorningStarStockScraper(self._session, symbol)
+        scraper = _MorningStarStockScraper(self, symbol, self._cache,
+                                           self._ttl, self._archive)
         return scraper.scrape()
 
 
@@ -61,148 +334,94 @@ class _MorningStarStockScraper(object):
     """Class to scrape data from MorningStar for an individual stock. Should
     only be used by the MorningStarScraper() class.
     """
-    _SLEEP_MAX = 5.0
     BALANCE_SHEET_URL = \
         'http://www.morningstar.com.au/Stocks/BalanceSheet/'
     HISTORICALS_URL = \
         'http://www.morningstar.com.au/Stocks/CompanyHistoricals/'
 
-    RETRIES = 5
-
-    _last_scrape = 0
-
-    def __init__(self, session, symbol):
-        self._session = session
+    def __init__(self, ms_scraper, symbol, cache=None, ttl=0, archive=None):
+        self._ms_scraper = ms_scraper
+        self._cache = cache
+        self._ttl = ttl
+        self._archive = archive
         self._stock_profile = StockProfile(symbol)
 
-    def _delay_scrape(self):
-        """Sleeps for a random amount of time, between 0 and _SLEEP_MAX. Should
-        be called before every page request, so that not too many requests are
-        sent at once.
+    def _get(self, url, headers):
+        """Sends a GET request through the MorningStarScraper's sessions, and
+        returns a tuple of (status, headers, text, expired), where expired is
+        True if the page came back as the login form.
         """
-        if self._last_scrape > 0:
-            time.sleep(random.uniform(0.0, self._SLEEP_MAX))
-
-        self._last_scrape = timestamp()
-
-    def _scrape_field(self, parent, title):
-        """Scrapes a specific field from a page. When there are multiple years
-        for a field, the last available year is always chosen.
-
-        Arguments:
-        parent -- A BeautifulSoup element. We look for our field inside it.
-        title -- The title of the field, eg 'Return on capital'.
+        start = time.perf_counter()
+        response = self._ms_scraper.get(url, headers=headers)
+        metrics.request(url, time.perf_counter() - start,
+                        len(response.content), response.status_code)
+
+        return response.status_code, response.headers, response.text, \
+            _login_required(response)
+
+    def _fetch(self, url, page_type):
+        """Fetches a page through the shared request executor, which limits,
+        retries and backs off requests as MorningStar allows. If our login
+        has expired, we log in again (outside the executor, so the login
+        doesn't hold up a request slot) and retry once; if that doesn't help,
+        SessionExpiredException is raised. Pages downloaded from MorningStar
+        (rather than served from the cache) are archived.
         """
-        print('_scrape_field', 'title:', title)
+        def opener(url, headers):
+            for attempt in range(2):
+                logins = self._ms_scraper.logins
+                status, response_headers, text, expired = \
+                    request_executor.execute(url, self._get, headers)
 
-        # use regex so we don't have to be so exact in our title searches
-        pattern = re.compile(r'' + title + '.*')
-        prev_element = next_element = parent.find('td', text=pattern)
+                if not expired:
+                    break
 
-        if not prev_element:
-            raise FieldMissingException('field "' + title + '" missing')
+                if attempt == 1:
+                    raise SessionExpiredException(
+                        'MorningStar redirected %s to its login form after '
+                        'logging in again' % url)
 
-        # find the last TD sibling; it will have the latest year's results
-        while next_element:
+                self._ms_scraper.relogin(logins)
 
-            if hasattr(next_element, 'text'):
-                prev_element = next_element
+            if self._archive is not None and status == 200:
+                self._archive.store(self._stock_profile.symbol, page_type,
+                                    url, text)
 
-            next_element = next_element.next_sibling
+            return status, response_headers, text
 
-        text = prev_element.text
-        # some fields have a comma, eg '4,873.0'
-        text = text.strip().replace(',', '')
-
-        if text == '--':
-            raise FieldMissingException('field "' + title + '" missing')
-
-        return float(text)
-
-    def _scrape_title(self, parent):
-        """Scrapes the company title - eg, 'Commonwealth Bank of Australia'.
-        This information comes from the BalanceSheet page.
-        """
-        self._delay_scrape()
-
-        div = parent.find('div', {'class': 'N_QHeaderContainer'})
-        label = div.find('label')
-        self._stock_profile.title = label.text.strip()
+        return cached_fetch(self._cache, url, self._ttl, opener)
 
     def _scrape_balancesheet(self):
         """Scrapes data from the BalanceSheet page.
         """
-        self._delay_scrape()
-
-        url = self.BALANCE_SHEET_URL + self._stock_profile.symbol
-
-        for i in itertools.count():
-            try:
-                page = self._session.get(url).text
-                break
-            except Exception:
-                if i >= self.RETRIES:
-                    raise
-
-                print("_scrape_balancesheet: connection failed; retrying...")
-                # sleep for 1 second
-                time.sleep(1)
-
-        soup = BeautifulSoup(page, 'lxml')
+        url = self._ms_scraper.balance_sheet_url + self._stock_profile.symbol
+        page = self._fetch(url, BALANCESHEET)
 
-        self._scrape_title(soup)
-
-        # the div doesn't have any unique identifiers, but we know it appears
-        # after this anchor
-        anchor = soup.find('a', {'name': 'CapitalPosition'})
-        div = anchor.parent
-
-        raw_cash = self._scrape_field(div, 'Cash')
-        raw_total_debt = self._scrape_field(div, 'Total debt')
-
-        # data displayed in thousands, so multiply for full number
-        self._stock_profile.cash = int(raw_cash * 1000)
-        self._stock_profile.total_debt = int(raw_total_debt * 1000)
+        with metrics.phase('parse'):
+            apply_balancesheet(self._stock_profile, page)
 
     def _scrape_historicals(self):
         """Scrapes data from the HistoricalFinancials page.
         """
-        self._delay_scrape()
-
-        url = self.HISTORICALS_URL + self._stock_profile.symbol
-
-        for i in itertools.count():
-            try:
-                page = self._session.get(url).text
-                break
-            except Exception:
-                if i >= self.RETRIES:
-                    raise
+        url = self._ms_scraper.historicals_url + self._stock_profile.symbol
+        page = self._fetch(url, HISTORICALS)
 
-                print("_scrape_historicals: connection failed; retrying...")
-                # sleep for 1 second
-                time.sleep(1)
+        with metrics.phase('parse'):
+            apply_historicals(self._stock_profile, page)
 
-        soup = BeautifulSoup(page, 'lxml')
-
-        parent = soup.find('div', {'id': 'HistoricalFinancialsTab'})
-        raw_roc = self._scrape_field(parent, 'Return on capital')
-        raw_ebit = self._scrape_field(parent, 'EBIT')
-
-        parent = soup.find('div', {'id': 'PerShareStatisticsTab'})
-        raw_market_cap = self._scrape_field(parent, 'Market cap')
-
-        # convert from percentage to decimal
-        self._stock_profile.return_on_capital = raw_roc / 100.0
-
-        # data displayed in millions, so multiply for full number
-        self._stock_profile.ebit = int(raw_ebit * 1000000)
-        self._stock_profile.market_cap = int(raw_market_cap * 1000000)
+    def fetch_pages(self):
+        """Fetches the stock's pages, and returns them as a tuple of
+        (CompanyHistoricals, BalanceSheet) page text.
+        """
+        symbol = self._stock_profile.symbol
+        return (self._fetch(self._ms_scraper.historicals_url + symbol,
+                            HISTORICALS),
+                self._fetch(self._ms_scraper.balance_sheet_url + symbol,
+                            BALANCESHEET))
 
     def scrape(self):
         """Scrapes MorningStar and returns a StockProfile object.
         """
-        print('scrape', 'symbol:', self._stock_profile.symbol)
         self._scrape_historicals()
         self._scrape_balancesheet()
         return self._stock_profile
@@ -0,0 +1,134 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import queue
+import threading
+import time
+from stockrank.metrics import metrics
+
+# upper bounds of the queue depth histogram buckets
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, float('inf'))
+
+# marks the end of a fetch worker's items
+_DONE = object()
+
+
+class FetchParsePipeline(object):
+    """Runs I/O-bound fetching and CPU-bound parsing in separate stages.
+
+    Fetch workers (threads) call fetch(item) and push the raw result onto a
+    bounded queue. A pool of parser processes consumes the queue, calling
+    parse(raw) on each result. When the parsers fall behind, the queue fills
+    and the fetch workers block, so memory use stays bounded however many
+    items there are.
+    """
+    def __init__(self, fetch, parse, fetch_workers=4, parse_processes=None,
+                 queue_size=None):
+        """Arguments:
+        fetch -- Function taking an item and returning its raw data. Called
+                 from the fetch threads.
+        parse -- Picklable (ie module-level) function taking the raw data of
+                 an item and returning a compact result. Called in the parser
+                 processes.
+        fetch_workers -- Number of fetch threads.
+        parse_processes -- Number of parser processes; defaults to the number
+                           of cores.
+        queue_size -- Maximum number of fetched items waiting to be parsed;
+                      defaults to twice the number of parser processes.
+        """
+        self._fetch = fetch
+        self._parse = parse
+        self._fetch_workers = fetch_workers
+        self._parse_processes = parse_processes or multiprocessing.cpu_count()
+        self._queue_size = queue_size or self._parse_processes * 2
+
+    def _fetch_worker(self, items, items_lock, fetched, stop):
+        """Fetches items until there are none left, or the pipeline stops.
+        """
+        try:
+            while not stop.is_set():
+                with items_lock:
+                    item = next(items, _DONE)
+
+                if item is _DONE:
+                    break
+
+                try:
+                    fetched.put((item, self._fetch(item), None))
+                except Exception as e:
+                    fetched.put((item, None, e))
+        finally:
+            fetched.put((_DONE, None, None))
+
+    def run(self, items):
+        """Fetches and parses every item, yielding (item, result) tuples as
+        they complete, in the order fetching finished. An exception raised
+        while fetching an item is re-raised here; an exception raised while
+        parsing it is yielded in place of its result.
+        """
+        items = iter(items)
+        items_lock = threading.Lock()
+        fetched = queue.Queue(self._queue_size)
+        stop = threading.Event()
+
+        threads = [threading.Thread(target=self._fetch_worker,
+                                    args=(items, items_lock, fetched, stop),
+                                    daemon=True)
+                   for _ in range(self._fetch_workers)]
+
+        # spawn rather than fork the parsers, as forking a process which is
+        # running threads isn't safe
+        executor = concurrent.futures.ProcessPoolExecutor(
+            self._parse_processes,
+            mp_context=multiprocessing.get_context('spawn'))
+
+        pending = collections.deque()
+        running = len(threads)
+        parsed = 0
+        start = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while running or pending:
+                # don't let more parses queue up than the parsers can keep
+                # busy with; the fetch queue provides the rest of the buffer
+                while pending and (pending[0][1].done() or not running or
+                                   len(pending) >= self._parse_processes * 2):
+                    item, future = pending.popleft()
+                    parsed += 1
+
+                    try:
+                        yield item, future.result()
+                    except Exception as e:
+                        yield item, e
+
+                if not running:
+                    continue
+
+                metrics.observe('parse_queue_depth', fetched.qsize(),
+                                bounds=QUEUE_DEPTH_BUCKETS)
+                item, raw, error = fetched.get()
+
+                if item is _DONE:
+                    running -= 1
+                elif error is not None:
+                    raise error
+                else:
+                    pending.append((item, executor.submit(self._parse, raw)))
+        finally:
+            stop.set()
+
+            # unblock any fetch workers waiting on a full queue
+            while any(thread.is_alive() for thread in threads):
+                try:
+                    fetched.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+            executor.shutdown(cancel_futures=True)
+
+            # reported by the caller, eg StockRank.download()
+            metrics.increment('parsed', parsed)
+            metrics.increment('parse_seconds', time.perf_counter() - start)
@@ -1,63 +1,241 @@
-from stockrank.scrapers.morningstar import MorningStarScraper
+import concurrent.futures
+import urllib.parse
+from stockrank.scrapers.morningstar import MorningStarScraper, \
+    _MorningStarStockScraper, parse_pages, PARSED_FIELDS
 from stockrank.scrapers.google import GoogleScraper
 from stockrank.scrapers.asx import AsxScraper
+from stockrank.scrapers.throttle import rate_limiter
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.cache import ResponseCache
+from stockrank.scrapers.archive import PageArchive
+from stockrank.scrapers.pipeline import FetchParsePipeline
+from stockrank.scrapers.merge import FIELD_PRECEDENCE, hash_join, collapse, \
+    merge_profile
+from stockrank.stock import StockProfile
 from stockrank.exceptions import FieldMissingException
+from stockrank.metrics import metrics
+from stockrank.helpers import parse_list, parse_market_cap, rebase_url
+
+# stocks in sectors containing any of these are never scraped from MorningStar,
+# unless [Scraper] excluded_sectors says otherwise
+EXCLUDED_SECTORS = ('Utilities', 'Financ', 'Banks', 'Real Estate')
 
 
 class StockScraper(object):
     """Used to scrape stock data from a variety of sources on the web. This
     class should be used by the client code instead of the specific scrapers.
     """
-    def __init__(self, config):
-        ms_username = config.get('Credentials', 'morningstar_username')
-        ms_password = config.get('Credentials', 'morningstar_password')
-
-        # we only want stocks with market cap > 50,000
-        # TODO: add this value to the config file!
-        self._google_scraper = GoogleScraper(50000000)
-        self._asx_scraper = AsxScraper()
-        self._ms_scraper = MorningStarScraper(ms_username, ms_password)
-        self._ms_scraper.login()
-
-    def scrape_stock_profiles(self):
-        """Scrapes and returns a list of stock profiles from various sources on
-        the web.
+    def __init__(self, config, morningstar=True):
+        """Arguments:
+        config -- A ConfigParser holding our settings.
+        morningstar -- If False, we don't log into MorningStar, so only
+                       candidates() can be used, eg to queue the stocks.
+        """
+        # number of stocks scraped from MorningStar at once
+        self._workers = config.getint('Scraper', 'workers', fallback=4)
+
+        # fetched pages are parsed by a pool of processes, fed through a
+        # bounded queue. zero means one process per core, and a queue of twice
+        # that size
+        self._parse_processes = config.getint('Scraper', 'parse_processes',
+                                              fallback=0)
+        self._queue_size = config.getint('Scraper', 'queue_size', fallback=0)
+
+        # each source may be served from another site, eg the stand-in
+        # server used by benchmarks.loadtest. empty means the real one
+        def root(source):
+            return config.get('Sources', source + '_url', fallback='') or None
+
+        # politeness comes from one shared request rate per host, rather than
+        # from sleeping in each worker
+        ms_host = urllib.parse.urlsplit(rebase_url(
+            _MorningStarStockScraper.BALANCE_SHEET_URL,
+            root('morningstar'))).hostname
+        rate_limiter.configure(
+            ms_host,
+            config.getfloat('Scraper', 'requests_per_second', fallback=1.0),
+            config.getint('Scraper', 'burst', fallback=1))
+
+        # requests in flight to each host start at initial_concurrency, and
+        # grow while the host keeps up, up to one per worker. failed requests
+        # are retried, and a host failing failure_threshold times in a row
+        # gets no requests for reset_after seconds
+        request_executor.configure(
+            retries=config.getint('Scraper', 'retries', fallback=5),
+            initial_concurrency=config.getint(
+                'Scraper', 'initial_concurrency', fallback=1),
+            max_concurrency=self._workers,
+            failure_threshold=config.getint('Scraper', 'failure_threshold',
+                                            fallback=5),
+            reset_after=config.getfloat('Scraper', 'reset_after',
+                                        fallback=30.0))
+
+        # an empty cache path disables the response cache
+        self.cache = None
+        cache_path = config.get('Cache', 'path', fallback='')
+
+        if cache_path:
+            self.cache = ResponseCache(
+                cache_path,
+                config.getint('Cache', 'max_size_mb', fallback=256) << 20)
+
+        # an empty archive path disables archiving of MorningStar pages
+        self.archive = None
+        archive_path = config.get('Archive', 'path', fallback='')
+
+        if archive_path:
+            self.archive = PageArchive(archive_path)
+
+        def ttl(source, default_hours):
+            return 3600 * config.getfloat('Cache', 'ttl_' + source,
+                                          fallback=default_hours)
+
+        # the screen applied before anything is scraped from MorningStar.
+        # see also --sweep, which tries other screens on what we have
+        self._excluded_sectors = parse_list(config.get(
+            'Scraper', 'excluded_sectors',
+            fallback=', '.join(EXCLUDED_SECTORS)))
+        min_market_cap = parse_market_cap(config.get(
+            'Scraper', 'min_market_cap', fallback='50M'))
+
+        self._google_scraper = GoogleScraper(min_market_cap, self.cache,
+                                             ttl('google', 6), root('google'))
+        # sectors are kept in our database, so they're only downloaded once
+        # they expire
+        self._asx_scraper = AsxScraper(
+            config.get('Application', 'database_path', fallback=':memory:'),
+            ttl('asx', 24), root('asx'))
+        self._ms_scraper = None
+
+        if morningstar:
+            # an empty cookie path means logging in on every run
+            self._ms_scraper = MorningStarScraper(
+                config.get('Credentials', 'morningstar_username'),
+                config.get('Credentials', 'morningstar_password'),
+                pool_size=self._workers, cache=self.cache,
+                ttl=ttl('morningstar', 720), archive=self.archive,
+                cookie_path=config.get('Credentials',
+                                       'morningstar_cookie_path',
+                                       fallback='') or None,
+                root=root('morningstar'))
+            # logs in now, so bad credentials are reported before any work
+            # starts, unless there's a login kept from an earlier run
+            self._ms_scraper.login()
+
+        # the sources fetched in bulk, as (name, function returning the
+        # source's relation, reason a stock missing from it is skipped). the
+        # first source drives the join, so it decides which stocks we look at.
+        # to add a source, add it here and give its fields a place in
+        # FIELD_PRECEDENCE
+        self._sources = [
+            ('google', self._google_scraper.relation, None),
+            ('asx', self._asx_scraper.relation, 'delisted'),
+        ]
+
+        # MorningStar data is merged into stocks already joined from the bulk
+        # sources, which form the 'universe' relation
+        self._ms_precedence = collapse(
+            FIELD_PRECEDENCE, [name for name, _, _ in self._sources],
+            'universe')
+
+    def _fetch_morningstar(self, stock):
+        """Fetches a stock's pages from MorningStar. Run by the pipeline's
+        fetch workers.
         """
-        stock_profiles = []
+        with metrics.phase('scrape'):
+            return self._ms_scraper.fetch_pages(stock.symbol)
 
-        # using Google stock data as our base, populate all the stock profiles
-        for stock in self._google_scraper.scrape_stock_profiles():
+    def _relations(self):
+        """Fetches every bulk source concurrently, and returns a list of
+        (name, relation) tuples in the order of self._sources. Each source is
+        read to the end here, rather than left open on a connection which
+        would idle for the whole of the MorningStar scrape; Google's list is
+        still decoded as it arrives.
+        """
+        with concurrent.futures.ThreadPoolExecutor(len(self._sources)) as \
+                executor:
+            futures = [(name, executor.submit(fetch))
+                       for name, fetch, _ in self._sources]
+            return [(name, future.result()) for name, future in futures]
 
-            try:
-                stock.sector = self._asx_scraper.sector(stock.symbol)
-            except KeyError:
+    def candidates(self, skip_symbols=()):
+        """Yields stock profiles joined from the bulk sources (Google and the
+        ASX), for the stocks which should be scraped from MorningStar.
+        """
+        with metrics.phase('universe'):
+            relations = self._relations()
+
+        reasons = {name: reason for name, _, reason in self._sources}
+
+        for symbol, records, missing in hash_join(relations):
+
+            if symbol in skip_symbols:
+                metrics.increment('skipped', reason='fresh')
+                continue
+
+            if missing is not None:
                 # The Google list sometimes has delisted companies, so if a
                 # sector can't be found, it's probably been delisted.
+                metrics.increment('skipped', reason=reasons[missing])
+                continue
+
+            stock = merge_profile(symbol, records)
+
+            # filter on sector here, before any MorningStar request is made
+            if any(x in stock.sector for x in self._excluded_sectors):
+                metrics.increment('skipped', reason='excluded_sector')
                 continue
 
-            # TODO: add these values into the config file?
-            if 'Utilities' in stock.sector \
-                    or 'Financ' in stock.sector \
-                    or 'Banks' in stock.sector \
-                    or 'Real Estate' in stock.sector:
-                        continue
-
-            # Merge in stock data from MorningStar
-            # Note that we keep Google's 'market cap', as it's more up-to-date
-            try:
-                ms_stock = self._ms_scraper.scrape_stock_profile(stock.symbol)
-            except FieldMissingException as e:
-                print(ms_stock.symbol, str(e))
+            yield stock
+
+    def scrape_morningstar(self, stock_profiles):
+        """Completes stock profiles from the bulk sources with data from
+        MorningStar. Pages are fetched concurrently by the configured number
+        of workers, and parsed by a pool of processes. Yields a tuple of
+        (stock, scraped) for each stock as soon as it's done, where scraped is
+        False if MorningStar doesn't have all the data we need on the stock.
+
+        Only a bounded number of stocks is in flight at any time, so memory
+        use doesn't grow with the number of stocks scraped.
+
+        Arguments:
+        stock_profiles -- An iterable of StockProfile objects, which is
+                          consumed as stocks are fetched.
+        """
+        pipeline = FetchParsePipeline(self._fetch_morningstar, parse_pages,
+                                      self._workers, self._parse_processes,
+                                      self._queue_size)
+
+        for stock, fields in pipeline.run(stock_profiles):
+
+            if isinstance(fields, FieldMissingException):
                 # if an attribute can't be found, we can't really do anything
                 # other than just continue. some companies don't have 'return
                 # on capital' available.
+                metrics.increment('skipped', reason='field_missing')
+                yield stock, False
                 continue
+            elif isinstance(fields, Exception):
+                raise fields
 
-            stock.return_on_capital = ms_stock.return_on_capital
-            stock.ebit = ms_stock.ebit
-            stock.total_debt = ms_stock.total_debt
-            stock.cash = ms_stock.cash
+            records = {
+                'universe': {field: getattr(stock, field)
+                             for field in StockProfile.__slots__},
+                'morningstar': dict(zip(PARSED_FIELDS, fields)),
+            }
+            yield merge_profile(stock.symbol, records,
+                                self._ms_precedence), True
 
-            stock_profiles.append(stock)
+    def scrape_stock_profiles(self, skip_symbols=()):
+        """Scrapes stock profiles from various sources on the web, yielding
+        each one as soon as it's complete.
+
+        Arguments:
+        skip_symbols -- Symbols which shouldn't be scraped, eg because our
+                        copy of their data is still fresh.
+        """
+        stocks = self.scrape_morningstar(self.candidates(skip_symbols))
 
-        return stock_profiles
+        for stock, scraped in stocks:
+            if scraped:
+                yield stock
@@ -0,0 +1,86 @@
+import contextlib
+import http.cookiejar
+import os
+import queue
+import threading
+import requests
+
+
+class SessionPool(object):
+    """A fixed number of requests sessions, which worker threads check out
+    one at a time, so each session (and its connection pool) only ever serves
+    one request at once. The sessions share one cookie jar, so logging in
+    through any of them logs them all in.
+
+    If given a path, the cookie jar is loaded from it, and saved to it by
+    save_cookies(), so a login can outlive the process. Cookies which have
+    expired are dropped as they're loaded.
+    """
+    def __init__(self, size, mount=None, cookie_path=None):
+        """Arguments:
+        size -- Number of sessions.
+        mount -- Function called with each new session, eg to mount
+                 adapters on it.
+        cookie_path -- File to persist cookies in, or None to keep them in
+                       memory.
+        """
+        self._cookie_path = cookie_path
+        self.cookies = http.cookiejar.LWPCookieJar(cookie_path)
+
+        if cookie_path and os.path.exists(cookie_path):
+            try:
+                # session cookies are kept too: only the server knows whether
+                # they're still valid
+                self.cookies.load(ignore_discard=True)
+            except (OSError, http.cookiejar.LoadError):
+                # a corrupt file just means logging in again
+                self.cookies.clear()
+
+        self._lock = threading.Lock()
+        self._sessions = queue.LifoQueue()
+
+        for _ in range(size):
+            session = requests.session()
+            session.cookies = self.cookies
+
+            if mount is not None:
+                mount(session)
+
+            self._sessions.put(session)
+
+    @contextlib.contextmanager
+    def session(self):
+        """Checks out a session for the duration of a with block, waiting
+        for one to be free if needed.
+        """
+        session = self._sessions.get()
+
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    def has_cookies(self):
+        return len(self.cookies) > 0
+
+    def clear_cookies(self):
+        self.cookies.clear()
+
+    def save_cookies(self):
+        """Saves the cookie jar to its file, readable only by us, as it holds
+        our login. Does nothing without a cookie path.
+        """
+        if not self._cookie_path:
+            return
+
+        with self._lock:
+            # created readable only by us, rather than restricted after the
+            # login is written. a file we already had is restricted too
+            fd = os.open(self._cookie_path,
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+
+            with os.fdopen(fd, 'w') as f:
+                # as LWPCookieJar.save() writes it
+                f.write('#LWP-Cookies-2.0\n')
+                f.write(self.cookies.as_lwp_str(ignore_discard=True))
@@ -0,0 +1,71 @@
+import threading
+import time
+import urllib.parse
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket. Each call to acquire() takes a token,
+    sleeping until one becomes available. Tokens are refilled at a constant
+    rate, up to a maximum of 'burst' tokens.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token from the bucket, blocking until it's available.
+        Returns the number of seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+
+            # reserve our token now, even if the bucket is empty. the deficit
+            # tells us how long to wait, and queues up later callers behind us
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+
+class RateLimiter(object):
+    """Holds one TokenBucket per host, so that every scraper sending requests
+    to the same host shares a single request rate.
+    """
+    def __init__(self, default_rate=1.0, default_burst=1):
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host, rate, burst=1):
+        """Sets the allowed request rate (per second) for a given host.
+        """
+        with self._lock:
+            self._buckets[host] = TokenBucket(rate, burst)
+
+    def bucket(self, host):
+        """Returns the TokenBucket for a host, creating it if necessary.
+        """
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.default_rate,
+                                                  self.default_burst)
+            return self._buckets[host]
+
+    def acquire(self, url):
+        """Blocks until a request to the given URL is allowed.
+        """
+        return self.bucket(urllib.parse.urlsplit(url).hostname).acquire()
+
+
+# shared by all scrapers in the process
+rate_limiter = RateLimiter()
@@ -0,0 +1,149 @@
+import http.server
+import json
+import math
+import urllib.parse
+
+
+def _json_number(value):
+    # JSON has no NaN, so values which can't be computed become null
+    return None if value is None or math.isnan(value) else value
+
+
+class RankedStocks(object):
+    """The ranked list of stocks, kept in memory and indexed by symbol and
+    sector. The ranking is only rebuilt when the database has changed since
+    it was last built, which is checked on every access.
+    """
+    def __init__(self, db):
+        """Arguments:
+        db -- A StockDatabase.
+        """
+        self._db = db
+        self._version = None
+        self.rebuilds = 0
+
+    def _rebuild(self):
+        stock_table = self._db.get_stock_table()
+        earnings_yield_ranks, roc_ranks, order = stock_table.ranks()
+
+        self._table = stock_table.take(order)
+        self._earnings_yield_ranks = earnings_yield_ranks[order] + 1
+        self._roc_ranks = roc_ranks[order] + 1
+        self._symbols = {}
+        self._sectors = {}
+
+        for i, (symbol, sector) in enumerate(zip(self._table.symbol,
+                                                 self._table.sector)):
+            self._symbols[symbol] = i
+            self._sectors.setdefault((sector or '').lower(), []).append(i)
+
+        self.rebuilds += 1
+
+    def _refresh(self):
+        version = self._db.data_version()
+
+        if version != self._version:
+            self._rebuild()
+            self._version = version
+
+    def _stock(self, i):
+        row = self._table[i]
+        return {'rank': i + 1,
+                'symbol': row.symbol,
+                'title': row.title,
+                'sector': row.sector,
+                'market_cap': _json_number(row.market_cap),
+                'earnings_yield': _json_number(row.earnings_yield),
+                'return_on_capital': _json_number(row.return_on_capital),
+                'earnings_yield_rank': int(self._earnings_yield_ranks[i]),
+                'roc_rank': int(self._roc_ranks[i])}
+
+    def top(self, count):
+        """Returns the top 'count' stocks, as a list of dicts.
+        """
+        self._refresh()
+        return [self._stock(i) for i in range(min(count, len(self._table)))]
+
+    def stock(self, symbol):
+        """Returns a stock as a dict, or None if we don't have it.
+        """
+        self._refresh()
+        i = self._symbols.get(symbol.upper())
+        return None if i is None else self._stock(i)
+
+    def sector(self, sector, count):
+        """Returns the top 'count' stocks in a sector (matched ignoring case),
+        as a list of dicts.
+        """
+        self._refresh()
+        return [self._stock(i)
+                for i in self._sectors.get(sector.lower(), [])[:count]]
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # don't let a stalled client hold up the (single-threaded) server
+    timeout = 10
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(x) for x in url.path.split('/') if x]
+        query = urllib.parse.parse_qs(url.query)
+        stocks = self.server.stocks
+
+        try:
+            count = int(query.get('n', [self.server.default_count])[0])
+        except ValueError:
+            count = -1
+
+        # a negative count would slice from the end
+        if count < 0:
+            self._send(400, {'error': 'n must be a number of at least 0'})
+            return
+
+        if parts == ['top']:
+            self._send(200, stocks.top(count))
+        elif len(parts) == 2 and parts[0] == 'stocks':
+            stock = stocks.stock(parts[1])
+
+            if stock is None:
+                self._send(404, {'error': 'unknown symbol'})
+            else:
+                self._send(200, stock)
+        elif len(parts) == 2 and parts[0] == 'sectors':
+            self._send(200, stocks.sector(parts[1], count))
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        # dashboards poll constantly, so don't log every request
+        pass
+
+
+class RankingServer(http.server.HTTPServer):
+    """A local HTTP server answering JSON queries on the ranking:
+
+    GET /top?n=20 -- the top n stocks.
+    GET /stocks/<symbol> -- a single stock.
+    GET /sectors/<sector>?n=20 -- the top n stocks in a sector.
+
+    Queries are answered from memory; see RankedStocks. Requests are handled
+    one at a time, as each takes only microseconds.
+    """
+    def __init__(self, address, db, default_count=20):
+        """Arguments:
+        address -- A (host, port) tuple to listen on.
+        db -- A StockDatabase.
+        default_count -- Number of stocks returned when a query has no 'n'.
+        """
+        super().__init__(address, _RequestHandler)
+        self.stocks = RankedStocks(db)
+        self.default_count = default_count
@@ -1,5 +1,8 @@
 class StockProfile(object):
 
+    __slots__ = ('symbol', 'title', 'sector', 'return_on_capital', 'ebit',
+                 'market_cap', 'total_debt', 'cash')
+
     def __init__(self, symbol=None, title=None, sector=None,
                  return_on_capital=None, ebit=None, market_cap=None,
                  total_debt=None, cash=None):
@@ -19,5 +22,5 @@ class StockProfile(object):
         return (self.ebit / enterprise_value)
 
     def to_string(self):
-        attrs = vars(self)
-        return ', '.join("%s: %s" % item for item in attrs.items())
+        return ', '.join("%s: %s" % (name, getattr(self, name))
+                         for name in self.__slots__)
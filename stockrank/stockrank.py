@@ -1,7 +1,12 @@
 import configparser
 from stockrank.database import StockDatabase
-from stockrank.scrapers.scraper import StockScraper
-from stockrank.helpers import sort_list_into_keys
+from stockrank.workqueue import WorkQueue, default_worker_id
+from stockrank.helpers import batched, parse_list, parse_market_cap
+from stockrank.metrics import metrics
+
+# NOTE: the scraping stack (requests, lxml, ...), NumPy and the HTTP server
+# are slow to import, so they're imported by the functions which use them.
+# that way read-only commands such as --show start quickly
 
 
 def _rank_stocks(stock_profiles):
@@ -9,18 +14,23 @@ def _rank_stocks(stock_profiles):
     Arguments:
     stock_profiles -- A list of stock objects to rank.
     """
-    # list of stock symbols, ordered by earnings yield
-    by_earnings = sort_list_into_keys(stock_profiles, 'symbol',
-                                      'earnings_yield')
-    # list of stock symbols, ordered by return on capital
-    by_roc = sort_list_into_keys(stock_profiles, 'symbol', 'return_on_capital')
+    from stockrank.ranking import rank_profiles
+
+    order = rank_profiles(stock_profiles)
+    return [stock_profiles[i] for i in order]
 
-    # rank by sort order for both earnings yield and return on capital
-    ranked_stocks = sorted(stock_profiles,
-                           key=lambda x: (by_earnings.index(x.symbol) +
-                                          by_roc.index(x.symbol)))
 
-    return ranked_stocks
+# stocks reparsed by a process at a time
+REPARSE_CHUNK_SIZE = 32
+
+
+def _reparse_chunk(chunk):
+    """Returns the profiles built from a chunk of archived pages, as yielded
+    by PageArchive.latest_pages(). Run in --reparse's processes.
+    """
+    from stockrank.scrapers.morningstar import profile_from_archive
+
+    return [profile_from_archive(archived) for archived in chunk]
 
 
 class StockRank(object):
@@ -49,19 +59,403 @@ class StockRank(object):
                    '${:,}'.format(stock.market_cap), stock.earnings_yield,
                    stock.return_on_capital))
 
-    def load_local(self):
-        """Loads a locally stored copy of the list of stocks.
+    def load_local(self, count=None, sector=None, min_market_cap=None):
+        """Loads a locally stored copy of the list of stocks, in ranked order.
+
+        Arguments:
+        count -- If given, only the top 'count' stocks are loaded.
+        sector -- If given, only stocks in this sector are loaded.
+        min_market_cap -- If given, only stocks with at least this market cap
+                          are loaded.
         """
-        self._stock_profiles = _rank_stocks(self._db.get_stock_profiles())
+        self._stock_profiles = self._db.get_ranked_profiles(count, sector,
+                                                            min_market_cap)
+
+    def load_file(self, path, count=None, sector=None, min_market_cap=None):
+        """Loads the list of stocks, in ranked order, from a columnar file
+        written by export(), instead of from our local copy. The file is
+        memory-mapped, so only the stocks used are read. See load_local()
+        for the other arguments.
+        """
+        from stockrank import columnar
+
+        self._stock_profiles = columnar.load_table(path, count, sector,
+                                                   min_market_cap)
+
+    def export(self, path):
+        """Exports our local copy of the stocks, in ranked order and with
+        their ranks, to a file: CSV or Parquet if the path ends in '.csv' or
+        '.parquet', otherwise a memory-mappable columnar file (see
+        stockrank.columnar) which load_file() can read.
+        """
+        from stockrank import columnar
+
+        columnar.export(path, self._db.get_ranked_columns())
+
+    def load_snapshot(self, date):
+        """Loads the list of stocks as it was ranked on a given date (or the
+        latest snapshot before it).
+
+        Arguments:
+        date -- A datetime.date.
+        """
+        self._stock_profiles = self._db.ranking_as_of(date)
+
+    def print_history(self, symbol):
+        """Prints how a stock's rank has changed between snapshots.
+        """
+        buf = ('%-10s %6s %15s %10s'
+               % ('Date', 'Rank', 'Earnings Yield', 'ROC'))
+        print(buf)
+        print('-' * len(buf))
+
+        for snapshot in self._db.rank_history(symbol):
+            print('%-10s %6d %15d %10d' % snapshot)
+
+    def backtest(self, prices_path=None, portfolio_size=None,
+                 holding_days=None, cost_bps=None, min_market_cap=None,
+                 start=None, end=None):
+        """Backtests the magic formula over our snapshots, against daily
+        prices from local files, and prints how it performed. Defaults come
+        from the [Backtest] section of the config file. See
+        stockrank.backtest.backtest().
+
+        Arguments:
+        prices_path -- CSV or Parquet file, or directory of them, of prices.
+        portfolio_size -- Number of stocks held.
+        holding_days -- Trading days between rebalances.
+        cost_bps -- Transaction costs, in basis points of the value traded.
+        min_market_cap -- If given, smaller stocks aren't bought.
+        start, end -- Optional datetime.date bounds of the backtest.
+        """
+        from stockrank import backtest
+
+        def setting(value, name, getter, fallback):
+            if value is not None:
+                return value
+            return getter('Backtest', name, fallback=fallback)
+
+        config = self._config
+        prices = backtest.load_prices(
+            setting(prices_path, 'prices_path', config.get, 'prices'))
+        excluded_sectors = parse_list(config.get('Backtest',
+                                                 'excluded_sectors',
+                                                 fallback=''))
+        snapshot_dates, ranks = backtest.snapshot_ranks(
+            self._db.snapshot_ranks(), prices.symbols, excluded_sectors,
+            min_market_cap)
+
+        result = backtest.backtest(
+            prices, snapshot_dates, ranks,
+            setting(portfolio_size, 'portfolio_size', config.getint, 30),
+            setting(holding_days, 'holding_days', config.getint, 252),
+            setting(cost_bps, 'cost_bps', config.getfloat, 30) / 10000,
+            start, end)
+        summary = result.summary()
+
+        print('%s to %s, %d rebalances'
+              % (result.dates[0], result.dates[-1], summary['rebalances']))
+        print('total return    %8.2f%%' % (100 * summary['total_return']))
+        print('CAGR            %8.2f%%' % (100 * summary['cagr']))
+        print('volatility      %8.2f%%' % (100 * summary['volatility']))
+        print('Sharpe ratio    %9.2f' % summary['sharpe'])
+        print('max drawdown    %8.2f%%' % (100 * summary['max_drawdown']))
+        print('costs           %8.2f%%' % (100 * result.costs.sum()))
+
+    def sweep(self, count=None, processes=None):
+        """Screens our local copy of the stocks under every combination of
+        the market cap floors, sector exclusions and metric weights in the
+        [Sweep] section of the config file, and prints the top picks of each.
+        Screens can only narrow the stocks we downloaded (see the [Scraper]
+        section). See stockrank.sweep.sweep().
+
+        Arguments:
+        count -- Number of stocks picked by each screen.
+        processes -- Number of processes to screen in; 0 means one per core.
+        """
+        from stockrank import sweep
+
+        config = self._config
+        market_caps = [parse_market_cap(x) for x in parse_list(
+            config.get('Sweep', 'market_caps', fallback='50M'))]
+        # sets of sectors are separated by ';', so an empty set can be given
+        sector_exclusions = [parse_list(x) for x in config.get(
+            'Sweep', 'excluded_sectors', fallback='').split(';')]
+        weights = [tuple(float(w) for w in x.split(':')) for x in parse_list(
+            config.get('Sweep', 'weights', fallback='1:1'))]
+
+        if count is None:
+            count = config.getint('Sweep', 'top', fallback=10)
+        if processes is None:
+            processes = config.getint('Sweep', 'processes', fallback=1)
+
+        screens = sweep.screens(market_caps, sector_exclusions, weights)
+        universe = sweep.Universe.from_table(self._db.get_stock_table())
+        picks = sweep.sweep(universe, screens, count, processes)
+
+        buf = ('%-4s %9s %-30s %-7s %s'
+               % ('#', 'Min Cap', 'Excluded Sectors', 'Weights',
+                  'Top %d' % count))
+        print(buf)
+        print('-' * len(buf))
+
+        for i, (screen, symbols) in enumerate(zip(screens, picks)):
+            print('%-4d %9s %-30s %-7s %s'
+                  % (i + 1, '${:,.0f}M'.format(screen.min_market_cap / 1e6),
+                     ','.join(screen.excluded_sectors)[:30] or '-',
+                     '%g:%g' % screen.weights, ' '.join(symbols)))
+
+    def serve(self):
+        """Serves the ranking over HTTP, as JSON, until interrupted. See
+        stockrank.server.RankingServer.
+        """
+        from stockrank.server import RankingServer
+
+        address = (self._config.get('Server', 'host', fallback='127.0.0.1'),
+                   self._config.getint('Server', 'port', fallback=8080))
+        server = RankingServer(
+            address, self._db,
+            self._config.getint('Server', 'default_count', fallback=20))
+
+        print('serving on http://%s:%d/' % server.server_address[:2])
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def _rank_and_snapshot(self):
+        """Ranks every stock in the database, both in memory and in the
+        ranks stored in the database, and records a snapshot of the ranking.
+        """
+        with metrics.phase('rank'):
+            self._db.rerank()
+            stock_table = self._db.get_stock_table()
+            ranks = stock_table.ranks()
+            self._stock_profiles = stock_table.take(ranks[2])
+            self._db.save_snapshot(stock_table, *ranks)
+
+    def reparse(self):
+        """Re-extracts MorningStar data for every stock from the page archive,
+        using a process per core, and updates our local copy with it. Nothing
+        is downloaded.
+        """
+        import collections
+        import concurrent.futures
+        import multiprocessing
+        from stockrank.scrapers.archive import PageArchive
+        from stockrank.scrapers.morningstar import ARCHIVED_PAGES
+
+        archive = PageArchive(self._config.get('Archive', 'path'))
+        processes = multiprocessing.cpu_count()
+        reparsed = 0
+
+        # spawn the parsers, as our other process pools do
+        with concurrent.futures.ProcessPoolExecutor(
+                processes, multiprocessing.get_context('spawn')) as executor:
 
-    def download(self):
-        """Gets a list of stocks from online sources.
+            def reparsed_chunks():
+                # only a window of chunks is in flight, so the archive's
+                # pages are streamed rather than all held in memory
+                pending = collections.deque()
+                chunks = batched(archive.latest_pages(ARCHIVED_PAGES),
+                                 REPARSE_CHUNK_SIZE)
+
+                for chunk in chunks:
+                    if len(pending) >= processes * 2:
+                        yield pending.popleft().result()
+
+                    pending.append(executor.submit(_reparse_chunk, chunk))
+
+                while pending:
+                    yield pending.popleft().result()
+
+            stock_profiles = (x for chunk in reparsed_chunks()
+                              for x in chunk if x is not None)
+
+            for batch in batched(stock_profiles, 500):
+                # keep Google's market cap and title, as for downloads
+                self._db.update_fields(batch, ['return_on_capital', 'ebit',
+                                               'total_debt', 'cash'],
+                                       rerank=False)
+                reparsed += len(batch)
+
+        print('reparsed %d stocks' % reparsed)
+        self._rank_and_snapshot()
+
+    def _queue_path(self):
+        # the queue lives in our stock database unless configured otherwise
+        return (self._config.get('WorkQueue', 'path', fallback='') or
+                self._config.get('Application', 'database_path'))
+
+    def _work_queue(self):
+        return WorkQueue(
+            self._queue_path(),
+            self._config.getfloat('WorkQueue', 'lease_seconds',
+                                  fallback=600),
+            self._config.getint('WorkQueue', 'max_attempts', fallback=3))
+
+    def _queue_database(self):
+        """Returns a StockDatabase on the work queue's database, where the
+        workers store the stocks they scrape.
+        """
+        path = self._queue_path()
+
+        if path == self._config.get('Application', 'database_path'):
+            return self._db
+
+        config = configparser.ConfigParser()
+        config.read_dict({'Application': {'database_path': path}})
+        return StockDatabase(config)
+
+    def enqueue(self, stale_after=None):
+        """Queues every stock which should be scraped from MorningStar, so
+        that any number of workers (see work()) can share the download.
+
+        Arguments:
+        stale_after -- If given, only stocks whose data is older than this many
+                       seconds are queued.
+        """
+        from stockrank.scrapers.scraper import StockScraper
+
+        skip_symbols = set()
+
+        if stale_after is not None:
+            skip_symbols = self._db.fresh_symbols(stale_after)
+
+        # only Google and the ASX are needed to list the stocks, so we don't
+        # log into MorningStar
+        scraper = StockScraper(self._config, morningstar=False)
+        queue = self._work_queue()
+        queued = 0
+
+        for batch in batched(scraper.candidates(skip_symbols), 500):
+            queue.enqueue(batch)
+            queued += len(batch)
+
+        print('queued %d stocks' % queued)
+
+    def work(self):
+        """Scrapes stocks from the work queue until it's empty, storing each
+        one in the queue's database. Several workers, on one machine or many,
+        can run at once. The stocks are ranked by print_progress() once every
+        worker is done, rather than by each worker.
+        """
+        from stockrank.scrapers.scraper import StockScraper
+
+        batch_size = self._config.getint('Application', 'batch_size',
+                                         fallback=50)
+        claim_size = self._config.getint('WorkQueue', 'claim_size',
+                                         fallback=10)
+        poll_seconds = self._config.getfloat('WorkQueue', 'poll_seconds',
+                                             fallback=5.0)
+        queue = self._work_queue()
+        results = self._queue_database()
+        worker = default_worker_id()
+
+        scraper = StockScraper(self._config)
+        stocks = scraper.scrape_morningstar(
+            queue.claimed(worker, claim_size, poll_seconds))
+
+        try:
+            for batch in batched(stocks, batch_size):
+                # the stocks are stored before they're marked as done, so a
+                # crash in between only means they're scraped again
+                with metrics.phase('db_write'):
+                    results.populate([stock for stock, scraped in batch
+                                      if scraped], rerank=False)
+                queue.complete([stock.symbol for stock, _ in batch])
+        finally:
+            # let other workers retry whatever we didn't get to
+            queue.release(worker)
+
+        self._report_metrics()
+
+    def _report_metrics(self):
+        """Prints the parsing throughput and the time spent in each phase of
+        a download, and writes its metrics to the configured files.
+        """
+        parsed = metrics.counter('parsed')
+        seconds = metrics.counter('parse_seconds')
+
+        if parsed:
+            print('parsed %d stocks in %.1fs (%.1f stocks/s)'
+                  % (parsed, seconds, parsed / seconds if seconds else 0.0))
+
+        print('phases:', metrics.summary())
+        metrics.dump(self._config.get('Metrics', 'json_path', fallback=''),
+                     self._config.get('Metrics', 'prometheus_path',
+                                      fallback=''))
+
+    def print_progress(self):
+        """Prints the progress of the workers sharing the work queue. Once
+        they're all done, the stocks they scraped are copied into our local
+        copy, if the queue is held elsewhere, and ranked.
+        """
+        progress = self._work_queue().progress()
+        remaining = progress['pending'] + progress['leased']
+
+        print('%d pending, %d leased, %d done, %d failed'
+              % (progress['pending'], progress['leased'], progress['done'],
+                 progress['failed']))
+
+        if progress['rate']:
+            print('%d workers, %.2f stocks/s, about %.0f minutes left'
+                  % (progress['workers'], progress['rate'],
+                     remaining / progress['rate'] / 60))
+        else:
+            print('%d workers' % progress['workers'])
+
+        if remaining == 0 and progress['done']:
+            results = self._queue_database()
+
+            if results is not self._db:
+                for batch in batched(results.get_stock_profiles(), 500):
+                    self._db.populate(batch, rerank=False)
+
+            self._rank_and_snapshot()
+            print('ranked %d stocks' % len(self._stock_profiles))
+
+    def download(self, stale_after=None, resume=False):
+        """Gets a list of stocks from online sources, and updates our local
+        copy with it.
 
         (Note that at this level of abstraction, the fact that we are actually
         "scraping" is hidden. Hence why this function is named "download()")
+
+        Arguments:
+        stale_after -- If given, only stocks whose data is older than this many
+                       seconds are downloaded again.
+        resume -- If True, an interrupted download is continued, skipping the
+                  stocks it already stored.
         """
-        # scrape
+        from stockrank.scrapers.scraper import StockScraper
+
+        batch_size = self._config.getint('Application', 'batch_size',
+                                         fallback=50)
+        run_id = self._db.start_run(resume)
+        skip_symbols = self._db.journaled_symbols(run_id)
+
+        if stale_after is not None:
+            skip_symbols |= self._db.fresh_symbols(stale_after)
+
+        # stream scraped stocks into the db in batches, so a crash only loses
+        # the current batch
         scraper = StockScraper(self._config)
-        self._stock_profiles = _rank_stocks(scraper.scrape_stock_profiles())
-        # save to db
-        self._db.populate(self._stock_profiles)
+        stock_profiles = scraper.scrape_stock_profiles(skip_symbols)
+
+        for batch in batched(stock_profiles, batch_size):
+            with metrics.phase('db_write'):
+                self._db.populate(batch, run_id=run_id, rerank=False)
+
+        self._db.finish_run(run_id)
+
+        # rank everything we have, including stocks we skipped
+        self._rank_and_snapshot()
+
+        if scraper.cache:
+            print(scraper.cache.report())
+
+        self._report_metrics()
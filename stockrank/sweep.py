@@ -0,0 +1,189 @@
+"""Screens one universe of stocks under many configurations ('screens') at
+once, eg to see how the top picks change with the market cap floor, the
+sectors excluded, or the weight given to each magic formula metric.
+
+Each metric is sorted once for the whole universe. A screen's ranks are then
+read off the presorted orders in linear time, by counting the stocks its
+mask lets through, and masks (and the ranks under them) are shared by every
+screen with the same filters.
+"""
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import numpy as np
+from stockrank import ranking
+
+# a screening configuration. weights is a tuple of the weights given to the
+# earnings yield and return on capital ranks; the magic formula is (1, 1)
+Screen = collections.namedtuple(
+    'Screen', ['min_market_cap', 'excluded_sectors', 'weights'])
+
+
+def screens(market_caps, sector_exclusions, weights):
+    """Returns a Screen for every combination of the given market cap floors
+    (None for no floor), collections of excluded sectors, and weights.
+    """
+    return [Screen(market_cap, tuple(sectors), tuple(weight))
+            for market_cap, sectors, weight in itertools.product(
+                market_caps, sector_exclusions, weights)]
+
+
+class Universe(object):
+    """A universe of stocks, prepared for screening.
+    """
+    def __init__(self, symbols, sectors, market_caps, earnings_yield,
+                 return_on_capital):
+        """Arguments:
+        symbols, sectors -- Arrays of each stock's symbol and sector.
+        market_caps, earnings_yield, return_on_capital -- float64 arrays, with
+            NaN for missing values.
+        """
+        self._columns = (symbols, sectors, market_caps, earnings_yield,
+                         return_on_capital)
+        self.symbols = symbols
+        self._market_caps = market_caps
+        self._orders = (ranking.descending_order(earnings_yield),
+                        ranking.descending_order(return_on_capital))
+        self._sector_names, self._sector_codes = np.unique(
+            np.array([sector or '' for sector in sectors], dtype=object),
+            return_inverse=True)
+        # masks, and the ranks under them, keyed by the filters they apply
+        self._masks = {}
+        self._ranks = {}
+
+    @classmethod
+    def from_table(cls, table):
+        """Prepares a StockTable for screening.
+        """
+        return cls(table.symbol, table.sector, table.market_cap,
+                   table.earnings_yield, table.return_on_capital)
+
+    def columns(self):
+        """Returns the arguments this universe was built from, eg to rebuild
+        it in another process.
+        """
+        return self._columns
+
+    def _mask(self, key, build):
+        if key not in self._masks:
+            self._masks[key] = build()
+        return self._masks[key]
+
+    def mask(self, screen):
+        """Returns the boolean mask of the stocks passing a screen's filters.
+        """
+        market_cap, sectors = screen.min_market_cap, screen.excluded_sectors
+
+        def cap_mask():
+            if market_cap is None:
+                return np.ones(len(self.symbols), dtype=bool)
+            return self._market_caps >= market_cap
+
+        def sector_mask():
+            excluded = np.array([any(x in name for x in sectors)
+                                 for name in self._sector_names], dtype=bool)
+            return ~excluded[self._sector_codes]
+
+        return self._mask(
+            (market_cap, sectors),
+            lambda: self._mask(('cap', market_cap), cap_mask) &
+            self._mask(('sectors', sectors), sector_mask))
+
+    def ranks(self, screen):
+        """Returns a tuple of (mask, earnings yield ranks, return on capital
+        ranks) for a screen, ranking only the stocks in its mask. Ranks of
+        other stocks are meaningless.
+        """
+        key = (screen.min_market_cap, screen.excluded_sectors)
+
+        if key not in self._ranks:
+            mask = self.mask(screen)
+            self._ranks[key] = (mask,) + tuple(
+                _masked_ranks(order, mask) for order in self._orders)
+
+        return self._ranks[key]
+
+    def top(self, screen, count):
+        """Returns the symbols of the top 'count' stocks under a screen, in
+        ranked order. With weights of (1, 1), this is the magic formula
+        ranking of the stocks passing the screen's filters.
+        """
+        mask, earnings_yield, return_on_capital = self.ranks(screen)
+        count = min(count, int(mask.sum()))
+
+        if count == 0:
+            return self.symbols[:0]
+
+        earnings_weight, roc_weight = screen.weights
+        score = np.where(mask, earnings_weight * earnings_yield +
+                         roc_weight * return_on_capital, np.inf)
+
+        # partition rather than sort, keeping every stock tied with the last
+        # one, then break ties by original order as the ranking does
+        threshold = np.partition(score, count - 1)[count - 1]
+        candidates = np.flatnonzero(score <= threshold)
+        best = candidates[np.argsort(score[candidates],
+                                     kind='stable')[:count]]
+        return self.symbols[best]
+
+
+def _masked_ranks(order, mask):
+    """Returns the rank of each stock in a mask among the stocks in the mask,
+    given the order of a metric over every stock.
+    """
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.cumsum(mask[order]) - 1
+    return ranks
+
+
+# the universe of a sweep's worker process
+_universe = None
+
+
+def _init_worker(columns):
+    global _universe
+    _universe = Universe(*columns)
+
+
+def _top_many(chunk, count):
+    return [_universe.top(screen, count) for screen in chunk]
+
+
+def sweep(universe, all_screens, count=10, processes=1):
+    """Returns the top 'count' symbols under each screen, as a list in the
+    order of the screens.
+
+    Arguments:
+    universe -- A Universe.
+    all_screens -- A list of Screens.
+    count -- Number of stocks picked by each screen.
+    processes -- Number of processes to screen in; None means one per core.
+                 Each process prepares its own copy of the universe.
+    """
+    processes = processes or multiprocessing.cpu_count()
+
+    if processes == 1 or len(all_screens) < 2:
+        return [universe.top(screen, count) for screen in all_screens]
+
+    # screens sharing filters go to the same process, so they share masks
+    order = sorted(range(len(all_screens)), key=lambda i: (
+        all_screens[i].min_market_cap or 0, all_screens[i].excluded_sectors))
+    size = -(-len(order) // processes)
+    chunks = [order[i:i + size] for i in range(0, len(order), size)]
+
+    results = [None] * len(all_screens)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            len(chunks), multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(universe.columns(),)) as executor:
+        futures = [(chunk, executor.submit(
+                    _top_many, [all_screens[i] for i in chunk], count))
+                   for chunk in chunks]
+
+        for chunk, future in futures:
+            for i, symbols in zip(chunk, future.result()):
+                results[i] = symbols
+
+    return results
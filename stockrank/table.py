@@ -0,0 +1,206 @@
+import sys
+import numpy as np
+from stockrank import ranking
+from stockrank.stock import StockProfile
+
+# text columns are stored as NumPy object arrays of interned strings
+TEXT_FIELDS = ('symbol', 'title', 'sector')
+
+# numeric columns are stored as float64 arrays, with NaN for missing values
+NUMERIC_FIELDS = ('return_on_capital', 'ebit', 'market_cap', 'total_debt',
+                  'cash')
+
+# numeric fields which StockProfile holds as integers
+_INTEGER_FIELDS = ('market_cap', 'total_debt', 'cash')
+
+
+def _intern(value):
+    return None if value is None else sys.intern(value)
+
+
+class StockTable(object):
+    """A column-oriented container of stocks. Each field is held in its own
+    NumPy array, rather than in one Python object per stock, and derived
+    metrics such as earnings yield are computed once for the whole table.
+
+    Indexing or iterating a table gives StockRow views, which read their
+    fields from the table's columns and can be used in place of StockProfile
+    objects.
+    """
+    def __init__(self, columns, derived=None):
+        """Arguments:
+        columns -- A dict mapping every field in TEXT_FIELDS and
+                   NUMERIC_FIELDS to an equal-length NumPy array. Text may
+                   also be held as UTF-8 bytes, eg in a memory-mapped file.
+        derived -- An optional dict of derived columns (eg earnings_yield)
+                   which have already been computed.
+        """
+        self.columns = columns
+        self._derived = dict(derived or {})
+
+    @classmethod
+    def from_rows(cls, rows, count=None):
+        """Builds a table from an iterable of tuples, whose values are in the
+        order of TEXT_FIELDS followed by NUMERIC_FIELDS.
+        """
+        rows = list(rows) if count is None else rows
+        count = len(rows) if count is None else count
+        columns = {}
+
+        for field in TEXT_FIELDS:
+            columns[field] = np.empty(count, dtype=object)
+
+        for field in NUMERIC_FIELDS:
+            columns[field] = np.empty(count, dtype=np.float64)
+
+        text_columns = [columns[field] for field in TEXT_FIELDS]
+        numeric_columns = [columns[field] for field in NUMERIC_FIELDS]
+        width = len(TEXT_FIELDS)
+
+        for i, row in enumerate(rows):
+            for column, value in zip(text_columns, row):
+                column[i] = _intern(value)
+            for column, value in zip(numeric_columns, row[width:]):
+                column[i] = np.nan if value is None else value
+
+        return cls(columns)
+
+    @classmethod
+    def from_profiles(cls, stock_profiles):
+        """Builds a table from a list of StockProfile objects.
+        """
+        fields = TEXT_FIELDS + NUMERIC_FIELDS
+        return cls.from_rows([[getattr(stock, field) for field in fields]
+                              for stock in stock_profiles])
+
+    def __len__(self):
+        return len(self.columns['symbol'])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('StockTable index out of range')
+
+        return StockRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield StockRow(self, i)
+
+    def __getattr__(self, name):
+        # columns can be read as attributes, eg table.market_cap
+        columns = self.__dict__.get('columns', {})
+
+        if name not in columns:
+            raise AttributeError(name)
+
+        return columns[name]
+
+    @property
+    def enterprise_value(self):
+        """Column of enterprise values (market cap + total debt - cash).
+        """
+        if 'enterprise_value' not in self._derived:
+            columns = self.columns
+            self._derived['enterprise_value'] = \
+                columns['market_cap'] + columns['total_debt'] - columns['cash']
+
+        return self._derived['enterprise_value']
+
+    @property
+    def earnings_yield(self):
+        """Column of earnings yields, NaN where they can't be computed.
+        """
+        if 'earnings_yield' not in self._derived:
+            columns = self.columns
+            self._derived['earnings_yield'] = ranking.earnings_yields(
+                columns['ebit'], columns['market_cap'],
+                columns['total_debt'], columns['cash'])
+
+        return self._derived['earnings_yield']
+
+    def take(self, indices):
+        """Returns a new table holding the given rows, in the given order.
+        Derived columns which were already computed are carried over.
+        """
+        table = StockTable({field: column[indices]
+                            for field, column in self.columns.items()})
+        table._derived = {name: column[indices]
+                          for name, column in self._derived.items()}
+        return table
+
+    def ranks(self):
+        """Ranks the table according to the magic formula. Returns the same
+        tuple as stockrank.ranking.magic_formula_ranks().
+        """
+        return ranking.magic_formula_ranks(self.earnings_yield,
+                                           self.columns['return_on_capital'])
+
+    def ranked(self):
+        """Returns a copy of the table, in ranked order.
+        """
+        return self.take(self.ranks()[2])
+
+    def to_profiles(self):
+        """Returns the table's rows as a list of StockProfile objects.
+        """
+        return [row.to_profile() for row in self]
+
+
+class StockRow(object):
+    """A view of one row of a StockTable. Fields are read from the table on
+    access, so creating a row copies nothing.
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def earnings_yield(self):
+        return float(self._table.earnings_yield[self._index])
+
+    @property
+    def enterprise_value(self):
+        return float(self._table.enterprise_value[self._index])
+
+    def to_profile(self):
+        """Returns a StockProfile holding a copy of this row.
+        """
+        fields = TEXT_FIELDS + NUMERIC_FIELDS
+        return StockProfile(**{field: getattr(self, field)
+                               for field in fields})
+
+
+def _text_property(field):
+    def getter(self):
+        value = self._table.columns[field][self._index]
+
+        # as stored in a file, where missing text is empty
+        if isinstance(value, bytes):
+            return value.decode('utf-8') or None
+
+        return value
+    return property(getter)
+
+
+def _numeric_property(field, integer):
+    def getter(self):
+        value = self._table.columns[field][self._index]
+
+        if np.isnan(value):
+            return None
+
+        return int(value) if integer else float(value)
+    return property(getter)
+
+
+for _field in TEXT_FIELDS:
+    setattr(StockRow, _field, _text_property(_field))
+
+for _field in NUMERIC_FIELDS:
+    setattr(StockRow, _field,
+            _numeric_property(_field, _field in _INTEGER_FIELDS))
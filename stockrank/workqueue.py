@@ -0,0 +1,189 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from stockrank.stock import StockProfile
+from stockrank.helpers import timestamp
+
+# states of a symbol in the queue
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_worker_id():
+    """Returns an id for this process which is unique across machines.
+    """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """A queue of stocks to scrape, shared by any number of worker processes
+    through an SQLite database. The database can be the one holding our
+    stocks, or any file every worker can reach.
+
+    A worker claims a few stocks at a time, taking a lease on each. A stock
+    whose lease expires before the worker completes it (eg because the worker
+    died) can be claimed by another worker, until it has been attempted
+    max_attempts times; it's then marked as failed. Completing a stock twice
+    is harmless, so results can be written back idempotently.
+    """
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # other workers may hold the database lock briefly while claiming
+        db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        db.execute('CREATE TABLE IF NOT EXISTS work_queue '
+                   '(symbol TEXT PRIMARY KEY,'
+                   'title TEXT,'
+                   'sector TEXT,'
+                   'market_cap INTEGER,'
+                   'state TEXT,'
+                   'lease_owner TEXT,'
+                   'lease_expires REAL,'
+                   'attempts INTEGER,'
+                   'enqueued_at REAL,'
+                   'finished_at REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS work_queue_state '
+                   'ON work_queue (state, lease_expires)')
+        db.commit()
+        self._db = db
+        self._lock = threading.Lock()
+
+    def enqueue(self, stock_profiles):
+        """Adds stocks to the queue, along with the data we already have on
+        them from Google and the ASX. Stocks already queued are reset to
+        pending, unless they're currently leased.
+
+        Arguments:
+        stock_profiles -- A list of StockProfile objects.
+        """
+        now = timestamp()
+
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO work_queue VALUES '
+                '(?, ?, ?, ?, ?, NULL, NULL, 0, ?, NULL) '
+                'ON CONFLICT(symbol) DO UPDATE SET '
+                'title = excluded.title, sector = excluded.sector, '
+                'market_cap = excluded.market_cap, state = excluded.state, '
+                'lease_owner = NULL, lease_expires = NULL, attempts = 0, '
+                'enqueued_at = excluded.enqueued_at, finished_at = NULL '
+                'WHERE state != ? OR lease_expires < ?',
+                ((stock.symbol, stock.title, stock.sector, stock.market_cap,
+                  PENDING, now, LEASED, now) for stock in stock_profiles))
+            self._db.commit()
+
+    def claim(self, worker, count):
+        """Leases up to 'count' stocks to a worker, and returns them as a list
+        of StockProfile objects holding the enqueued data. Pending stocks are
+        claimed first, then stocks whose lease has expired.
+        """
+        now = timestamp()
+
+        with self._lock:
+            # stocks which have used up their attempts won't be retried
+            self._db.execute('UPDATE work_queue SET state = ? '
+                             'WHERE state = ? AND lease_expires < ? '
+                             'AND attempts >= ?',
+                             (FAILED, LEASED, now, self.max_attempts))
+
+            # a single statement, so two workers can't claim the same stock
+            rows = self._db.execute(
+                'UPDATE work_queue SET state = ?, lease_owner = ?, '
+                'lease_expires = ?, attempts = attempts + 1 '
+                'WHERE symbol IN (SELECT symbol FROM work_queue '
+                'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                'ORDER BY attempts, enqueued_at LIMIT ?) '
+                'RETURNING symbol, title, sector, market_cap',
+                (LEASED, worker, now + self.lease_seconds, PENDING, LEASED,
+                 now, count)).fetchall()
+            self._db.commit()
+
+        return [StockProfile(symbol=symbol, title=title, sector=sector,
+                             market_cap=market_cap)
+                for symbol, title, sector, market_cap in rows]
+
+    def outstanding(self, exclude_worker=None):
+        """Returns the number of stocks which are pending, or leased by a
+        worker other than exclude_worker. Leases which have expired count as
+        outstanding, as they will be retried.
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT count(*) FROM work_queue WHERE state = ? '
+                'OR (state = ? AND (lease_owner IS NOT ? '
+                'OR lease_expires < ?))',
+                (PENDING, LEASED, exclude_worker, timestamp())).fetchone()[0]
+
+    def claimed(self, worker, count=10, poll_interval=5.0):
+        """Yields stocks leased to a worker, claiming 'count' at a time as
+        they're consumed. When nothing can be claimed but other workers still
+        hold leases, waits for them to either complete or expire, so that
+        stocks abandoned by a dead worker are picked up.
+        """
+        while True:
+            stocks = self.claim(worker, count)
+
+            if stocks:
+                yield from stocks
+            elif self.outstanding(exclude_worker=worker):
+                time.sleep(poll_interval)
+            else:
+                return
+
+    def complete(self, symbols):
+        """Marks stocks as done. Stocks which are already done, eg because a
+        worker whose lease expired finished them anyway, are left alone.
+        """
+        with self._lock:
+            self._db.executemany(
+                'UPDATE work_queue SET state = ?, finished_at = ?, '
+                'lease_owner = NULL, lease_expires = NULL '
+                'WHERE symbol = ? AND state != ?',
+                ((DONE, timestamp(), symbol, DONE) for symbol in symbols))
+            self._db.commit()
+
+    def release(self, worker):
+        """Returns every stock still leased to a worker to the queue, so that
+        it's retried straight away rather than once its lease expires. Stocks
+        which have used up their attempts are marked as failed instead, as
+        they are when their lease expires.
+        """
+        with self._lock:
+            self._db.execute('UPDATE work_queue SET state = CASE '
+                             'WHEN attempts >= ? THEN ? ELSE ? END, '
+                             'lease_owner = NULL, lease_expires = NULL '
+                             'WHERE state = ? AND lease_owner = ?',
+                             (self.max_attempts, FAILED, PENDING, LEASED,
+                              worker))
+            self._db.commit()
+
+    def progress(self, window=300):
+        """Returns a dict summarising the queue: the number of stocks in each
+        state, the number of workers holding leases, and the rate (in stocks
+        per second) at which stocks were completed over the last 'window'
+        seconds.
+        """
+        now = timestamp()
+
+        with self._lock:
+            counts = dict(self._db.execute(
+                'SELECT state, count(*) FROM work_queue GROUP BY state'))
+            workers = self._db.execute(
+                'SELECT count(DISTINCT lease_owner) FROM work_queue '
+                'WHERE state = ? AND lease_expires >= ?',
+                (LEASED, now)).fetchone()[0]
+            recent = self._db.execute(
+                'SELECT count(*) FROM work_queue '
+                'WHERE state = ? AND finished_at >= ?',
+                (DONE, now - window)).fetchone()[0]
+
+        progress = {state: counts.get(state, 0)
+                    for state in (PENDING, LEASED, DONE, FAILED)}
+        progress['workers'] = workers
+        progress['rate'] = recent / window
+        return progress
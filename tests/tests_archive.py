@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+from stockrank.scrapers.archive import PageArchive
+from stockrank.scrapers.morningstar import profile_from_archive, \
+    ARCHIVED_PAGES, HISTORICALS, BALANCESHEET
+from stockrank.stock import StockProfile
+from stockrank.stockrank import StockRank
+
+ASSETS = os.path.join(os.path.dirname(__file__), 'assets')
+
+
+def _read(filename):
+    with open(os.path.join(ASSETS, filename)) as f:
+        return f.read()
+
+
+class PageArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.archive = PageArchive(os.path.join(self.dir, 'archive.db'))
+
+        historicals = _read('Pharmaxis Ltd - Company Historicals.html')
+        balancesheet = _read('Pharmaxis Ltd - Balance Sheet.html')
+
+        self.archive.store('PXS', HISTORICALS, 'url', 'old', fetched_at=1)
+        self.archive.store('PXS', HISTORICALS, 'url', historicals,
+                           fetched_at=2)
+        self.archive.store('PXS', BALANCESHEET, 'url', balancesheet,
+                           fetched_at=2)
+        # incomplete stocks are skipped
+        self.archive.store('ZZZ', HISTORICALS, 'url', historicals)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_latest_pages(self):
+        self.assertEqual(self.archive.latest('PXS', HISTORICALS)[:5],
+                         _read('Pharmaxis Ltd - Company Historicals.html')[:5])
+
+        archived = list(self.archive.latest_pages(ARCHIVED_PAGES))
+        self.assertEqual([symbol for symbol, _ in archived], ['PXS'])
+
+        stock = profile_from_archive(archived[0])
+        self.assertEqual(stock.title, 'Pharmaxis Ltd')
+        self.assertEqual(stock.ebit, 19010000)
+        self.assertEqual(stock.cash, 54138000)
+
+    def test_reparse(self):
+        config_path = os.path.join(self.dir, 'config.ini')
+
+        with open(config_path, 'w') as f:
+            f.write('[Application]\ndatabase_path = %s\n'
+                    '[Archive]\npath = %s\n'
+                    % (os.path.join(self.dir, 'stocks.db'),
+                       os.path.join(self.dir, 'archive.db')))
+
+        stockrank = StockRank(config_path)
+        stockrank._db.populate([StockProfile(
+            symbol='PXS', title='Pharmaxis', sector='Health Care',
+            return_on_capital=0.0, ebit=0, market_cap=70000000,
+            total_debt=0, cash=0)])
+        stockrank.reparse()
+
+        stock = stockrank._db.get_stock_profiles()[0]
+        self.assertEqual(stock.return_on_capital, 0.36)
+        self.assertEqual(stock.ebit, 19010000)
+        self.assertEqual(stock.total_debt, 10893000)
+        # Google's market cap is kept
+        self.assertEqual(stock.market_cap, 70000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import io
+import os
+import tempfile
+import unittest
+import urllib.error
+from unittest import mock
+from stockrank.scrapers.asx import AsxScraper
+from stockrank.scrapers.executor import request_executor
+
+CSV = ('ASX listed companies as at Mon Jan 18 2016\r\n'
+       '\r\n'
+       'Company name,ASX code,GICS industry group\r\n'
+       '"PHARMAXIS LTD",PXS,"Pharmaceuticals, Biotechnology & Life '
+       'Sciences"\r\n'
+       '"BHP BILLITON LIMITED",BHP,"Materials"\r\n')
+
+
+class MockResponse(io.BytesIO):
+
+    def __init__(self, text, headers=None):
+        super().__init__(text.encode('utf-8'))
+        self.status = 200
+        self.headers = headers or {}
+
+
+class AsxScraperTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        request_executor.reset()
+
+        # failed requests are retried without waiting
+        for name in ('rate_limiter', 'time.sleep'):
+            patcher = mock.patch('stockrank.scrapers.executor.' + name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _urlopen(self, *responses):
+        return mock.patch('urllib.request.urlopen', side_effect=responses)
+
+    def test_sectors_are_stored(self):
+        with self._urlopen(MockResponse(CSV, {'ETag': '"v1"'})) as urlopen:
+            scraper = AsxScraper(self.path, ttl=3600)
+            self.assertEqual(scraper.sector('BHP'), 'Materials')
+            self.assertEqual(scraper.relation()['PXS'], {
+                'sector': 'Pharmaceuticals, Biotechnology & Life Sciences'})
+            self.assertEqual(urlopen.call_count, 1)
+
+        # a later run is served from the database, without any request
+        with self._urlopen() as urlopen:
+            scraper = AsxScraper(self.path, ttl=3600)
+            self.assertEqual(scraper.sector('BHP'), 'Materials')
+            self.assertEqual(scraper.version(), 1)
+            self.assertFalse(urlopen.called)
+
+        with self.assertRaises(KeyError):
+            scraper.sector('ZZZ')
+
+    def test_expired_sectors(self):
+        with self._urlopen(MockResponse(CSV, {'ETag': '"v1"'})):
+            AsxScraper(self.path).relation()
+
+        not_modified = urllib.error.HTTPError('url', 304, 'Not Modified',
+                                              {}, None)
+
+        with self._urlopen(not_modified) as urlopen:
+            scraper = AsxScraper(self.path)
+            self.assertEqual(scraper.sector('PXS')[:5], 'Pharm')
+            self.assertEqual(scraper.version(), 2)
+
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"v1"')
+
+        # offline, the last sectors stored are used
+        offline = urllib.error.URLError('no network')
+
+        with self._urlopen(*[offline] * 6), mock.patch('builtins.print'):
+            self.assertEqual(AsxScraper(self.path).sector('BHP'), 'Materials')
+
+        # as they are when the ASX is down
+        request_executor.reset()
+        unavailable = urllib.error.HTTPError('url', 503, 'Unavailable', {},
+                                             None)
+
+        with self._urlopen(*[unavailable] * 6), mock.patch('builtins.print'):
+            self.assertEqual(AsxScraper(self.path).sector('BHP'), 'Materials')
+
+        # but with nothing stored, there's nothing to fall back on. (the
+        # retries above opened the ASX's circuit, so start afresh)
+        request_executor.reset()
+
+        with self._urlopen(*[offline] * 6):
+            with self.assertRaises(urllib.error.URLError):
+                AsxScraper().sector('BHP')
+
+
+if __name__ == '__main__':
+    unittest.main()
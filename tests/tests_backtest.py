@@ -0,0 +1,168 @@
+import configparser
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from stockrank.backtest import Prices, load_prices, snapshot_ranks, \
+    backtest
+from stockrank.database import StockDatabase
+from stockrank.ranking import profile_ranks
+from stockrank.stock import StockProfile
+from stockrank.stockrank import StockRank
+
+DATES = np.datetime64('2020-01-01') + np.arange(6)
+SYMBOLS = np.array(['AAA', 'BBB', 'CCC'], dtype=object)
+
+
+def _profile(symbol, ebit, sector='Materials'):
+    return StockProfile(symbol=symbol, title=symbol + ' Ltd', sector=sector,
+                        return_on_capital=ebit / 10, ebit=ebit,
+                        market_cap=60000000, total_debt=0, cash=0)
+
+
+class BacktestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _prices(self):
+        closes = np.array([[10, 20, 40],
+                           [11, 20, 40],
+                           [12, 20, 40],
+                           [12, 30, 40],
+                           [12, 30, np.nan],
+                           [12, 15, 80]], dtype=np.float64)
+        return Prices(DATES, SYMBOLS, closes)
+
+    def test_rebalancing(self):
+        snapshot_dates = DATES[[0, 2]]
+        ranks = np.array([[1, 2, np.inf],
+                          [3, 1, 2]], dtype=np.float64)
+
+        result = backtest(self._prices(), snapshot_dates, ranks,
+                          portfolio_size=2, holding_days=3, cost=0.01)
+
+        # AAA and BBB are bought on day 0, then BBB and CCC on day 3, from
+        # the snapshot taken on day 2
+        self.assertEqual([list(x) for x in result.holdings],
+                         [['AAA', 'BBB'], ['BBB', 'CCC']])
+        np.testing.assert_array_equal(result.rebalance_dates, DATES[[0, 3]])
+
+        # by day 3 the portfolio has drifted to 4/9 AAA and 5/9 BBB, so
+        # selling AAA, trimming BBB and buying CCC trades all of it
+        np.testing.assert_allclose(result.turnover, [1, 1])
+        rebalanced = 0.99 * 1.35 * 0.99
+        expected = [0.99, 0.99 * 1.05, 0.99 * 1.1, rebalanced, rebalanced,
+                    rebalanced * 1.25]
+        np.testing.assert_allclose(result.values, expected)
+
+        summary = result.summary()
+        self.assertAlmostEqual(summary['total_return'], expected[-1] - 1)
+        self.assertEqual(summary['rebalances'], 2)
+        self.assertEqual(summary['max_drawdown'], 0)
+
+    def test_untradeable_stocks(self):
+        prices = self._prices()
+
+        # no snapshot ranks anything, so the portfolio stays in cash
+        result = backtest(prices, DATES[:1], np.full((1, 3), np.inf),
+                          holding_days=2)
+        np.testing.assert_array_equal(result.values, np.ones(6))
+
+        # CCC has no price on day 4, so can't be bought then
+        result = backtest(prices, DATES[:1], np.array([[3.0, 2.0, 1.0]]),
+                          portfolio_size=1, holding_days=2, start=DATES[2])
+        self.assertEqual([list(x) for x in result.holdings],
+                         [['CCC'], ['BBB']])
+
+        # only AAA can be bought, so half the portfolio stays in cash
+        ranks = np.array([[1.0, np.inf, np.inf]])
+        result = backtest(prices, DATES[:1], ranks, portfolio_size=2,
+                          holding_days=6)
+        self.assertEqual([list(x) for x in result.holdings], [['AAA']])
+        np.testing.assert_allclose(result.values,
+                                   [1, 1.05, 1.1, 1.1, 1.1, 1.1])
+        np.testing.assert_allclose(result.turnover, [0.5])
+
+        with self.assertRaises(ValueError):
+            backtest(prices, DATES[:1], np.ones((1, 3)),
+                     end=DATES[0] - 1)
+
+    def test_load_prices(self):
+        with open(os.path.join(self.workdir, 'all.csv'), 'w') as f:
+            f.write('Date,Symbol,Close\n'
+                    '2020-01-02,BBB,5.5\n'
+                    '2020-01-01,AAA,1.5\n'
+                    '2020-01-02,AAA,2\n')
+
+        with open(os.path.join(self.workdir, 'ccc.csv'), 'w') as f:
+            f.write('date,close\n'
+                    '2020-01-03,7\n')
+
+        prices = load_prices(self.workdir)
+        self.assertEqual(list(prices.symbols), ['AAA', 'BBB', 'CCC'])
+        np.testing.assert_array_equal(prices.dates, DATES[:3])
+        np.testing.assert_array_equal(prices.closes,
+                                      [[1.5, np.nan, np.nan],
+                                       [2, 5.5, np.nan],
+                                       [np.nan, np.nan, 7]])
+
+        with self.assertRaises(ValueError):
+            load_prices(os.path.join(self.workdir, 'empty'))
+
+    def test_snapshot_ranks(self):
+        rows = [('2020-01-01', 'AAA', 1, 'Materials', 60000000),
+                ('2020-01-01', 'ZZZ', 2, 'Materials', 60000000),
+                ('2020-01-01', 'BBB', 3, 'Banks', 60000000),
+                ('2020-01-03', 'CCC', 1, 'Energy', 10)]
+
+        dates, ranks = snapshot_ranks(rows, SYMBOLS, ['Bank'], 1000)
+        np.testing.assert_array_equal(dates, DATES[[0, 2]])
+        np.testing.assert_array_equal(ranks, [[1, np.inf, np.inf],
+                                              [np.inf, np.inf, np.inf]])
+
+    def test_stored_snapshots(self):
+        path = os.path.join(self.workdir, 'stocks.db')
+        config = configparser.ConfigParser()
+        config.read_dict({'Application': {'database_path': path}})
+        db = StockDatabase(config)
+
+        stocks = [_profile('AAA', 1), _profile('BBB', 3),
+                  _profile('CCC', 2, 'Banks')]
+        db.save_snapshot(stocks, *profile_ranks(stocks),
+                         date=datetime.date(2020, 1, 1))
+
+        with open(os.path.join(self.workdir, 'prices.csv'), 'w') as f:
+            f.write('date,symbol,close\n')
+
+            for day in range(6):
+                for symbol in SYMBOLS:
+                    f.write('2020-01-0%d,%s,%d\n' % (day + 1, symbol,
+                                                     10 + day))
+
+        config_path = os.path.join(self.workdir, 'config.ini')
+
+        with open(config_path, 'w') as f:
+            f.write('[Application]\ndatabase_path = %s\n'
+                    '[Backtest]\nprices_path = %s\nexcluded_sectors = Bank\n'
+                    % (path, os.path.join(self.workdir, 'prices.csv')))
+
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            StockRank(config_path).backtest(portfolio_size=1, cost_bps=0)
+
+        self.assertIn('2020-01-01 to 2020-01-06, 1 rebalances',
+                      output.getvalue())
+        self.assertIn('total return       50.00%', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import contextlib
+import io
+import unittest
+from benchmarks import suite
+
+
+class BenchmarkSuiteTests(unittest.TestCase):
+
+    def test_run(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            results = suite.run([100])
+
+        names = [x['name'] for x in results['results']]
+        self.assertEqual(names, ['rank_stocks', 'populate',
+                                 'get_stock_profiles', 'get_stock_table',
+                                 'rank_table', 'top_30', 'export',
+                                 'load_export', 'sweep_100',
+                                 'print_stocks',
+                                 'parse_morningstar', 'backtest',
+                                 'import_main'])
+
+        for result in results['results']:
+            self.assertGreater(result['seconds'], 0)
+
+            if result['name'] != 'import_main':
+                self.assertGreater(result['peak_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from stockrank.scrapers.cache import ResponseCache
+
+
+class MockOpener(object):
+    """Records requests, and answers them with a fixed body and ETag. Sends
+    '304 Not Modified' when the request's ETag matches.
+    """
+    def __init__(self, body='page', etag='"v1"'):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    def __call__(self, url, headers):
+        self.requests.append(headers)
+
+        if headers.get('If-None-Match') == self.etag:
+            return 304, {}, None
+
+        return 200, {'ETag': self.etag}, self.body
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_hit_within_ttl(self):
+        cache = ResponseCache(self.path)
+        opener = MockOpener()
+
+        self.assertEqual(cache.fetch('http://a/1', 60, opener), 'page')
+        self.assertEqual(cache.fetch('http://a/1', 60, opener), 'page')
+        self.assertEqual(len(opener.requests), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_revalidate_after_ttl(self):
+        cache = ResponseCache(self.path)
+        opener = MockOpener()
+        cache.fetch('http://a/1', 60, opener)
+
+        with mock.patch('stockrank.scrapers.cache.timestamp',
+                        return_value=1e12):
+            self.assertEqual(cache.fetch('http://a/1', 60, opener), 'page')
+
+        self.assertEqual(opener.requests[-1], {'If-None-Match': '"v1"'})
+        self.assertEqual(cache.revalidated, 1)
+
+    def test_errors_not_stored(self):
+        cache = ResponseCache(self.path)
+        opener = mock.Mock(return_value=(503, {}, 'unavailable'))
+
+        self.assertEqual(cache.fetch('http://a/1', 60, opener), 'unavailable')
+
+        # the next fetch goes to the server, rather than serving the error
+        self.assertEqual(cache.fetch('http://a/1', 60, MockOpener()), 'page')
+        self.assertEqual(cache.fetch('http://a/1', 60, opener), 'page')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_size=10)
+
+        with mock.patch('stockrank.scrapers.cache.timestamp',
+                        side_effect=range(100)):
+            cache.fetch('http://a/1', 60, MockOpener('x' * 4))
+            cache.fetch('http://a/2', 60, MockOpener('x' * 4))
+            # touch the first page, so the second is least recently used
+            cache.fetch('http://a/1', 60, MockOpener('x' * 4))
+            cache.fetch('http://a/3', 60, MockOpener('x' * 4))
+
+        opener = MockOpener()
+        cache.fetch('http://a/1', 1e12, opener)
+        cache.fetch('http://a/2', 1e12, opener)
+        self.assertEqual(len(opener.requests), 1)
+        self.assertNotIn('If-None-Match', opener.requests[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import configparser
+import csv
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.suite import synthetic_profiles
+from stockrank import columnar
+from stockrank.database import StockDatabase
+from stockrank.stock import StockProfile
+
+
+class ColumnarTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        config = configparser.ConfigParser()
+        config.read_dict({'Application': {
+            'database_path': os.path.join(self.workdir, 'stocks.db')}})
+        self.db = StockDatabase(config)
+        self.db.populate(synthetic_profiles(200) + [
+            StockProfile(symbol='NEW', title='Ünïcode Ltd', sector=None,
+                         market_cap=70000000)])
+        self.columns = self.db.get_ranked_columns()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_round_trip(self):
+        path = os.path.join(self.workdir, 'stocks.srk')
+        columnar.export(path, self.columns)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(8), columnar.MAGIC)
+
+        columns = columnar.read(path)
+        self.assertEqual(list(columns), list(columnar.COLUMNS))
+
+        for name, column in columns.items():
+            # every column is a view of the mapped file
+            self.assertIsInstance(column.base, np.memmap)
+            self.assertEqual(column.ctypes.data % 64, 0)
+
+            if name in columnar.RANK_FIELDS:
+                self.assertEqual(column.dtype, np.int64)
+                np.testing.assert_array_equal(column, self.columns[name])
+
+        # the table matches the ranking held in the database
+        table = columnar.load_table(path)
+        expected = self.db.get_ranked_profiles()
+        self.assertEqual([x.to_profile().to_string() for x in table],
+                         [x.to_string() for x in expected])
+        np.testing.assert_array_equal(table.earnings_yield,
+                                      self.columns['earnings_yield'])
+        # unfiltered, nothing is copied out of the read-only mapping
+        self.assertFalse(table.columns['cash'].flags.owndata)
+        self.assertFalse(table.columns['cash'].flags.writeable)
+        self.assertEqual(table[-1].title, 'Ünïcode Ltd')
+
+        top = columnar.load_table(path, 5, 'materials', 1000000000)
+        expected = self.db.get_ranked_profiles(5, 'materials', 1000000000)
+        self.assertEqual([x.symbol for x in top],
+                         [x.symbol for x in expected])
+
+        with open(path, 'r+b') as f:
+            f.write(b'NOTSTOCK')
+
+        with self.assertRaises(ValueError):
+            columnar.read(path)
+
+    def test_csv(self):
+        path = os.path.join(self.workdir, 'stocks.csv')
+        columnar.export(path, self.columns)
+
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertEqual(len(rows), 201)
+        self.assertEqual(rows[0]['rank'], '1')
+        self.assertEqual(rows[0]['symbol'], self.columns['symbol'][0])
+        self.assertEqual(rows[-1]['ebit'], '')
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'),
+                         'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        path = os.path.join(self.workdir, 'stocks.parquet')
+        columnar.export(path, self.columns)
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column_names, list(columnar.COLUMNS))
+        self.assertEqual(table.column('rank').to_pylist()[:3], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import configparser
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from stockrank.database import StockDatabase
+from stockrank.stock import StockProfile
+from stockrank.ranking import profile_ranks
+
+
+def _profile(symbol, ebit=1000000, roc=0.2):
+    return StockProfile(symbol=symbol, title=symbol + ' Ltd',
+                        sector='Materials', return_on_capital=roc, ebit=ebit,
+                        market_cap=60000000, total_debt=1000000,
+                        cash=2000000)
+
+
+class StockDatabaseTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({'Application': {'database_path': self.path}})
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_populate_upserts(self):
+        db = StockDatabase(self.config)
+        db.populate([_profile('AAA'), _profile('BBB')])
+        db.populate([_profile('BBB', ebit=5)])
+
+        stocks = {x.symbol: x for x in db.get_stock_profiles()}
+        self.assertEqual(sorted(stocks), ['AAA', 'BBB'])
+        self.assertEqual(stocks['AAA'].ebit, 1000000)
+        self.assertEqual(stocks['BBB'].ebit, 5)
+
+    def test_fresh_symbols(self):
+        db = StockDatabase(self.config)
+        db.populate([_profile('OLD')], fetched_at=1000)
+
+        with mock.patch('stockrank.database.timestamp', return_value=5000):
+            db.populate([_profile('NEW')])
+            self.assertEqual(db.fresh_symbols(3000), {'NEW'})
+            self.assertEqual(db.fresh_symbols(4000), {'NEW', 'OLD'})
+
+    def test_migrate_old_schema(self):
+        old = sqlite3.connect(self.path)
+        old.execute('CREATE TABLE stocks (symbol TEXT, title TEXT, '
+                    'sector TEXT, return_on_capital REAL, ebit REAL, '
+                    'market_cap INTEGER, total_debt INTEGER, cash INTEGER)')
+        old.execute("INSERT INTO stocks VALUES "
+                    "('AAA', 'A', 'Materials', 0.1, 1, 2, 3, 4)")
+        old.commit()
+        old.close()
+
+        db = StockDatabase(self.config)
+        db.populate([_profile('AAA', ebit=7)])
+
+        stocks = db.get_stock_profiles()
+        self.assertEqual(len(stocks), 1)
+        self.assertEqual(stocks[0].ebit, 7)
+
+    def test_resume_run(self):
+        db = StockDatabase(self.config)
+        run_id = db.start_run()
+        db.populate([_profile('AAA')], run_id=run_id)
+
+        # an interrupted run is continued, along with its journal
+        self.assertEqual(db.start_run(resume=True), run_id)
+        self.assertEqual(db.journaled_symbols(run_id), {'AAA'})
+
+        db.finish_run(run_id)
+        self.assertNotEqual(db.start_run(resume=True), run_id)
+
+    def test_snapshots(self):
+        db = StockDatabase(self.config)
+        day1 = [_profile('AAA'), _profile('BBB', ebit=9000000, roc=0.3)]
+        day2 = [_profile('AAA'), _profile('BBB', ebit=10, roc=0.3)]
+
+        db.save_snapshot(day1, *profile_ranks(day1),
+                         date=datetime.date(2016, 1, 1))
+        db.save_snapshot(day2, *profile_ranks(day2),
+                         date=datetime.date(2016, 1, 2))
+
+        # AAA didn't change, so only three distinct versions are stored
+        count = db._db.execute('SELECT count(*) FROM profile_versions')
+        self.assertEqual(count.fetchone()[0], 3)
+
+        ranked = db.ranking_as_of(datetime.date(2016, 1, 1))
+        self.assertEqual([x.symbol for x in ranked], ['BBB', 'AAA'])
+        ranked = db.ranking_as_of(datetime.date(2017, 1, 1))
+        self.assertEqual([x.symbol for x in ranked], ['AAA', 'BBB'])
+        self.assertEqual(ranked[1].ebit, 10)
+
+        self.assertEqual(db.rank_history('BBB'),
+                         [('2016-01-01', 1, 1, 1), ('2016-01-02', 2, 2, 1)])
+
+    def test_materialized_ranks(self):
+        rand = random.Random(3)
+        stocks = [StockProfile(symbol='S%d' % i, title='Stock %d' % i,
+                               sector=rand.choice(['Materials', 'Energy']),
+                               return_on_capital=rand.choice([0.1, 0.2, 0.3]),
+                               ebit=rand.randint(1, 5) * 1000000,
+                               market_cap=rand.randint(50, 60) * 1000000,
+                               total_debt=rand.randint(0, 3) * 1000000,
+                               cash=rand.randint(0, 3) * 1000000)
+                  for i in range(300)]
+        stocks.append(StockProfile(symbol='NONE', title='No Data',
+                                   sector='Energy'))
+
+        db = StockDatabase(self.config)
+        db.populate(stocks[:150])
+        db.populate(stocks[150:])
+
+        # the stored ranks, including ties, match those ranked in memory
+        expected = db.get_stock_table().ranked()
+        ranked = db.get_ranked_table()
+        self.assertEqual(list(ranked.symbol), list(expected.symbol))
+        self.assertEqual(ranked.symbol[-1], 'NONE')
+
+        top = db.get_ranked_table(10, 'energy', 55000000)
+        self.assertEqual(list(top.symbol),
+                         [x.symbol for x in expected
+                          if x.sector == 'Energy' and x.market_cap and
+                          x.market_cap >= 55000000][:10])
+
+        row = db._db.execute("SELECT * FROM stocks WHERE symbol = 'S0'")
+        row = row.fetchone()
+        self.assertEqual(row['enterprise_value'],
+                         stocks[0].market_cap + stocks[0].total_debt -
+                         stocks[0].cash)
+        self.assertAlmostEqual(row['earnings_yield'],
+                               stocks[0].earnings_yield)
+        self.assertEqual(row['score'],
+                         row['earnings_yield_rank'] + row['roc_rank'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import time
+import unittest
+import urllib.error
+from unittest import mock
+from stockrank.scrapers.executor import AdaptiveLimit, CircuitBreaker, \
+    RequestExecutor
+from stockrank.exceptions import CircuitOpenException, \
+    RequestFailedException
+
+URL = 'http://example.com/page'
+
+
+class ExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        # requests are neither rate limited nor kept waiting between retries
+        for name in ('rate_limiter', 'time.sleep'):
+            patcher = mock.patch('stockrank.scrapers.executor.' + name)
+            setattr(self, name.split('.')[-1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def _send(self, *results):
+        """Returns a mock sender returning (or raising) each result in turn.
+        """
+        return mock.Mock(side_effect=[
+            result if isinstance(result, Exception) else (result, {}, 'body')
+            for result in results])
+
+    def test_limit_increases_additively(self):
+        limit = AdaptiveLimit(initial=1, maximum=4)
+
+        for _ in range(3):
+            limit.acquire()
+            limit.release(0.1, False)
+
+        # +1 from 1, then +1/2 twice
+        self.assertEqual(limit.limit, 3.0)
+
+        for _ in range(10):
+            limit.acquire()
+            limit.release(0.1, False)
+
+        self.assertEqual(limit.limit, 4)
+
+    def test_limit_decreases_multiplicatively(self):
+        limit = AdaptiveLimit(initial=8)
+        limit.acquire()
+        limit.release(0.1, True)
+        self.assertEqual(limit.limit, 4)
+
+        # a response much slower than usual also counts as overload, but
+        # only once per round trip
+        limit.acquire()
+        limit.release(0.1, False)
+        limit._decreased_at = 0.0
+        limit.acquire()
+        limit.release(5.0, False)
+        self.assertEqual(limit.limit, 2.125)
+        limit.acquire()
+        limit.release(5.0, False)
+        self.assertEqual(limit.limit, 2.125)
+
+        limit = AdaptiveLimit(initial=1)
+        limit.acquire()
+        limit.release(0.1, True)
+        self.assertEqual(limit.limit, 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, reset_after=30.0)
+        breaker.record(False)
+        breaker.before('example.com')
+        breaker.record(False)
+
+        with self.assertRaises(CircuitOpenException):
+            breaker.before('example.com')
+
+        # after reset_after, a single trial request is let through
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 31):
+            trial = breaker.before('example.com')
+            self.assertTrue(trial)
+
+            # a request which was already in flight doesn't end the trial
+            breaker.record(False)
+
+            with self.assertRaises(CircuitOpenException):
+                breaker.before('example.com')
+
+            breaker.record(True, trial)
+            self.assertFalse(breaker.before('example.com'))
+
+    def test_retries_overloaded_requests(self):
+        executor = RequestExecutor(retries=3)
+        send = mock.Mock(side_effect=[
+            (429, {'Retry-After': '2'}, None),
+            (503, {}, None),
+            (200, {}, 'body')])
+
+        self.assertEqual(executor.execute(URL, send, {'a': 'b'}),
+                         (200, {}, 'body'))
+        send.assert_called_with(URL, {'a': 'b'})
+        self.assertEqual(send.call_count, 3)
+
+        # the server's Retry-After is honoured, otherwise the backoff is
+        # random, but within the first backoff window
+        self.assertEqual(self.sleep.call_args_list[0], mock.call(2.0))
+        self.assertLessEqual(self.sleep.call_args_list[1][0][0], 1.0)
+
+        limit, breaker = executor.host('example.com')
+        self.assertEqual(limit.in_flight, 0)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_client_errors_are_not_retried(self):
+        executor = RequestExecutor()
+        not_found = urllib.error.HTTPError(URL, 404, 'Not Found', {}, None)
+        send = self._send(not_found)
+
+        with self.assertRaises(urllib.error.HTTPError):
+            executor.execute(URL, send)
+
+        self.assertEqual(send.call_count, 1)
+        self.assertFalse(self.sleep.called)
+
+    def test_retries_exhausted(self):
+        executor = RequestExecutor(retries=2, failure_threshold=10)
+
+        with self.assertRaises(RequestFailedException):
+            executor.execute(URL, self._send(500, 500, 500))
+
+        # connection errors are raised as they are, for callers expecting them
+        offline = urllib.error.URLError('no network')
+
+        with self.assertRaises(urllib.error.URLError):
+            executor.execute(URL, self._send(offline, offline, offline))
+
+        self.assertEqual(self.sleep.call_count, 4)
+
+    def test_circuit_opens_after_failures(self):
+        executor = RequestExecutor(retries=4, failure_threshold=3)
+        send = self._send(*[500] * 5)
+
+        with self.assertRaises(RequestFailedException):
+            executor.execute(URL, send)
+
+        # later requests to the host fail straight away
+        send = self._send(200)
+
+        with self.assertRaises(CircuitOpenException):
+            executor.execute(URL, send)
+
+        self.assertFalse(send.called)
+
+        # other hosts are unaffected
+        send = self._send(200)
+        executor.execute('http://example.org/', send)
+        self.assertEqual(send.call_count, 1)
+
+    def test_trial_without_outcome(self):
+        executor = RequestExecutor(retries=0, failure_threshold=1,
+                                   reset_after=30.0)
+
+        with self.assertRaises(RequestFailedException):
+            executor.execute(URL, self._send(500))
+
+        # the trial raises something which isn't a network error
+        send = mock.Mock(side_effect=KeyError('not a network error'))
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 31):
+            with self.assertRaises(KeyError):
+                executor.execute(URL, send)
+
+            # which doesn't keep the circuit open for good
+            executor.execute(URL, self._send(200))
+            executor.execute(URL, self._send(200))
+
+
+if __name__ == '__main__':
+    unittest.main()
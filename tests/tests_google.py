@@ -0,0 +1,92 @@
+import io
+import json
+import unittest
+from unittest import mock
+from stockrank.scrapers.google import GoogleScraper
+from stockrank.scrapers.jsonstream import iter_array, fix_hex_escapes
+from stockrank.exceptions import FieldMissingException
+
+
+def _result(ticker, title, market_cap):
+    return {'ticker': ticker, 'title': title,
+            'columns': [{'field': 'MarketCap', 'value': market_cap},
+                        {'field': 'PE', 'value': '12.5'}]}
+
+
+# Google escapes some characters as '\xNN', which json.loads rejects
+PAYLOAD = json.dumps({
+    'original_query': '[currency == "AUD"]',
+    'num_company_results': '3',
+    'searchresults': [_result('PXS', 'Pharmaxis Ltd', '72.1M'),
+                      _result('BHP', 'BHP Billiton \\x26 Co', '60.2B'),
+                      _result('AAA', 'Escaped \\x26', '1,234')],
+}).replace('\\\\x26 Co', '\\x26 Co')
+
+
+class MockResponse(io.BytesIO):
+
+    def __init__(self, text):
+        super().__init__(text.encode('utf-8'))
+        self.status = 200
+        self.headers = {}
+
+
+class GoogleScraperTests(unittest.TestCase):
+
+    def test_scrape_stock_profiles(self):
+        with mock.patch('urllib.request.urlopen',
+                        return_value=MockResponse(PAYLOAD)):
+            stocks = list(GoogleScraper(50000000).scrape_stock_profiles())
+
+        self.assertEqual([x.symbol for x in stocks], ['PXS', 'BHP', 'AAA'])
+        self.assertEqual(stocks[0].market_cap, 72100000)
+        self.assertEqual(stocks[1].market_cap, 60200000000)
+        self.assertEqual(stocks[1].title, 'BHP Billiton & Co')
+        # an escaped backslash isn't an escape
+        self.assertEqual(stocks[2].title, 'Escaped \\x26')
+        self.assertEqual(stocks[2].market_cap, 1234)
+
+    def test_records(self):
+        response = MockResponse(PAYLOAD)
+
+        # the request is sent at once, but nothing is decoded until asked
+        with mock.patch('urllib.request.urlopen',
+                        return_value=response) as urlopen:
+            records = GoogleScraper(50000000).records()
+            self.assertTrue(urlopen.called)
+
+        self.assertEqual(response.tell(), 0)
+        self.assertEqual(next(records),
+                         ('PXS', {'title': 'Pharmaxis Ltd',
+                                  'market_cap': 72100000}))
+        self.assertEqual([symbol for symbol, _ in records], ['BHP', 'AAA'])
+        self.assertTrue(response.closed)
+
+    def test_missing_market_cap(self):
+        payload = json.dumps({'searchresults': [_result('PXS', 'P', '-')]})
+
+        with mock.patch('urllib.request.urlopen',
+                        return_value=MockResponse(payload)):
+            with self.assertRaises(FieldMissingException):
+                list(GoogleScraper(50000000).scrape_stock_profiles())
+
+    def test_chunk_boundaries(self):
+        expected = [x['title'] for x in iter_array(
+            io.StringIO(PAYLOAD), 'searchresults', fix_escapes=True)]
+
+        # values, escapes and numbers may all be split between chunks
+        for chunk_size in range(1, 20):
+            results = iter_array(io.StringIO(PAYLOAD), 'searchresults',
+                                 chunk_size, fix_escapes=True)
+            self.assertEqual([x['title'] for x in results], expected)
+
+        self.assertEqual(''.join(fix_hex_escapes(['a\\', 'x26\\\\', 'x'])),
+                         'a\\u0026\\\\x')
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            list(iter_array(io.StringIO('{"a": [1, 2]}'), 'searchresults'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from stockrank.helpers import parse_market_cap, parse_duration, \
+    rebase_url
+
+
+class HelpersTests(unittest.TestCase):
+
+    def test_parse_market_cap(self):
+        self.assertEqual(parse_market_cap('50M'), 50000000)
+        self.assertEqual(parse_market_cap('10B'), 10000000000)
+        self.assertEqual(parse_market_cap('4.35M'), 4350000)
+        self.assertEqual(parse_market_cap('1.2T'), 1200000000000)
+        self.assertEqual(parse_market_cap('750K'), 750000)
+        self.assertEqual(parse_market_cap('1,234.5M'), 1234500000)
+        self.assertEqual(parse_market_cap('65000000'), 65000000)
+
+        with self.assertRaises(ValueError):
+            parse_market_cap('-')
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('30d'), 30 * 86400)
+        self.assertEqual(parse_duration('12h'), 12 * 3600)
+        self.assertEqual(parse_duration('90'), 90)
+
+    def test_rebase_url(self):
+        url = 'https://www.asx.com.au/asx/companies.csv?a=1'
+        self.assertEqual(rebase_url(url, 'http://127.0.0.1:8081/'),
+                         'http://127.0.0.1:8081/asx/companies.csv?a=1')
+        self.assertEqual(rebase_url(url, None), url)
+
+
+if __name__ == '__main__':
+    unittest.main()
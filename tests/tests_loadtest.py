@@ -0,0 +1,111 @@
+import contextlib
+import io
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from benchmarks import loadtest
+from benchmarks.standin import StandInServer, synthetic_stocks
+from stockrank.exceptions import LoginFailedException
+from stockrank.scrapers.asx import AsxScraper
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.google import GoogleScraper
+from stockrank.scrapers.morningstar import MorningStarScraper
+from stockrank.scrapers.scraper import EXCLUDED_SECTORS
+
+
+class StandInServerTests(unittest.TestCase):
+
+    def _serve(self, **settings):
+        server = StandInServer(symbols=40, latency=0, **settings)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def _status(self, url):
+        try:
+            with urllib.request.urlopen(url) as response:
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers
+
+    def test_sources(self):
+        request_executor.reset()
+        server = self._serve()
+        stocks = synthetic_stocks(40)
+
+        google = GoogleScraper(1000000000, root=server.url).relation()
+        self.assertEqual(list(google), [stock.symbol for stock in stocks
+                                        if stock.market_cap >= 1000000000])
+
+        asx = AsxScraper(root=server.url).relation()
+        self.assertEqual(asx['AAC'], {'sector': stocks[2].sector})
+
+        scraper = MorningStarScraper('user', 'password', root=server.url)
+        scraper.login()
+        self.assertEqual(scraper.scrape_stock_profile('AAA').title,
+                         'Pharmaxis Ltd')
+        self.assertEqual(scraper.scrape_stock_profile('AAB').title,
+                         'The PAS Group Limited')
+
+        with self.assertRaises(LoginFailedException):
+            MorningStarScraper('user', 'wrong', root=server.url).login()
+
+        # members-only pages redirect to the login form without a login
+        with urllib.request.urlopen(
+                server.url + '/Stocks/BalanceSheet/AAA') as response:
+            self.assertIn('/Security/Login?ReturnUrl=', response.url)
+
+        self.assertEqual(server.stats()['balancesheet'], {200: 2, 302: 1})
+        self.assertEqual(server.stats()['login'], {200: 2, 302: 1})
+
+    def test_faults(self):
+        server = self._serve(throttle_rate=1, retry_after=7)
+        status, headers = self._status(server.url + '/finance')
+        self.assertEqual((status, headers['Retry-After']), (429, '7'))
+
+        # logins never fail
+        status, _ = self._status(server.url + '/Security/Login')
+        self.assertEqual(status, 200)
+
+        server = self._serve(rate_limit=0.01, burst=1)
+        self.assertEqual(self._status(server.url + '/finance')[0], 200)
+        status, headers = self._status(server.url + '/finance')
+        self.assertEqual(status, 429)
+        self.assertGreater(int(headers['Retry-After']), 1)
+
+
+class LoadTestTests(unittest.TestCase):
+
+    def test_run(self):
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            results = loadtest.run(symbols=40, workers=2,
+                                   requests_per_second=1000,
+                                   parse_processes=1, latency=0.001,
+                                   error_rate=0.05, seed=1)
+
+        expected = [stock for stock in synthetic_stocks(40, seed=1)
+                    if stock.market_cap >= 50000000 and
+                    not any(x in stock.sector for x in EXCLUDED_SECTORS)]
+
+        self.assertIsNone(results['error'])
+        self.assertEqual(results['stocks'], len(expected))
+        self.assertGreater(results['stocks_per_second'], 0)
+        self.assertEqual(results['failures'], 0)
+
+        # every 500 was retried
+        errors = sum(statuses.get(500, 0)
+                     for statuses in results['responses'].values())
+        self.assertEqual(results['retries'], errors)
+        self.assertEqual(results['requests'],
+                         2 * len(expected) + 2 + errors)
+
+        self.assertIn('%d stocks in' % len(expected),
+                      loadtest.report(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from stockrank.scrapers.merge import FIELD_PRECEDENCE, hash_join, collapse, \
+    merge_fields, merge_profile
+
+
+class MergeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.google = {'AAA': {'title': 'A Ltd', 'market_cap': 100},
+                       'BBB': {'title': 'B Ltd', 'market_cap': 200},
+                       'CCC': {'title': 'C Ltd', 'market_cap': 300}}
+        self.asx = {'CCC': {'sector': 'Energy'},
+                    'AAA': {'sector': 'Materials'},
+                    'ZZZ': {'sector': 'Energy'}}
+
+    def test_hash_join(self):
+        joined = list(hash_join([('google', self.google),
+                                 ('asx', self.asx)]))
+
+        # the first relation drives the join, and keeps its order
+        self.assertEqual([(symbol, missing) for symbol, _, missing in joined],
+                         [('AAA', None), ('BBB', 'asx'), ('CCC', None)])
+        self.assertEqual(joined[2][1], {'google': self.google['CCC'],
+                                        'asx': self.asx['CCC']})
+
+        # the driver may be a stream of (symbol, record) tuples
+        streamed = list(hash_join([('google', iter(self.google.items())),
+                                   ('asx', self.asx)]))
+        self.assertEqual(streamed, joined)
+
+    def test_precedence(self):
+        records = {'google': {'title': 'A Ltd', 'market_cap': 100},
+                   'asx': {'sector': 'Materials'},
+                   'morningstar': {'title': 'A Limited', 'market_cap': 90,
+                                   'ebit': 5, 'cash': None}}
+        fields = merge_fields(records)
+
+        self.assertEqual(fields['title'], 'A Ltd')
+        self.assertEqual(fields['market_cap'], 100)
+        self.assertEqual(fields['sector'], 'Materials')
+        self.assertEqual(fields['ebit'], 5)
+        self.assertIsNone(fields['cash'])
+
+        # a source without a value gives way to the next
+        del records['google']['market_cap']
+        self.assertEqual(merge_fields(records)['market_cap'], 90)
+
+    def test_collapse(self):
+        precedence = collapse(FIELD_PRECEDENCE, ['google', 'asx'], 'universe')
+
+        self.assertEqual(precedence['market_cap'],
+                         ('universe', 'morningstar'))
+        self.assertEqual(precedence['sector'], ('universe',))
+
+        stock = merge_profile('AAA', {
+            'universe': {'title': 'A Ltd', 'sector': 'Materials',
+                         'market_cap': 100},
+            'morningstar': {'title': 'A Limited', 'market_cap': 90,
+                            'ebit': 5}}, precedence)
+        self.assertEqual(stock.title, 'A Ltd')
+        self.assertEqual(stock.market_cap, 100)
+        self.assertEqual(stock.ebit, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import unittest
+from stockrank.metrics import Metrics
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_record_and_export(self):
+        metrics = Metrics()
+
+        with metrics.phase('rank'):
+            pass
+
+        metrics.increment('skipped', reason='delisted')
+        metrics.increment('skipped', reason='delisted')
+        metrics.request('http://example.com/a', 0.02, 100, 200)
+        metrics.request('http://example.com/b', 3.0, 50, 200)
+
+        self.assertEqual(metrics.counter('skipped', reason='delisted'), 2)
+        self.assertEqual(metrics.counter('bytes', host='example.com'), 150)
+
+        data = json.loads(metrics.to_json())
+        self.assertEqual(data['phases']['rank']['count'], 1)
+        histogram = data['histograms'][0]
+        self.assertEqual(histogram['host'], 'example.com')
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(histogram['buckets']['0.025'], 1)
+        self.assertEqual(histogram['buckets']['5.0'], 1)
+
+        text = metrics.to_prometheus()
+        self.assertIn('stockrank_skipped_total{reason="delisted"} 2', text)
+        self.assertIn('stockrank_request_seconds_bucket'
+                      '{host="example.com",le="0.025"} 1', text)
+        self.assertIn('stockrank_request_seconds_bucket'
+                      '{host="example.com",le="+Inf"} 2', text)
+        self.assertIn('stockrank_request_seconds_count'
+                      '{host="example.com"} 2', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,33 +1,58 @@
+import http.cookiejar
 import os
+import tempfile
 import unittest
 from unittest import mock
-from stockrank.scrapers.morningstar import MorningStarScraper
+from stockrank.exceptions import LoginFailedException, \
+    SessionExpiredException
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.morningstar import MorningStarScraper, \
+    parse_balancesheet, parse_historicals, LOGIN_URL
 
 
 class MockResponse(object):
     """A mock response returned by Session.get()
     """
-    def __init__(self, text):
+    def __init__(self, text, url='http://www.morningstar.com.au/'):
         self.text = text
+        self.content = text.encode('utf-8')
+        self.url = url
+        self.status_code = 200
+        self.headers = {}
 
 
 class MockSession(object):
     """Mock session object used to retrieve local html files for testing.
-    Functions used to connect to a remote server (mount(), post()) do nothing.
+    Functions used to connect to a remote server (mount(), post()) do nothing,
+    other than count logins. While 'expired' is set, pages redirect to the
+    login form.
     """
+    def __init__(self):
+        self.logins = 0
+        self.expired = False
+
     def mount(self, prefix, adapter):
         pass
 
     def post(self, url, data=None, json=None, **kwargs):
-        pass
+        self.logins += 1
+        self.expired = False
+
+        if data['Password'] != 'password':
+            return MockResponse('', url=LOGIN_URL)
+        return MockResponse('')
 
     def get(self, url, **kwargs):
+        if self.expired:
+            return MockResponse('', url=LOGIN_URL + '?ReturnUrl=x')
+
         if 'BalanceSheet' in url:
             filename = 'Pharmaxis Ltd - Balance Sheet.html'
         else:
             filename = 'Pharmaxis Ltd - Company Historicals.html'
 
-        filepath = os.path.join('test/assets', filename)
+        filepath = os.path.join(os.path.dirname(__file__), 'assets',
+                                filename)
 
         with open(filepath) as f:
             return MockResponse(f.read())
@@ -46,6 +71,14 @@ def get_mock_session():
 
 class MorningStarTests(unittest.TestCase):
 
+    def setUp(self):
+        request_executor.reset()
+
+        # requests aren't held up by the rate limit
+        patcher = mock.patch('stockrank.scrapers.executor.rate_limiter')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch('requests.session', get_mock_session())
     def test_scrape(self):
         scraper = MorningStarScraper('username', 'password')
@@ -59,5 +92,84 @@ class MorningStarTests(unittest.TestCase):
         self.assertEqual(stock.cash, 54138000)
         self.assertEqual(stock.earnings_yield, 0.7381091050281499)
 
+    def test_parse_all_years(self):
+        session = MockSession()
+        historicals = parse_historicals(session.get('CompanyHistoricals').text)
+        title, balancesheet = parse_balancesheet(
+            session.get('BalanceSheet').text)
+
+        self.assertEqual(title, 'Pharmaxis Ltd')
+        self.assertEqual(historicals['Market cap'], [43.0, 20.0, 69.0])
+        self.assertEqual(historicals['Return on capital'],
+                         [-52.0, -161.0, 36.0])
+        self.assertEqual(balancesheet['Cash'], [63943.0, 34182.0, 54138.0])
+        self.assertEqual(balancesheet['Total debt'], [10893.0])
+
+    def test_login(self):
+        session = MockSession()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+
+        with mock.patch('requests.session', return_value=session):
+            scraper = MorningStarScraper('username', 'password',
+                                         pool_size=2, cookie_path=path)
+            # the mock server sets no cookies, so add one as a login would
+            scraper._sessions.cookies.set_cookie(_cookie('auth'))
+            scraper.login()
+            self.assertEqual(session.logins, 0)
+
+            scraper = MorningStarScraper('username', 'password',
+                                         cookie_path=path)
+            scraper.login()
+            self.assertEqual(session.logins, 1)
+
+            # the login is saved with its cookies
+            scraper._sessions.cookies.set_cookie(_cookie('auth'))
+            scraper._sessions.save_cookies()
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            scraper = MorningStarScraper('username', 'password',
+                                         cookie_path=path)
+            scraper.login()
+            self.assertEqual(session.logins, 1)
+
+            # an expired login is noticed, and we log in again, through the
+            # executor but not while holding the page request's slot
+            session.expired = True
+            execute = request_executor.execute
+
+            def check_slot(url, send, *args):
+                if send == scraper._post:
+                    limit = request_executor.host('www.morningstar.com.au')[0]
+                    self.assertEqual(limit.in_flight, 0)
+                return execute(url, send, *args)
+
+            with mock.patch.object(request_executor, 'execute',
+                                   side_effect=check_slot) as executed:
+                stock = scraper.scrape_stock_profile('PXS')
+
+            self.assertEqual(stock.title, 'Pharmaxis Ltd')
+            self.assertEqual(session.logins, 2)
+            self.assertIn(scraper._post,
+                          [call[0][1] for call in executed.call_args_list])
+
+            with mock.patch.object(session, 'post',
+                                   return_value=MockResponse('')):
+                session.expired = True
+
+                with self.assertRaises(SessionExpiredException):
+                    scraper.fetch_pages('PXS')
+
+            with self.assertRaises(LoginFailedException):
+                MorningStarScraper('username', 'wrong').login()
+
+
+def _cookie(name):
+    return http.cookiejar.Cookie(
+        0, name, 'value', None, False, 'www.morningstar.com.au', False,
+        False, '/', True, False, None, False, None, None, {})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,64 @@
+import contextlib
+import io
+import os
+import unittest
+from stockrank.metrics import metrics
+from stockrank.scrapers.morningstar import parse_pages
+from stockrank.scrapers.pipeline import FetchParsePipeline
+
+ASSETS = os.path.join(os.path.dirname(__file__), 'assets')
+
+
+def _read(filename):
+    with open(os.path.join(ASSETS, filename)) as f:
+        return f.read()
+
+
+class FetchParsePipelineTests(unittest.TestCase):
+
+    def _run(self, pipeline, items):
+        return list(pipeline.run(items))
+
+    def test_run(self):
+        metrics.reset()
+        pipeline = FetchParsePipeline(lambda x: 'x' * x, len, fetch_workers=3,
+                                      parse_processes=2, queue_size=2)
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            results = self._run(pipeline, range(50))
+
+        self.assertEqual(sorted(results), [(x, x) for x in range(50)])
+
+        # throughput is recorded for the caller to report, not printed
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(metrics.counter('parsed'), 50)
+        self.assertGreater(metrics.counter('parse_seconds'), 0)
+
+    def test_parse_errors_are_yielded(self):
+        pipeline = FetchParsePipeline(str, int, parse_processes=1)
+        results = dict(self._run(pipeline, ['1', 'x']))
+        self.assertEqual(results['1'], 1)
+        self.assertIsInstance(results['x'], ValueError)
+
+    def test_fetch_errors_are_raised(self):
+        def fetch(item):
+            raise IOError('connection failed')
+
+        pipeline = FetchParsePipeline(fetch, len, parse_processes=1)
+        with self.assertRaises(IOError):
+            self._run(pipeline, [1, 2, 3])
+
+    def test_parse_morningstar_pages(self):
+        pages = (_read('Pharmaxis Ltd - Company Historicals.html'),
+                 _read('Pharmaxis Ltd - Balance Sheet.html'))
+        pipeline = FetchParsePipeline(lambda x: pages, parse_pages,
+                                      parse_processes=1)
+
+        [(_, fields)] = self._run(pipeline, ['PXS'])
+        self.assertEqual(fields, ('Pharmaxis Ltd', 0.36, 19010000, 69000000,
+                                  10893000, 54138000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import random
+import unittest
+from stockrank.stock import StockProfile
+from stockrank.stockrank import _rank_stocks
+from stockrank.helpers import sort_list_into_keys
+
+
+def _quadratic_rank(stock_profiles):
+    """The original list.index() based ranking, used as a reference.
+    """
+    by_earnings = [x.symbol for x in sorted(
+        stock_profiles, key=lambda x: x.earnings_yield, reverse=True)]
+    by_roc = [x.symbol for x in sorted(
+        stock_profiles, key=lambda x: x.return_on_capital, reverse=True)]
+
+    return sorted(stock_profiles,
+                  key=lambda x: (by_earnings.index(x.symbol) +
+                                 by_roc.index(x.symbol)))
+
+
+def _random_profile(rand, i):
+    return StockProfile(symbol='S%d' % i, title='Stock %d' % i,
+                        sector='Sector',
+                        return_on_capital=rand.choice([0.1, 0.2, 0.3]),
+                        ebit=rand.randint(1, 10) * 1000000,
+                        market_cap=rand.randint(50, 100) * 1000000,
+                        total_debt=rand.randint(0, 10) * 1000000,
+                        cash=rand.randint(0, 10) * 1000000)
+
+
+class RankingTests(unittest.TestCase):
+
+    def test_matches_reference(self):
+        rand = random.Random(1)
+        stocks = [_random_profile(rand, i) for i in range(500)]
+
+        expected = [x.symbol for x in _quadratic_rank(stocks)]
+        actual = [x.symbol for x in _rank_stocks(stocks)]
+        self.assertEqual(actual, expected)
+
+    def test_missing_fields_rank_last(self):
+        good = StockProfile(symbol='AAA', return_on_capital=0.6, ebit=60,
+                            market_cap=100, total_debt=0, cash=0)
+        no_roc = StockProfile(symbol='BBB', ebit=50, market_cap=100,
+                              total_debt=0, cash=0)
+        no_ebit = StockProfile(symbol='CCC', return_on_capital=0.5,
+                               market_cap=100, total_debt=0, cash=0)
+
+        ranked = _rank_stocks([no_roc, no_ebit, good])
+        self.assertEqual([x.symbol for x in ranked], ['AAA', 'BBB', 'CCC'])
+
+    def test_sort_list_into_keys(self):
+        stocks = [StockProfile(symbol='A', return_on_capital=0.1),
+                  StockProfile(symbol='B', return_on_capital=None),
+                  StockProfile(symbol='C', return_on_capital=0.3),
+                  StockProfile(symbol='D', return_on_capital=0.1)]
+
+        keys = sort_list_into_keys(stocks, 'symbol', 'return_on_capital')
+        self.assertEqual(keys, ['C', 'A', 'D', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import configparser
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from stockrank.database import StockDatabase
+from stockrank.server import RankedStocks, RankingServer
+from stockrank.stock import StockProfile
+
+
+def _profile(symbol, sector='Materials', roc=0.2, ebit=1000000):
+    return StockProfile(symbol=symbol, title=symbol + ' Ltd', sector=sector,
+                        return_on_capital=roc, ebit=ebit,
+                        market_cap=60000000, total_debt=1000000,
+                        cash=2000000)
+
+
+class RankingServerTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        config = configparser.ConfigParser()
+        config.read_dict({'Application': {'database_path': self.path}})
+
+        # the server reads through its own connection, as it would when
+        # another process downloads
+        self.writer = StockDatabase(config)
+        self.writer.populate([_profile('AAA', roc=0.1),
+                              _profile('BBB', roc=0.3, ebit=3000000),
+                              _profile('CCC', sector='Energy', roc=0.2,
+                                       ebit=2000000)])
+        self.config = config
+        self.db = StockDatabase(config)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_rebuilds_only_on_change(self):
+        stocks = RankedStocks(self.db)
+
+        self.assertEqual([x['symbol'] for x in stocks.top(2)],
+                         ['BBB', 'CCC'])
+        self.assertEqual(stocks.stock('ccc')['rank'], 2)
+        self.assertEqual([x['symbol'] for x in stocks.sector('materials', 5)],
+                         ['BBB', 'AAA'])
+        self.assertEqual(stocks.rebuilds, 1)
+
+        self.writer.populate([_profile('AAA', roc=0.9, ebit=9000000)])
+        self.assertEqual(stocks.top(1)[0]['symbol'], 'AAA')
+        self.assertEqual(stocks.rebuilds, 2)
+
+    def test_http(self):
+        started = threading.Event()
+        servers = []
+
+        def serve():
+            # sqlite connections belong to the thread which opened them
+            servers.append(RankingServer(('127.0.0.1', 0),
+                                         StockDatabase(self.config),
+                                         default_count=2))
+            started.set()
+            servers[0].serve_forever()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        started.wait()
+        server = servers[0]
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+        def get(path):
+            with urllib.request.urlopen(url + path) as response:
+                return json.loads(response.read().decode('utf-8'))
+
+        try:
+            self.assertEqual(len(get('/top')), 2)
+            self.assertEqual(len(get('/top?n=10')), 3)
+            self.assertEqual(get('/stocks/BBB')['earnings_yield_rank'], 1)
+            self.assertEqual(get('/sectors/Energy')[0]['symbol'], 'CCC')
+
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                get('/stocks/ZZZ')
+            self.assertEqual(context.exception.code, 404)
+
+            for n in ('-1', 'x'):
+                with self.assertRaises(urllib.error.HTTPError) as context:
+                    get('/sectors/Materials?n=' + n)
+                self.assertEqual(context.exception.code, 400)
+
+            # an unknown market cap is null, as JSON has no NaN
+            self.writer.populate([StockProfile(
+                symbol='DDD', title='DDD Ltd', sector='Energy',
+                return_on_capital=0.1, ebit=1000000, total_debt=0, cash=0)])
+            self.assertIsNone(get('/stocks/DDD')['market_cap'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from benchmarks.suite import import_time
+
+# modules which only downloading needs, and which take long to import
+SCRAPING_MODULES = {'requests', 'urllib3', 'ssl', 'lxml', 'bs4', 'numpy',
+                    'http.server'}
+
+# seconds 'import stockrank.main' may take, if set; typically a few tens of
+# milliseconds, and over 0.1s once NumPy or requests are imported. wall-clock
+# times vary too much between machines to check by default
+IMPORT_BUDGET = os.environ.get('STOCKRANK_IMPORT_BUDGET')
+
+
+class StartupTests(unittest.TestCase):
+
+    def test_import_time(self):
+        seconds, modules = import_time('stockrank.main')
+
+        self.assertEqual(modules & SCRAPING_MODULES, set())
+
+        if IMPORT_BUDGET:
+            self.assertLess(seconds, float(IMPORT_BUDGET))
+
+    def test_show_loads_no_scraping_modules(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config_path = os.path.join(directory, 'config.ini')
+
+        with open(config_path, 'w') as f:
+            f.write('[Application]\ndatabase_path = %s\n'
+                    % os.path.join(directory, 'stocks.db'))
+
+        script = ('import sys\n'
+                  'from stockrank.main import main\n'
+                  'sys.argv = ["stockrank", "--show", "--top", "30", '
+                  '"--config", %r]\n'
+                  'main()\n'
+                  'print(" ".join(sys.modules))\n' % config_path)
+        output = subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        modules = set(output.decode().splitlines()[-1].split())
+
+        self.assertIn('stockrank.database', modules)
+        self.assertEqual(modules & SCRAPING_MODULES, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+from benchmarks.suite import synthetic_profiles
+from stockrank import ranking
+from stockrank.stockrank import StockRank
+from stockrank.sweep import Screen, Universe, screens, sweep
+from stockrank.table import StockTable
+
+
+class SweepTests(unittest.TestCase):
+
+    def setUp(self):
+        self.table = StockTable.from_profiles(synthetic_profiles(2000))
+        self.universe = Universe.from_table(self.table)
+        self.screens = screens([None, 500000000, 2000000000],
+                               [(), ('Energy',), ('Materials', 'Health')],
+                               [(1, 1), (2, 1), (0, 1)])
+
+    def _expected(self, screen, count):
+        """Ranks the stocks passing a screen from scratch.
+        """
+        table = self.table
+        keep = np.array([not any(x in sector for x in screen.excluded_sectors)
+                         for sector in table.sector])
+
+        if screen.min_market_cap is not None:
+            keep &= table.market_cap >= screen.min_market_cap
+
+        indices = np.flatnonzero(keep)
+        score = screen.weights[0] * ranking.metric_ranks(
+            table.earnings_yield[indices]) + \
+            screen.weights[1] * ranking.metric_ranks(
+                table.return_on_capital[indices])
+        order = np.argsort(score, kind='stable')
+        return list(table.symbol[indices[order[:count]]])
+
+    def test_screens(self):
+        self.assertEqual(len(self.screens), 27)
+
+        for screen in self.screens:
+            self.assertEqual(list(self.universe.top(screen, 15)),
+                             self._expected(screen, 15))
+
+        # the magic formula, with no filters, is the usual ranking
+        screen = Screen(None, (), (1, 1))
+        order = self.table.ranks()[2]
+        self.assertEqual(list(self.universe.top(screen, 30)),
+                         list(self.table.symbol[order[:30]]))
+
+        # masks are shared by screens with the same filters
+        self.assertIs(self.universe.mask(self.screens[0]),
+                      self.universe.mask(self.screens[1]))
+
+        screen = Screen(10 ** 15, (), (1, 1))
+        self.assertEqual(len(self.universe.top(screen, 10)), 0)
+
+    def test_process_pool(self):
+        serial = sweep(self.universe, self.screens, 5)
+        parallel = sweep(self.universe, self.screens, 5, processes=2)
+        self.assertEqual([list(x) for x in serial],
+                         [list(x) for x in parallel])
+
+    def test_print_sweep(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        config_path = path + '.ini'
+        self.addCleanup(os.remove, config_path)
+
+        with open(config_path, 'w') as f:
+            f.write('[Application]\ndatabase_path = %s\n'
+                    '[Sweep]\nmarket_caps = 100M, 1B\n'
+                    'excluded_sectors = ; Energy, Materials\n'
+                    'weights = 1:1, 2:1\n' % path)
+
+        stockrank = StockRank(config_path)
+        stockrank._db.populate(synthetic_profiles(100))
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            stockrank.sweep(3)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2 + 8)
+        self.assertIn('Top 3', lines[0])
+        self.assertIn('$1,000M Energy,Materials', lines[-1])
+        self.assertEqual(len(lines[-1].split()), 4 + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
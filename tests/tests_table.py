@@ -0,0 +1,54 @@
+import random
+import unittest
+from stockrank.stock import StockProfile
+from stockrank.stockrank import _rank_stocks
+from stockrank.table import StockTable
+
+
+class StockTableTests(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(2)
+        self.stocks = [
+            StockProfile(symbol='S%d' % i, title='Stock %d' % i,
+                         sector=rand.choice(['Materials', 'Energy']),
+                         return_on_capital=rand.uniform(0, 1),
+                         ebit=rand.randint(1, 10) * 1000000,
+                         market_cap=rand.randint(50, 100) * 1000000,
+                         total_debt=rand.randint(0, 10) * 1000000,
+                         cash=rand.randint(0, 10) * 1000000)
+            for i in range(200)]
+        self.stocks.append(StockProfile(symbol='NONE', title='No Data',
+                                        sector='Energy'))
+
+    def test_rows(self):
+        table = StockTable.from_profiles(self.stocks)
+        self.assertEqual(len(table), len(self.stocks))
+
+        for stock, row in zip(self.stocks, table):
+            for field in StockProfile.__slots__:
+                self.assertEqual(getattr(row, field), getattr(stock, field))
+
+        self.assertEqual(table[0].earnings_yield,
+                         self.stocks[0].earnings_yield)
+        self.assertIsNone(table[-1].market_cap)
+
+        # sector strings are interned, so each is only stored once
+        energy = [x for x in table.sector if x == 'Energy']
+        self.assertTrue(all(x is energy[0] for x in energy))
+
+    def test_ranked_matches_rank_stocks(self):
+        table = StockTable.from_profiles(self.stocks).ranked()
+        expected = [x.symbol for x in _rank_stocks(self.stocks)]
+        self.assertEqual(list(table.symbol), expected)
+
+    def test_derived_columns_computed_once(self):
+        table = StockTable.from_profiles(self.stocks)
+        self.assertIs(table.earnings_yield, table.earnings_yield)
+        self.assertEqual(table[5].enterprise_value,
+                         self.stocks[5].market_cap +
+                         self.stocks[5].total_debt - self.stocks[5].cash)
+
+
+if __name__ == '__main__':
+    unittest.main()
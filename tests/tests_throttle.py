@@ -0,0 +1,38 @@
+import threading
+import time
+import unittest
+from stockrank.scrapers.throttle import TokenBucket, RateLimiter
+
+
+class ThrottleTests(unittest.TestCase):
+
+    def test_bucket_rate(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        start = time.monotonic()
+
+        for _ in range(6):
+            bucket.acquire()
+
+        # the first token is free; the other five are spaced 1/50s apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_bucket_shared_across_threads(self):
+        limiter = RateLimiter()
+        limiter.configure('example.com', rate=50, burst=1)
+        url = 'http://example.com/page'
+        start = time.monotonic()
+
+        threads = [threading.Thread(target=limiter.acquire, args=(url,))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertIs(limiter.bucket('example.com'),
+                      limiter.bucket('example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from benchmarks.standin import StandInServer, synthetic_stocks
+from stockrank.scrapers.executor import request_executor
+from stockrank.scrapers.scraper import EXCLUDED_SECTORS
+from stockrank.stockrank import StockRank
+from stockrank.workqueue import WorkQueue
+from stockrank.stock import StockProfile
+
+
+def _profile(symbol):
+    return StockProfile(symbol=symbol, title=symbol + ' Ltd',
+                        sector='Materials', market_cap=60000000)
+
+
+class WorkQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.queue = WorkQueue(self.path, lease_seconds=60, max_attempts=2)
+        self.queue.enqueue([_profile('AAA'), _profile('BBB'),
+                            _profile('CCC')])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _expire_leases(self):
+        self.queue._db.execute('UPDATE work_queue SET lease_expires = 0 '
+                               'WHERE state = ?', ('leased',))
+
+    def test_claim(self):
+        first = self.queue.claim('one', 2)
+        # a second worker, with its own connection, gets what's left
+        second = WorkQueue(self.path).claim('two', 2)
+
+        self.assertEqual([x.symbol for x in first], ['AAA', 'BBB'])
+        self.assertEqual([x.symbol for x in second], ['CCC'])
+        self.assertEqual(first[0].title, 'AAA Ltd')
+        self.assertEqual(first[0].market_cap, 60000000)
+        self.assertEqual(self.queue.claim('three', 2), [])
+
+    def test_expired_leases_are_retried(self):
+        self.queue.claim('one', 3)
+        self.queue.complete(['AAA'])
+        self._expire_leases()
+
+        retried = self.queue.claim('two', 3)
+        self.assertEqual(sorted(x.symbol for x in retried), ['BBB', 'CCC'])
+
+        # after max_attempts, a stock fails rather than being retried
+        self._expire_leases()
+        self.assertEqual(self.queue.claim('three', 3), [])
+
+        progress = self.queue.progress()
+        self.assertEqual(progress['done'], 1)
+        self.assertEqual(progress['failed'], 2)
+        self.assertEqual(progress['pending'], 0)
+
+    def test_complete_is_idempotent(self):
+        self.queue.claim('one', 1)
+        self.queue.complete(['AAA'])
+        self.queue.complete(['AAA'])
+
+        self.assertEqual(self.queue.progress()['done'], 1)
+        self.assertEqual(self.queue.outstanding(), 2)
+
+    def test_release(self):
+        self.queue.claim('one', 3)
+        self.assertEqual(self.queue.outstanding(exclude_worker='one'), 0)
+
+        self.queue.release('one')
+        self.assertEqual(self.queue.progress()['pending'], 3)
+
+        # a stock released on its last attempt isn't claimed again
+        self.queue.claim('one', 1)
+        self.queue.release('one')
+        progress = self.queue.progress()
+        self.assertEqual((progress['pending'], progress['failed']), (2, 1))
+        self.assertEqual([x.symbol for x in self.queue.claim('two', 3)],
+                         ['BBB', 'CCC'])
+
+    def test_claimed_waits_for_other_workers(self):
+        self.queue.claim('one', 1)
+        claimed = self.queue.claimed('two', 2, poll_interval=0)
+
+        def expire(seconds):
+            self.queue._db.execute('UPDATE work_queue SET lease_expires = 0 '
+                                   'WHERE lease_owner = ?', ('one',))
+
+        # once it has claimed everything else, 'two' waits for the lease held
+        # by 'one' to expire, and then takes it over
+        with mock.patch('time.sleep', side_effect=expire) as sleep:
+            symbols = [x.symbol for x in claimed]
+
+        self.assertEqual(symbols, ['BBB', 'CCC', 'AAA'])
+        self.assertTrue(sleep.called)
+
+
+class SharedDownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        request_executor.reset()
+
+        self.server = StandInServer(symbols=30, latency=0)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.expected = sorted(
+            stock.symbol for stock in synthetic_stocks(30)
+            if stock.market_cap >= 50000000 and
+            not any(x in stock.sector for x in EXCLUDED_SECTORS))
+
+    def _stockrank(self, name, credentials=True):
+        """Returns a StockRank with its own database, sharing a queue in
+        another.
+        """
+        config_path = os.path.join(self.workdir, name + '.ini')
+
+        with open(config_path, 'w') as f:
+            if credentials:
+                f.write('[Credentials]\nmorningstar_username = user\n'
+                        'morningstar_password = password\n')
+
+            f.write('[Application]\ndatabase_path = %s\n'
+                    '[WorkQueue]\npath = %s\npoll_seconds = 0\n'
+                    '[Scraper]\nrequests_per_second = 1000\nburst = 10\n'
+                    'parse_processes = 1\n'
+                    '[Sources]\ngoogle_url = %s\nasx_url = %s\n'
+                    'morningstar_url = %s\n'
+                    % (os.path.join(self.workdir, name + '.db'),
+                       os.path.join(self.workdir, 'queue.db'),
+                       self.server.url, self.server.url, self.server.url))
+
+        return StockRank(config_path)
+
+    def test_enqueue(self):
+        # listing the stocks needs no MorningStar login
+        with contextlib.redirect_stdout(io.StringIO()):
+            self._stockrank('coordinator', credentials=False).enqueue()
+
+        self.assertNotIn('login', self.server.stats())
+        queue = WorkQueue(os.path.join(self.workdir, 'queue.db'))
+        self.assertEqual(queue.progress()['pending'], len(self.expected))
+
+    def test_work(self):
+        coordinator = self._stockrank('coordinator')
+        worker = self._stockrank('worker')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            coordinator.enqueue()
+            worker.work()
+
+        # the worker stores its stocks in the queue's database, not its own,
+        # and leaves ranking them to the coordinator
+        self.assertEqual(worker._db.get_stock_profiles(), [])
+        queue = WorkQueue(os.path.join(self.workdir, 'queue.db'))
+        self.assertEqual(queue.progress()['done'], len(self.expected))
+        self.assertEqual(coordinator._db.get_stock_profiles(), [])
+
+        out = io.StringIO()
+
+        with contextlib.redirect_stdout(out):
+            coordinator.print_progress()
+
+        self.assertIn('ranked %d stocks' % len(self.expected), out.getvalue())
+        self.assertEqual(sorted(stock.symbol for stock
+                                in coordinator._db.get_stock_profiles()),
+                         self.expected)
+        self.assertTrue(coordinator._db.snapshot_ranks())
+
+
+if __name__ == '__main__':
+    unittest.main()